@@ -1,6 +1,10 @@
 '''Lightweight modbus control.'''
 
 # REVISION HISTORY
+# 17-Oct-2026
+#   Requests are pipelined (matched by Transaction ID within a configurable window), adjacent coil and
+#   register writes are merged into FC15/FC16 requests and bank reads are merged into as few reads as possible.
+#
 # 21-Jan-2018 
 #   Support for read-only unsigned 16-bit MODBUS registers (use Custom)
 #
@@ -57,10 +61,26 @@ local_event_SyncErrors = LocalEvent({'title': 'Sync errors', 'group': 'Status',
 
 local_event_ShowLog = LocalEvent({'title': 'Show log', 'order': 9998, 'group': 'Debug', 'schema': {'type': 'boolean'}})
 
+DEFAULT_WINDOW = 4 # requests in flight
+DEFAULT_READ_GAP = 0 # only adjacent or overlapping banks share a read
+
+param_transport = Parameter({'title': 'Transport', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+        'window': {'type': 'integer', 'title': 'Max. requests in flight', 'hint': str(DEFAULT_WINDOW), 'order': 1,
+                   'desc': 'Use 1 for gateways that can only handle one request at a time'},
+        'readGap': {'type': 'integer', 'title': 'Max. unused addresses between merged reads', 'hint': str(DEFAULT_READ_GAP), 'order': 2,
+                    'desc': 'Banks further apart are read separately; unmapped addresses are usually rejected by the device'}}}})
+
 # hold the list of poller functions
 pollers = list()
 
+# the coil and register ranges that are polled, (startAddr, count, onValues, pollGap)
+coilReads = list()
+registerReads = list()
+
 def main(arg = None):
+  global transport
+  transport = ModbusTransport((param_transport or {}).get('window') or DEFAULT_WINDOW)
+  
   tcp.setDest('%s:%s'% (param_ipAddress, TCP_PORT))
   
   # lookup the config based on the device
@@ -81,6 +101,57 @@ def main(arg = None):
     for info in param_registerBanks or []:
       bindRegisterBank(info)
     
+  # merge the banks into as few reads as possible
+  readGap = (param_transport or {}).get('readGap') or DEFAULT_READ_GAP
+  
+  for (startAddr, count, ranges) in planReads(coilReads, MAX_READ_COILS, readGap):
+    bindPoller(modbus_readCoils, startAddr, count, ranges)
+    
+  for (startAddr, count, ranges) in planReads(registerReads, MAX_READ_REGISTERS, readGap):
+    bindPoller(modbus_readRegisters, startAddr, count, ranges)
+    
+# how long to wait before retrying a read the device rejected
+READ_ERROR_BACKOFF = 5.0 # seconds
+
+def bindPoller(readFunc, startAddr, count, ranges):
+  # the fastest bank sets the pace of a merged read
+  pollGap = min([r[3] for r in ranges])
+  
+  def onResponse(seqNum, values):
+    for (rStartAddr, rCount, onValues, rPollGap) in ranges:
+      offset = rStartAddr - startAddr
+      onValues(values[offset:offset+rCount])
+    
+    call_safe(lambda: read(seqNum), pollGap)
+    
+  def onError(seqNum, code):
+    if len(ranges) > 1:
+      # a merged read was rejected, so split it back into its banks for good (incl. after reconnecting)
+      console.warn('Read of %s from address %s rejected (code %s); reading its %s banks separately' % (count, startAddr, code, len(ranges)))
+      
+      pollers.remove(read)
+      
+      for r in ranges:
+        bindPoller(readFunc, r[0], r[1], [r])(seqNum)
+      
+      return
+    
+    # keep the chain going but back off
+    call_safe(lambda: read(seqNum), max(pollGap, READ_ERROR_BACKOFF))
+    
+  def read(seqNum):
+    # chain next call (instead of locked timer)
+    if seqNum != sequence[0]:
+      # stop this chain
+      print '(connection %s ended)' % seqNum
+      return
+    
+    readFunc(startAddr, count, lambda values: onResponse(seqNum, values), lambda code: onError(seqNum, code))
+    
+  pollers.append(read)
+  
+  return read
+    
 def bindCoilBank(info):
   startAddr = info['startAddr']
   prefix = info['prefix']
@@ -95,23 +166,12 @@ def bindCoilBank(info):
     
   pollGap = 0.08 if readOnly else 2.0
 
-  def onBankResponse(seqNum, values):
+  def onBankValues(values):
     for (es, v) in zip(coilEvents, values):
       invert = safeGet(es[1].getArg(), 'invert', False)
       es[0].emitIfDifferent(v if not invert else not v)
     
-    call_safe(lambda: readBank(seqNum), pollGap)
-    
-  def readBank(seqNum):
-    # chain next call (instead of locked timer)
-    if seqNum != sequence[0]:
-      # stop this chain
-      print '(connection %s ended)' % seqNum
-      return
-    
-    modbus_readCoils(startAddr, count, lambda values: onBankResponse(seqNum, values))
-    
-  pollers.append(readBank)
+  coilReads.append((startAddr, count, onBankValues, pollGap))
   
 def bindCoil(prefix, index, addr, readOnly):
   event = Event('%s %s State' % (prefix, index), {'group': '"%s" coils\' states' % prefix, 'order': next_seq(), 'schema': {'type': 'boolean'}})
@@ -176,22 +236,11 @@ def bindRegisterBank(info):
     
   pollGap = 0.08 if readOnly else 2.0
 
-  def onRegisterResponse(seqNum, values):
+  def onBankValues(values):
     for (es, v) in zip(registerEvents, values):
       es[0].emitIfDifferent(v)
     
-    call_safe(lambda: readRegister(seqNum), pollGap)
-    
-  def readRegister(seqNum):
-    # chain next call (instead of locked timer)
-    if seqNum != sequence[0]:
-      # stop this chain
-      print '(connection %s ended)' % seqNum
-      return
-    
-    modbus_readRegisters(startAddr, count, lambda values: onRegisterResponse(seqNum, values))
-    
-  pollers.append(readRegister)
+  registerReads.append((startAddr, count, onBankValues, pollGap))
 
 def bindRegister(prefix, index, addr, readOnly):
   # 'readOnly' not used yet
@@ -216,7 +265,7 @@ def connected():
   # don't let commands rush through
 
   tcp.clearQueue()
-  queue.clearQueue()
+  transport.clear()
   
   # start all the poller
   seqNum = sequence[0]
@@ -251,7 +300,9 @@ def disconnected():
   
   # reset sequence (which will stop pollers)
   tcp.clearQueue()
-  queue.clearQueue()
+  transport.clear()
+  coilWrites.clear()
+  registerWrites.clear()
   
   newSeq = sequence[0] + 1
   sequence[0] = newSeq
@@ -271,12 +322,74 @@ tcp = TCP(connected=connected,
 def protocolTimeout():
   console.log('MODBUS timeout; flushing buffers and dropping TCP connection for good measure')
   tcp.drop()
-  queue.clearQueue()
+  transport.clear()
   del recvBuffer[:]
 
-# MODBUS using no delimeters within its binary protocol so must use a 
-# custom request queue
-queue = request_queue(timeout=protocolTimeout)
+# <!--- transport
+
+MODBUS_TIMEOUT = 5.0 # seconds
+UNIT_ID = 1
+
+class ModbusTransport:
+  '''Keeps up to 'window' requests in flight at once, matching responses by their Transaction ID'''
+  
+  def __init__(self, window):
+    self._window = max(1, window)
+    self._nextTID = next_seq() % 65536
+    
+    self._inFlight = {}     # by TID, e.g. { 147: (sentAt, onResponse) }
+    self._waiting = list()  # (pdu, onResponse) waiting for room in the window
+    
+  def request(self, pdu, onResponse):
+    self._waiting.append((pdu, onResponse))
+    self._pump()
+    
+  def _pump(self):
+    while len(self._waiting) > 0 and len(self._inFlight) < self._window:
+      (pdu, onResponse) = self._waiting.pop(0)
+      
+      tid = self._nextTID
+      self._nextTID = (tid + 1) % 65536
+      
+      self._inFlight[tid] = (system_clock(), onResponse)
+      
+      # MBAP header: TID, protocol (always 0), length (incl. unit), unit
+      tcp.send('%s\x00\x00%s%s%s' % (formatInt16(tid), formatInt16(len(pdu) + 1), chr(UNIT_ID), pdu))
+  
+  def handle(self, message):
+    tid = toInt16(message, 0)
+    
+    entry = self._inFlight.pop(tid, None)
+    if entry == None:
+      handleTIDMismatch(tid)
+      return
+    
+    entry[1](message)
+    
+    self._pump()
+    
+  def checkTimeouts(self):
+    now = system_clock()
+    
+    for (sentAt, onResponse) in self._inFlight.values():
+      if now - sentAt > MODBUS_TIMEOUT * 1000:
+        protocolTimeout()
+        return
+    
+  def clear(self):
+    self._inFlight.clear()
+    del self._waiting[:]
+
+# (created in main)
+transport = None
+
+def checkTimeouts():
+  if transport != None:
+    transport.checkTimeouts()
+
+timeout_timer = Timer(checkTimeouts, 1.0)
+
+# transport ---!>
 
 # the full receive buffer
 recvBuffer = list()
@@ -303,8 +416,8 @@ def processBuffer():
       message = ''.join(recvBuffer[:fullLen])
       del recvBuffer[:fullLen]
       
-      # and 'push' it back through the request queue handler
-      queue.handle(message)
+      # and 'push' it back through the transport which matches it up with its request
+      transport.handle(message)
       
       # might be more, so continue...
       
@@ -315,23 +428,37 @@ def processBuffer():
 READ_COILS = 1
 READ_REGISTERS = 3
 FORCE_COIL = 5
+FORCE_COILS = 15
+PRESET_REGISTERS = 16
+
+# protocol limits on quantities per request
+MAX_READ_COILS = 2000
+MAX_READ_REGISTERS = 125
+MAX_WRITE_COILS = 1968
+MAX_WRITE_REGISTERS = 123
 
-def handleModbusResponse(resp, expTid, count=0, onFuncResp=None):
+def handleModbusResponse(resp, count=0, onFuncResp=None, onFuncError=None):
   # Response example
   # (raw buffer): 0093 0000 0005 01 01 02 fd0f
   tID = toInt16(resp, 0)
-  if tID != expTid:
-    handleTIDMismatch(tID, expTid)
-    return
-
   protID = toInt16(resp, 2)
   length = toInt16(resp, 4)
     
   unit = ord(resp[6])
   modbus_func = ord(resp[7])
-  byteCount = ord(resp[8])
+
+  if modbus_func & 0x80:
+    # e.g. 0001 0000 0003 01 81 02
+    code = ord(resp[8])
+    console.warn('MODBUS exception response: tid:%s func:%s code:%s' % (tID, modbus_func & 0x7f, code))
+    
+    if onFuncError:
+      onFuncError(code)
+      
+    return
   
   if modbus_func == READ_COILS:
+    byteCount = ord(resp[8])
     bits = list()
     
     for i in range(byteCount):
@@ -349,7 +476,7 @@ def handleModbusResponse(resp, expTid, count=0, onFuncResp=None):
       onFuncResp(bits)
 
 
-  if modbus_func == READ_REGISTERS:
+  elif modbus_func == READ_REGISTERS:
     registers = list()
 
     # go through the 2-byte registers which
@@ -376,16 +503,23 @@ def handleModbusResponse(resp, expTid, count=0, onFuncResp=None):
       onFuncResp(state)
 
 
-def modbus_readCoils(startAddr=0, count=12, onFuncResp=None):
-  # Request example:
-  #      \x00\x93  \x00\x00  \x00\x06  \x01  \x01         \x00\x00     \x00\x0c                                      
-  #      tID2      protID2   length2   unit  modbus_func  start_addr2  count
-  (tid, protID, length, unitID, modbus_func) = (next_seq() % 65536, 0, 6, 1, READ_COILS)
-  
-  req = '%s%s%s%s%s%s%s' % (formatInt16(tid), formatInt16(protID), formatInt16(length),
-                            chr(unitID), chr(modbus_func), formatInt16(startAddr), formatInt16(count))
+  elif modbus_func in (FORCE_COILS, PRESET_REGISTERS):
+    # e.g. 0001 0000 0006 01 0f 0010 0003
+
+    if local_event_ShowLog.getArg():
+      print 'WRITE_MULTIPLE resp: tid:%s protID:%s len:%s unit:%s func:%s addr:%s count:%s' % (tID, protID, length, unit, modbus_func, toInt16(resp, 8), toInt16(resp, 10))
+
+    if onFuncResp:
+      onFuncResp()
+
+
+def modbus_readCoils(startAddr=0, count=12, onFuncResp=None, onFuncError=None):
+  # Request PDU example (MBAP header is added by the transport):
+  #      \x01         \x00\x00     \x00\x0c
+  #      modbus_func  start_addr2  count
+  req = '%s%s%s' % (chr(READ_COILS), formatInt16(startAddr), formatInt16(count))
   
-  queue.request(lambda: tcp.send(req), lambda resp: handleModbusResponse(resp, tid, count, onFuncResp=onFuncResp))
+  transport.request(req, lambda resp: handleModbusResponse(resp, count, onFuncResp=onFuncResp, onFuncError=onFuncError))
   
 Action('ReadCoils', lambda arg: modbus_readCoils(arg['startAddr'], arg['count']), 
        metadata={'group': 'Modbus', 'order': next_seq()+9000, 'schema': {'type': 'object', 'title': 'Params', 'properties': {
@@ -393,52 +527,157 @@ Action('ReadCoils', lambda arg: modbus_readCoils(arg['startAddr'], arg['count'])
         'count': {'type': 'integer', 'title': 'Count', 'order': 2}}}})
 
 
-def modbus_readRegisters(startAddr=0, count=12, onFuncResp=None):
-  # Request example (read 3 registers, from address 00:6B)
-  #      \x00\x93  \x00\x00  \x00\x06  \x01  \x03         \x00\x6b     \x00\x03
-  #      tID2      protID2   length2   unit  modbus_func  start_addr2  count
-  (tid, protID, length, unitID, modbus_func) = (next_seq() % 65536, 0, 6, 1, READ_REGISTERS)
+def modbus_readRegisters(startAddr=0, count=12, onFuncResp=None, onFuncError=None):
+  # Request PDU example (read 3 registers, from address 00:6B)
+  #      \x03         \x00\x6b     \x00\x03
+  #      modbus_func  start_addr2  count
+  req = '%s%s%s' % (chr(READ_REGISTERS), formatInt16(startAddr), formatInt16(count))
   
-  req = '%s%s%s%s%s%s%s' % (formatInt16(tid), formatInt16(protID), formatInt16(length),
-                            chr(unitID), chr(modbus_func), formatInt16(startAddr), formatInt16(count))
-  
-  queue.request(lambda: tcp.send(req), lambda resp: handleModbusResponse(resp, tid, count, onFuncResp=onFuncResp))
+  transport.request(req, lambda resp: handleModbusResponse(resp, count, onFuncResp=onFuncResp, onFuncError=onFuncError))
 
 Action('ReadRegisters', lambda arg: modbus_readRegisters(arg['startAddr'], arg['count']), 
        metadata={'group': 'Modbus', 'order': next_seq()+9000, 'schema': {'type': 'object', 'title': 'Params', 'properties': {
         'startAddr': {'type': 'integer', 'title': 'Start address', 'order': 1},
         'count': {'type': 'integer', 'title': 'Count', 'order': 2}}}})  
 
-def modbus_writeCoil(addr, state, onFuncResp=None):
-  # e.g 00 01     00 00     00 06     01    05           00 10     ff 00
-  #     tID2      protID2   length2   unit  modbus_func  addr      state
-  (tid, protID, length, unitID, modbus_func) = (next_seq() % 65536, 0, 6, 1, FORCE_COIL)
-  
-  if state == True:
-    value = '\xff\x00'
+class WriteCoalescer:
+  '''Merges writes to adjacent addresses made at the same moment into bulk requests'''
+
+  def __init__(self, maxRun, sendRun):
+    self._maxRun = maxRun
+    self._sendRun = sendRun # takes (startAddr, values, callbacks)
+
+    self._pending = {} # by address, e.g. { 16: (True, onFuncResp) }
+
+  def write(self, addr, value, onFuncResp):
+    if len(self._pending) == 0:
+      # flush after anything else currently being processed, e.g. a group of actions
+      call_safe(self.flush, 0)
+
+    # (a later write to the same address supersedes an earlier one, whose caller hears back with the later one)
+    superseded = self._pending.get(addr)
+    if superseded != None and superseded[1] != None:
+      onFuncResp = chainCallbacks(superseded[1], onFuncResp)
+
+    self._pending[addr] = (value, onFuncResp)
+
+  def clear(self):
+    # (e.g. on disconnect, so stale writes aren't sent after reconnecting)
+    self._pending.clear()
+
+  def flush(self):
+    writes = sorted(self._pending.items())
+    self._pending.clear()
+
+    run = list()
+
+    for (addr, (value, onFuncResp)) in writes:
+      if len(run) > 0 and (addr != run[-1][0] + 1 or len(run) >= self._maxRun):
+        self._flushRun(run)
+        run = list()
+
+      run.append((addr, value, onFuncResp))
+
+    if len(run) > 0:
+      self._flushRun(run)
+
+  def _flushRun(self, run):
+    self._sendRun(run[0][0], [value for (addr, value, onFuncResp) in run], [onFuncResp for (addr, value, onFuncResp) in run])
+
+def chainCallbacks(earlier, later):
+  def callBoth(*args):
+    earlier(*args)
+
+    if later:
+      later(*args)
+
+  return callBoth
+
+def sendCoilRun(startAddr, states, callbacks):
+  def onResponse(state=None):
+    for (s, onFuncResp) in zip(states, callbacks):
+      if onFuncResp:
+        onFuncResp(s)
+
+  if len(states) == 1:
+    # e.g  05           00 10     ff 00
+    #      modbus_func  addr      state
+    req = '%s%s%s' % (chr(FORCE_COIL), formatInt16(startAddr), '\xff\x00' if states[0] else '\x00\x00')
+
   else:
-    value = '\x00\x00'
-  
-  req = '%s%s%s%s%s%s%s' % (formatInt16(tid), formatInt16(protID), formatInt16(length),
-                            chr(unitID), chr(modbus_func), formatInt16(addr), value)
-  
-  queue.request(lambda: tcp.send(req), lambda resp: handleModbusResponse(resp, tid, onFuncResp=onFuncResp))
+    # e.g  0f           00 10     00 03     01          05
+    #      modbus_func  addr      count     byte count  states (LSB first)
+    packed = [0] * ((len(states) + 7) / 8)
+    for i, state in enumerate(states):
+      if state:
+        packed[i / 8] |= 1 << (i % 8)
+
+    req = '%s%s%s%s%s' % (chr(FORCE_COILS), formatInt16(startAddr), formatInt16(len(states)),
+                          chr(len(packed)), ''.join([chr(b) for b in packed]))
+
+  transport.request(req, lambda resp: handleModbusResponse(resp, onFuncResp=onResponse))
+
+def sendRegisterRun(startAddr, values, callbacks):
+  def onResponse():
+    for (v, onFuncResp) in zip(values, callbacks):
+      if onFuncResp:
+        onFuncResp(v)
+
+  # e.g  10           00 6b     00 02     04          00 0a 01 02
+  #      modbus_func  addr      count     byte count  values
+  req = '%s%s%s%s%s' % (chr(PRESET_REGISTERS), formatInt16(startAddr), formatInt16(len(values)),
+                        chr(len(values) * 2), ''.join([formatInt16(v) for v in values]))
+
+  transport.request(req, lambda resp: handleModbusResponse(resp, onFuncResp=onResponse))
+
+coilWrites = WriteCoalescer(MAX_WRITE_COILS, sendCoilRun)
+registerWrites = WriteCoalescer(MAX_WRITE_REGISTERS, sendRegisterRun)
+
+def modbus_writeCoil(addr, state, onFuncResp=None):
+  coilWrites.write(addr, state == True, onFuncResp)
 
 Action('WriteCoil', lambda arg: modbus_writeCoil(arg['addr'], arg['state']), 
        metadata={'group': 'Modbus', 'order': next_seq()+9000, 'schema': {'type': 'object', 'title': 'Params', 'properties': {
         'addr': {'type': 'integer', 'title': 'Start address', 'order': 1},
         'state': {'type': 'boolean', 'title': 'State', 'order': 2}}}})           
 
+def modbus_writeRegister(addr, value, onFuncResp=None):
+  registerWrites.write(addr, value % 65536, onFuncResp)
+
+Action('WriteRegister', lambda arg: modbus_writeRegister(arg['addr'], arg['value']),
+       metadata={'group': 'Modbus', 'order': next_seq()+9000, 'schema': {'type': 'object', 'title': 'Params', 'properties': {
+        'addr': {'type': 'integer', 'title': 'Address', 'order': 1},
+        'value': {'type': 'integer', 'title': 'Value', 'order': 2}}}})
+
+def planReads(ranges, maxCount, maxGap):
+  '''Merges (startAddr, count, ...) ranges into as few reads as possible, returns a list of (startAddr, count, ranges)'''
+  plans = list()
+
+  for r in sorted(ranges, key=lambda r: r[0]):
+    (startAddr, count) = (r[0], r[1])
+
+    if len(plans) > 0:
+      plan = plans[-1]
+      planEnd = plan[0] + plan[1]
+      newEnd = max(planEnd, startAddr + count)
+
+      if startAddr <= planEnd + maxGap and newEnd - plan[0] <= maxCount:
+        plan[1] = newEnd - plan[0]
+        plan[2].append(r)
+        continue
 
-def handleTIDMismatch(tid, expTID):
-  console.warn('Mismatched TID (modbus seqnum) detected; dropping connection and resyncing... tid=%s, expected=%s' % (tid, expTID))
+    plans.append([startAddr, count, [r]])
+
+  return [tuple(plan) for plan in plans]
+
+def handleTIDMismatch(tid):
+  # (e.g. a late response to a request that already timed out, so nothing to resync)
+  console.warn('Unexpected TID (modbus seqnum) detected; ignoring response... tid=%s' % tid)
   
   arg = local_event_SyncErrors.getArg() or {'count': 0}
   arg['count'] = int(arg.get('count') or 0) + 1
   arg['last'] = str(date_now())
   local_event_SyncErrors.emit(arg)
-                                     
-  tcp.drop()
 		
 # convenience functions ----
 
@@ -18,6 +18,18 @@ param_FeedbackFilters = Parameter({'title': 'Console Feedback filters', 'schema'
                                      'type': {'type': 'string', 'enum': ['Include', 'Exclude'], 'order': 1},
                                      'filter': {'type': 'string', 'order': 2}}}}})
 
+param_Supervisor = Parameter({'title': 'Supervisor', 'desc': 'Restart backoff after interruptions, crash-loop detection and (Linux) resource sampling', 'schema': {'type': 'object', 'properties': {
+                                'backoffMin': {'title': 'Restart backoff min. (s)', 'type': 'integer', 'hint': '2', 'order': 1},
+                                'backoffMax': {'title': 'Restart backoff max. (s)', 'type': 'integer', 'hint': '300', 'order': 2},
+                                'crashLoopCount': {'title': 'Crash-loop interruptions', 'type': 'integer', 'hint': '5', 'order': 3},
+                                'crashLoopWindow': {'title': 'Crash-loop window (mins)', 'type': 'integer', 'hint': '10', 'order': 4},
+                                'sampleInterval': {'title': 'Resource sample interval (s)', 'type': 'integer', 'hint': '15 (0 to disable)', 'order': 5}}}})
+
+param_FeedbackConsole = Parameter({'title': 'Console Feedback limits', 'desc': 'Rate limit on feedback written to the console and how many recent lines are kept', 'schema': {'type': 'object', 'properties': {
+                                     'rate': {'title': 'Max. lines per sec', 'type': 'integer', 'hint': '20', 'order': 1},
+                                     'burst': {'title': 'Burst', 'type': 'integer', 'hint': '100', 'order': 2},
+                                     'recentLines': {'title': 'Recent lines kept', 'type': 'integer', 'hint': '500', 'order': 3}}}})
+
 # --->
 
 
@@ -175,6 +187,7 @@ local_event_PowerOff = LocalEvent({ 'group': 'Power', 'title': 'Off', 'order': n
 def Power(arg):
   # clear the first interrupted
   local_event_FirstInterrupted.emit('')
+  clearInterruptions()
   
   if arg == 'On':
     local_event_DesiredPower.emit('On')
@@ -217,17 +230,158 @@ def bindPower():
 # --- power>
 
 
+# <feedback ---
+
+# Each line of the application's output goes through the filters (compiled once), is kept in a short history and
+# is then written to the console, rate-limited so a chatty application cannot swamp it.
+
+import re
+from collections import deque
+
+DEFAULT_CONSOLERATE = 20  # lines per second
+DEFAULT_CONSOLEBURST = 100
+DEFAULT_RECENTLINES = 500
+
+local_event_FeedbackStats = LocalEvent({'group': 'Monitoring', 'order': next_seq(), 'desc': 'Application output line counts (every minute)', 'schema': {'type': 'object', 'properties': {
+                                          'lines': {'type': 'integer', 'order': 1},
+                                          'filtered': {'type': 'integer', 'title': 'Filtered out', 'order': 2},
+                                          'suppressed': {'type': 'integer', 'title': 'Suppressed (rate limit)', 'order': 3}}}})
+
+class FeedbackFilter:
+  '''Include / Exclude substring filters, each kind combined into a single pattern'''
+
+  def __init__(self, filters):
+    self._filters = [ (f.get('type'), f.get('filter')) for f in filters if f.get('type') in ('Include', 'Exclude') and f.get('filter') != None ]
+
+    self._include = self._compile('Include')
+    self._exclude = self._compile('Exclude')
+
+  def _compile(self, filterType):
+    substrings = [ ffilter for (t, ffilter) in self._filters if t == filterType ]
+    if len(substrings) == 0:
+      return None
+
+    return re.compile('|'.join([ re.escape(s) for s in substrings ]))
+
+  def keep(self, line):
+    included = self._include != None and self._include.search(line) != None
+    excluded = self._exclude != None and self._exclude.search(line) != None
+
+    if included and excluded:
+      # (rare) the last matching filter wins
+      keep = None
+      for filterType, ffilter in self._filters:
+        if ffilter in line:
+          keep = filterType == 'Include'
+      return keep
+
+    if excluded:
+      return False
+
+    if included:
+      return True
+
+    # with no Include filters in use, lines are kept by default
+    return self._include == None
+
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self._rate = float(rate) / 1000 # tokens per millisecond
+    self._burst = burst
+    self._tokens = float(burst)
+    self._last = system_clock()
+
+  def take(self):
+    now = system_clock()
+    self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+    self._last = now
+
+    if self._tokens < 1:
+      return False
+
+    self._tokens -= 1
+    return True
+
+_feedbackFilter = None # (compiled before main)
+_consoleBucket = None
+_recentLines = None
+
+_feedbackStats = { 'lines': 0, 'filtered': 0, 'suppressed': 0 }
+_pendingSuppressed = [0] # since last reported
+
+@before_main
+def initFeedback():
+  global _feedbackFilter, _consoleBucket, _recentLines
+
+  limits = param_FeedbackConsole or {}
+
+  _feedbackFilter = FeedbackFilter(param_FeedbackFilters or [])
+  _consoleBucket = TokenBucket(limits.get('rate') or DEFAULT_CONSOLERATE, limits.get('burst') or DEFAULT_CONSOLEBURST)
+  _recentLines = deque(maxlen=limits.get('recentLines') or DEFAULT_RECENTLINES)
+
+# print out feedback from the console  
+def process_feedback(line):
+  _feedbackStats['lines'] += 1
+  _recentLines.append(line)
+
+  if not _feedbackFilter.keep(line):
+    _feedbackStats['filtered'] += 1
+    return
+
+  if not _consoleBucket.take():
+    _feedbackStats['suppressed'] += 1
+    _pendingSuppressed[0] += 1
+    return
+
+  reportSuppressed()
+
+  console.info('feedback> [%s]' % line)
+
+def reportSuppressed():
+  suppressed = _pendingSuppressed[0]
+  if suppressed > 0:
+    _pendingSuppressed[0] = 0
+    console.warn('feedback> (%s line%s suppressed, see "Recent Feedback")' % (suppressed, '' if suppressed == 1 else 's'))
+
+# (in case the application goes quiet while suppressing)
+timer_reportSuppressed = Timer(reportSuppressed, 5)
+
+def emitFeedbackStats():
+  local_event_FeedbackStats.emit(dict(_feedbackStats))
+
+  for key in _feedbackStats:
+    _feedbackStats[key] = 0
+
+timer_feedbackStats = Timer(emitFeedbackStats, 60, 60)
+
+@local_action({'group': 'Monitoring', 'title': 'Recent Feedback', 'order': next_seq(), 'desc': 'Dumps the most recent application output (unfiltered) to the console',
+               'schema': {'type': 'integer', 'title': 'Lines', 'hint': '(all kept)'}})
+def RecentFeedback(arg):
+  lines = list(_recentLines)
+  if arg:
+    lines = lines[-arg:]
+
+  console.info('RECENT FEEDBACK (%s lines)\n%s' % (len(lines), '\n'.join(lines)))
+
+# --- feedback>
+
+
 # <process ---
 
 def process_started():
   console.info('application started!')
+  now = date_now()
+  onSupervisedStart(now.getMillis())
   local_event_Running.emit('On')
-  local_event_LastStarted.emit(str(date_now()))
+  local_event_LastStarted.emit(str(now))
   
 def process_stopped(exitCode):
   console.info('application stopped! exitCode:%s' % exitCode)
   
-  nowStr = str(date_now()) # so exact timestamps are used
+  now = date_now()
+  nowStr = str(now) # so exact timestamps are used
+
+  resetSampling()
   
   if local_event_DesiredPower.getArg() == 'On':
     local_event_LastInterrupted.emit(nowStr)
@@ -235,41 +389,10 @@ def process_stopped(exitCode):
     # timestamp 'first interrupted' ONCE
     if len(local_event_FirstInterrupted.getArg() or '') == 0:
       local_event_FirstInterrupted.emit(nowStr)
-  
-  local_event_Running.emit('Off')
-
-# print out feedback from the console  
-def process_feedback(line):
-  inclusionFiltering = False
-  
-  keep = None
-    
-  for filterInfo in param_FeedbackFilters or []:
-    filterType = filterInfo.get('type')
-    ffilter = filterInfo.get('filter')
-    matches = ffilter in line
-      
-    if filterType == 'Include':
-      inclusionFiltering = True
-      if matches:
-        keep = True
-          
-    elif filterType == 'Exclude':
-      if matches:
-        keep = False
 
-        
-  if keep == None: # (not True or False)
-    if not inclusionFiltering:
-      # there are no Include filters in use so 'keep' defaults to True
-      keep = True
-      
-    else:
-      keep = False
+    onSupervisedInterruption(now.getMillis())
   
-  if keep:
-    console.info('feedback> [%s]' % line)
-    
+  local_event_Running.emit('Off')
 
 _process = Process(None,
                   started=process_started,
@@ -281,6 +404,239 @@ _process = Process(None,
 # --->
 
 
+# <supervisor ---
+
+# Interruptions are kept as epoch millis (the date signals are only parsed once, on start). Each interruption pushes
+# the next restart out exponentially (with jitter) until the application has stayed up for a while, and too many
+# within a sliding window is treated as a crash-loop.
+
+import random
+
+DEFAULT_BACKOFFMIN = 2      # seconds
+DEFAULT_BACKOFFMAX = 300
+DEFAULT_CRASHLOOPCOUNT = 5
+DEFAULT_CRASHLOOPWINDOW = 10 # minutes
+DEFAULT_SAMPLEINTERVAL = 15 # seconds
+
+BACKOFF_JITTER = 0.2        # +/- 20%
+STABLE_RUN = 60 * 1000      # a run at least this long resets the backoff (millis)
+
+local_event_RestartBackoff = LocalEvent({'group': 'Monitoring', 'order': next_seq(), 'schema': {'type': 'number'},
+                                         'desc': 'The delay (seconds) before the application is restarted after its last interruption'})
+
+local_event_CrashLoop = LocalEvent({'group': 'Monitoring', 'order': next_seq(), 'schema': {'type': 'boolean'},
+                                    'desc': 'Too many interruptions within the crash-loop window'})
+
+_supervisor = { 'firstInterrupted': None, # (millis)
+                'lastInterrupted': None,
+                'lastStarted': None,
+                'attempts': 0,
+                'restartSeq': 0 }          # cancels any pending restart
+
+_recentInterruptions = deque() # (millis), within the crash-loop window
+
+def supervisorParam(name, default):
+  return (param_Supervisor or EMPTY).get(name) or default
+
+@before_main
+def initSupervisor():
+  # only place the persisted dates are parsed
+  for key, signal in [ ('firstInterrupted', local_event_FirstInterrupted), ('lastInterrupted', local_event_LastInterrupted) ]:
+    if not is_blank(signal.getArg()):
+      _supervisor[key] = date_parse(signal.getArg()).getMillis()
+
+def clearInterruptions():
+  _supervisor['firstInterrupted'] = None
+  _supervisor['attempts'] = 0
+  _supervisor['restartSeq'] += 1
+
+  _recentInterruptions.clear()
+  local_event_CrashLoop.emit(False)
+
+def onSupervisedStart(nowMillis):
+  _supervisor['lastStarted'] = nowMillis
+
+def onSupervisedInterruption(nowMillis):
+  _supervisor['lastInterrupted'] = nowMillis
+  if _supervisor['firstInterrupted'] == None:
+    _supervisor['firstInterrupted'] = nowMillis
+
+  # sliding window
+  _recentInterruptions.append(nowMillis)
+  trimInterruptions(nowMillis)
+  local_event_CrashLoop.emit(len(_recentInterruptions) >= supervisorParam('crashLoopCount', DEFAULT_CRASHLOOPCOUNT))
+
+  # exponential backoff, reset after a stable run
+  lastStarted = _supervisor['lastStarted']
+  if lastStarted != None and nowMillis - lastStarted >= STABLE_RUN:
+    _supervisor['attempts'] = 0
+
+  backoffMin = supervisorParam('backoffMin', DEFAULT_BACKOFFMIN)
+  backoffMax = supervisorParam('backoffMax', DEFAULT_BACKOFFMAX)
+
+  delay = min(backoffMax, backoffMin * (2 ** min(_supervisor['attempts'], 16)))
+  delay = round(delay * (1 + BACKOFF_JITTER * (2 * random.random() - 1)), 1)
+
+  _supervisor['attempts'] += 1
+
+  local_event_RestartBackoff.emit(delay)
+
+  # take over from the process manager's own restart
+  _process.stop()
+
+  _supervisor['restartSeq'] += 1
+  restartSeq = _supervisor['restartSeq']
+
+  def restart():
+    if restartSeq != _supervisor['restartSeq'] or local_event_DesiredPower.getArg() != 'On':
+      return
+
+    console.info('(restarting application after %ss backoff)' % delay)
+    _process.start()
+
+  console.info('application will be restarted in %ss (interruption %s in a row)' % (delay, _supervisor['attempts']))
+  call_safe(restart, delay)
+
+def trimInterruptions(nowMillis):
+  windowStart = nowMillis - supervisorParam('crashLoopWindow', DEFAULT_CRASHLOOPWINDOW) * 60000
+
+  while len(_recentInterruptions) > 0 and _recentInterruptions[0] < windowStart:
+    _recentInterruptions.popleft()
+
+def isCrashLooping(nowMillis):
+  trimInterruptions(nowMillis)
+
+  crashLooping = len(_recentInterruptions) >= supervisorParam('crashLoopCount', DEFAULT_CRASHLOOPCOUNT)
+  local_event_CrashLoop.emitIfDifferent(crashLooping)
+
+  return crashLooping
+
+
+# resource sampling (Linux only, reads /proc)
+
+CLK_TCK = 100 # (USER_HZ, effectively fixed on Linux)
+RSS_TREND_SAMPLES = 20
+
+local_event_ProcessResources = LocalEvent({'group': 'Monitoring', 'order': next_seq(), 'desc': 'Resource use of the application process (Linux only)', 'schema': {'type': 'object', 'properties': {
+                                             'pid': {'type': 'integer', 'order': 1},
+                                             'rss': {'type': 'integer', 'title': 'RSS (kB)', 'order': 2},
+                                             'rssTrend': {'type': 'integer', 'title': 'RSS trend (kB/min)', 'order': 3},
+                                             'cpu': {'type': 'number', 'title': 'CPU (%)', 'order': 4},
+                                             'cpuTicks': {'type': 'integer', 'title': 'CPU ticks (total)', 'order': 5},
+                                             'threads': {'type': 'integer', 'order': 6},
+                                             'fds': {'type': 'integer', 'title': 'File descriptors', 'order': 7}}}})
+
+_sampling = { 'pid': None,
+              'lastTicks': None,
+              'lastMillis': None }
+
+_rssTrend = deque(maxlen=RSS_TREND_SAMPLES) # (millis, rss kB)
+
+def readProcFile(path):
+  f = open(path)
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def readProcStat(pid):
+  # e.g. "1234 (my app) S 1200 ... utime stime ... num_threads ..." (the name can contain spaces and brackets)
+  stat = readProcFile('/proc/%s/stat' % pid)
+  fields = stat[stat.rfind(')')+2:].split()
+
+  # (fields now starts at "state", i.e. field 3)
+  return { 'ppid': int(fields[1]),
+           'ticks': int(fields[11]) + int(fields[12]), # utime + stime
+           'threads': int(fields[17]) }
+
+def readRSS(pid):
+  for line in readProcFile('/proc/%s/status' % pid).splitlines():
+    if line.startswith('VmRSS:'):
+      return int(line.split()[1]) # (kB)
+
+  return None
+
+def findAppPid():
+  # the application is a direct child of this (Nodel host) process
+  ownPid = int(readProcFile('/proc/self/stat').split()[0])
+  appName = os.path.basename(_resolvedAppPath or '')
+
+  for name in os.listdir('/proc'):
+    if not name.isdigit():
+      continue
+
+    try:
+      if readProcStat(name)['ppid'] != ownPid:
+        continue
+
+      argv0 = readProcFile('/proc/%s/cmdline' % name).split('\x00')[0]
+      if argv0 == _resolvedAppPath or os.path.basename(argv0) == appName:
+        return int(name)
+
+    except (IOError, OSError, ValueError, IndexError):
+      # (process came and went)
+      pass
+
+  return None
+
+def resetSampling():
+  _sampling['pid'] = _sampling['lastTicks'] = _sampling['lastMillis'] = None
+  _rssTrend.clear()
+
+def sampleResources():
+  if local_event_Running.getArg() != 'On':
+    return
+
+  if _sampling['pid'] == None:
+    _sampling['pid'] = findAppPid()
+
+    if _sampling['pid'] == None:
+      return
+
+  pid = _sampling['pid']
+  nowMillis = system_clock()
+
+  try:
+    stat = readProcStat(pid)
+    rss = readRSS(pid)
+    fds = len(os.listdir('/proc/%s/fd' % pid))
+
+  except (IOError, OSError, ValueError, IndexError):
+    # gone or restarted, look up again next time
+    resetSampling()
+    return
+
+  cpu = None
+  if _sampling['lastTicks'] != None and nowMillis > _sampling['lastMillis']:
+    cpu = round(100.0 * (stat['ticks'] - _sampling['lastTicks']) / CLK_TCK / ((nowMillis - _sampling['lastMillis']) / 1000.0), 1)
+
+  _sampling['lastTicks'] = stat['ticks']
+  _sampling['lastMillis'] = nowMillis
+
+  rssTrend = None
+  if rss != None:
+    _rssTrend.append((nowMillis, rss))
+
+    (firstMillis, firstRSS) = _rssTrend[0]
+    if nowMillis - firstMillis >= 60000:
+      rssTrend = int((rss - firstRSS) * 60000 / (nowMillis - firstMillis))
+
+  local_event_ProcessResources.emit({ 'pid': pid, 'rss': rss, 'rssTrend': rssTrend, 'cpu': cpu,
+                                      'cpuTicks': stat['ticks'], 'threads': stat['threads'], 'fds': fds })
+
+timer_sampleResources = Timer(sampleResources, DEFAULT_SAMPLEINTERVAL, DEFAULT_SAMPLEINTERVAL, stopped=True)
+
+@after_main
+def initSampling():
+  if (param_Supervisor or EMPTY).get('sampleInterval') == 0 or not os.path.isdir('/proc/self'):
+    return
+
+  timer_sampleResources.setInterval(supervisorParam('sampleInterval', DEFAULT_SAMPLEINTERVAL))
+  timer_sampleResources.start()
+
+# --->
+
+
 # <status ---
 
 local_event_Status = LocalEvent({'order': -100, 'group': 'Status', 'schema': {'type': 'object', 'properties': {
@@ -289,16 +645,18 @@ local_event_Status = LocalEvent({'order': -100, 'group': 'Status', 'schema': {'t
 
 def statusCheck():
   # recently interrupted
-  now = date_now()
-  nowMillis = now.getMillis()
+  nowMillis = date_now().getMillis()
   
   # check for recent interruption within the last 4 days (to incl. long weekends)
-  firstInterrupted = date_parse(local_event_FirstInterrupted.getArg() or '1960')
-  firstInterruptedDiff = nowMillis - firstInterrupted.getMillis()
+  firstInterrupted = _supervisor['firstInterrupted']
+  lastInterrupted = _supervisor['lastInterrupted']
 
-  lastInterrupted = date_parse(local_event_LastInterrupted.getArg() or '1960')
+  if isCrashLooping(nowMillis):
+    local_event_Status.emit({'level': 2, 'message': 'Application is crash-looping (%s interruptions within %s mins, last time %s, next restart in up to %ss)' % 
+                                                     (len(_recentInterruptions), supervisorParam('crashLoopWindow', DEFAULT_CRASHLOOPWINDOW),
+                                                      toBriefTime(lastInterrupted), local_event_RestartBackoff.getArg())})
   
-  if firstInterruptedDiff < 4*24*3600*1000L: # (4 days)
+  elif firstInterrupted != None and nowMillis - firstInterrupted < 4*24*3600*1000L: # (4 days)
     if firstInterrupted == lastInterrupted:
       timeMsgs = 'last time %s' % toBriefTime(lastInterrupted)
     else:
@@ -307,7 +665,7 @@ def statusCheck():
     local_event_Status.emit({'level': 1, 'message': 'Application interruptions may be taking place (%s)' % timeMsgs})
     
   # fallback to a general process check if it's supposed to be running
-  elif local_event_DesiredPower.getArg == 'On' and local_event_Power.getArg() != 'On':
+  elif local_event_DesiredPower.getArg() == 'On' and local_event_Power.getArg() != 'On':
     local_event_Status.emit({'level': 2, 'message': 'Application is not running'})
     return
     
@@ -321,12 +679,15 @@ statusCheck_timer = Timer(statusCheck, 30)
 
 # <--- convenience functions
 
-# Converts into a brief time relative to now
-def toBriefTime(dateTime):
-  now = date_now()
-  nowMillis = now.getMillis()
+# Converts into a brief time relative to now (from epoch millis)
+def toBriefTime(millis):
+  if millis == None:
+    return 'never'
+
+  nowMillis = date_now().getMillis()
+  dateTime = date_instant(millis)
 
-  diff = (nowMillis - dateTime.getMillis()) / 60000 # in minutes
+  diff = (nowMillis - millis) / 60000 # in minutes
   
   if diff == 0:
     return '<1 min ago'
@@ -4,10 +4,11 @@ u'''
 
 Make sure TELNET is turned on.
 
-`rev 10.20240319`
+`rev 11.20261017`
 
 _changelog_
  
+   * r11: meters use TTP subscriptions (resubscribed on reconnect) instead of polling; received data is processed a chunk at a time
    * r10: added Logic Meter
    * r9: general faults raise warning and automatic connection drop
    * r8: activeFaults
@@ -548,8 +549,132 @@ def initMeters(meterType, label, inst, index):
     tcp_request('%s get %s %s\n' % (inst, cmd, index), 
                 lambda resp: parseResp(resp, handleResult))
   
-  # start meters much later to avoid being overwhelmed with feedback
-  _pollers.append(Timer(poll, 0.5, random(30,45), stopped=True))
+  # pushed by the device from now on (polling only if not possible)
+  subscriptions.add(inst, cmd, index, RATE_GROUP_METERS if cmd == 'level' else RATE_GROUP_STATES, handleResult, poll)
+
+# <!-- subscriptions
+
+# Meters are subscribed to (TTP 'subscribe') instead of being polled so the device pushes their values
+# at the rate of their group, e.g.
+# > Meter1 subscribe level 1 S1 500
+# < +OK
+# < ! "publishToken":"S1" "value":-64.697762
+#
+# Subscriptions only live as long as the session so they're all remade after every (re)connect.
+
+DEFAULT_METER_RATE = 500  # ms
+DEFAULT_STATE_RATE = 1000 # ms
+FALLBACK_POLL = 0.5       # s, when subscriptions are disabled or refused
+
+param_Subscriptions = Parameter({'title': 'Subscriptions', 'schema': {'type': 'object', 'properties': {
+          'disabled': {'type': 'boolean', 'desc': 'Poll meters instead of subscribing', 'order': 1},
+          'meterRate': {'type': 'integer', 'title': 'Level meter rate (ms)', 'hint': str(DEFAULT_METER_RATE), 'order': 2},
+          'stateRate': {'type': 'integer', 'title': 'Presence and logic rate (ms)', 'hint': str(DEFAULT_STATE_RATE), 'order': 3}}}})
+
+RATE_GROUP_METERS = 'meters'
+RATE_GROUP_STATES = 'states'
+
+def getSubscriptionRate(rateGroup):
+  info = param_Subscriptions or EMPTY
+  
+  if rateGroup == RATE_GROUP_STATES:
+    return info.get('stateRate') or DEFAULT_STATE_RATE
+  
+  return info.get('meterRate') or DEFAULT_METER_RATE
+
+class Subscription:
+  def __init__(self, token, inst, attribute, index, rateGroup, onValue, poll):
+    self.token = token
+    self.inst = inst
+    self.attribute = attribute
+    self.index = index
+    self.rateGroup = rateGroup
+    self.onValue = onValue  # takes the raw value string
+    self.subscribed = False
+    
+    # only used if subscriptions are disabled or refused
+    self.fallback = Timer(poll, FALLBACK_POLL, random(1, 2), stopped=True)
+
+class SubscriptionManager:
+  '''Keeps track of subscriptions by publish token and (re)makes them on each new session'''
+  
+  def __init__(self):
+    self._subs = list()
+    self._byToken = {}
+    
+  def add(self, inst, attribute, index, rateGroup, onValue, poll):
+    token = 'S%s' % (len(self._subs) + 1)
+    
+    sub = Subscription(token, inst, attribute, index, rateGroup, onValue, poll)
+    
+    self._subs.append(sub)
+    self._byToken[token] = sub
+    
+  def subscribeAll(self):
+    disabled = (param_Subscriptions or EMPTY).get('disabled')
+    
+    for sub in self._subs:
+      sub.subscribed = False
+      
+      if disabled:
+        sub.fallback.start()
+      else:
+        sub.fallback.stop()
+        self._subscribe(sub)
+      
+  def _subscribe(self, sub):
+    tcp_request('%s subscribe %s %s %s %s\n' % (sub.inst, sub.attribute, sub.index, sub.token, getSubscriptionRate(sub.rateGroup)),
+                lambda resp: self._onSubscribeResp(sub, resp))
+    
+  def _onSubscribeResp(self, sub, resp):
+    if resp.strip().startswith('+OK'):
+      sub.subscribed = True
+      return
+    
+    global _errorCount
+    _errorCount += 1
+    console.warn('Subscription to %s %s %s refused, will poll instead; resp was [%s]' % (sub.inst, sub.attribute, sub.index, resp.strip()))
+    sub.fallback.start()
+    
+  def unsubscribeAll(self):
+    for sub in self._subs:
+      if sub.subscribed:
+        tcp_request('%s unsubscribe %s %s %s\n' % (sub.inst, sub.attribute, sub.index, sub.token), lambda resp: None)
+        sub.subscribed = False
+        
+  def stopAll(self):
+    # (subscriptions end with the session)
+    for sub in self._subs:
+      sub.subscribed = False
+      sub.fallback.stop()
+    
+  def handlePublish(self, msg):
+    # e.g. ! "publishToken":"S1" "value":-64.697762
+    tokenStart = msg.find('"publishToken":"')
+    if tokenStart < 0:
+      return
+    
+    tokenStart += 16
+    tokenEnd = msg.find('"', tokenStart)
+    
+    sub = self._byToken.get(msg[tokenStart:tokenEnd])
+    if sub == None:
+      return
+    
+    valuePos = msg.find('"value":', tokenEnd)
+    if valuePos < 0:
+      return
+    
+    sub.onValue(msg[valuePos+8:])
+
+subscriptions = SubscriptionManager()
+
+@local_action({'group': 'Subscriptions', 'order': next_seq(), 'desc': 'Removes and remakes all subscriptions'})
+def Resubscribe(arg):
+  subscriptions.unsubscribeAll()
+  subscriptions.subscribeAll()
+
+# -->
 
 # only requests *if ready*
 def tcp_request(req, onResp):
@@ -611,52 +736,104 @@ def tcp_connected():
   receivedTelnetOptions = False
   
   tcp.clearQueue()
+  resetReceive()
   
 def tcp_received(data):
   # UNCOMMENT TO SHOW HEX TOO:
   # log(3, 'tcp_recv [%s] -- [%s]' % (data, data.encode('hex')))
-  log(3, 'tcp_recv [%s]' % data)
-  for c in data:
-    handleByte(c)
-
-telnetBuffer = list()
-recvBuffer = list()
+  if isLogging(3):
+    log(3, 'tcp_recv [%s]' % data)
+  
+  global _partialTelnet
+  
+  if len(_partialTelnet) > 0:
+    # a TELNET frame was split across chunks
+    data = _partialTelnet + data
+    _partialTelnet = ''
     
-def handleByte(c):
-  if len(telnetBuffer) > 0:
-    # goes into a TELNET frame
-    telnetBuffer.append(c)
+  pos, end = 0, len(data)
+  
+  while pos < end:
+    m = LINE_OR_TELNET.search(data, pos)
     
-    if len(telnetBuffer) == 3:
-      frame = ''.join(telnetBuffer)
-      del telnetBuffer[:]
-      telnet_frame_received(frame)
-
+    if m == None:
+      # rest of chunk is part of a NORMAL msg still to be completed
+      appendToLine(data[pos:])
+      return
     
-  elif c == '\xff':
-    # start of TELNET FRAME
-    telnetBuffer.append(c)
+    i = m.start()
+    if i > pos:
+      appendToLine(data[pos:i])
+      
+    if data[i] == '\xff':
+      # start of TELNET frame (always 3 bytes)
+      if i + 3 > end:
+        _partialTelnet = data[i:]
+        return
       
-  elif c in ['\r', '\n']:
-    # end of a NORMAL msg
-    msg = ''.join(recvBuffer).strip()
-    del recvBuffer[:]
+      telnet_frame_received(data[i:i+3])
+      pos = i + 3
+      
+    else:
+      # end of a NORMAL msg
+      line_received()
+      pos = i + 1
+
+import re
+
+# TELNET IAC or end of a NORMAL msg
+LINE_OR_TELNET = re.compile('[\r\n\xff]')
+
+MAX_LINE = 1024
+
+_lineParts = list() # parts of a NORMAL msg (TELNET frames can be mixed in)
+_lineLength = 0
+_partialTelnet = ''
+
+def appendToLine(part):
+  global _lineLength, _errorCount
+  
+  while _lineLength + len(part) > MAX_LINE:
+    # drop everything up to the point it became too big and carry on with the rest
+    cut = MAX_LINE + 1 - _lineLength
+    _lineParts.append(part[:cut])
+    part = part[cut:]
+    
+    console.warn('buffer too big; dropped; was "%s"' % ''.join(_lineParts))
+    resetReceive()
+    _errorCount += 1
     
-    if len(msg) > 0:
-      queue.handle(msg)
+  if len(part) > 0:
+    _lineParts.append(part)
+    _lineLength += len(part)
+    
+def line_received():
+  if _lineLength == 0:
+    return
+  
+  msg = ''.join(_lineParts).strip()
+  resetReceive()
+  
+  if len(msg) == 0:
+    pass
+  
+  elif msg[0] == '!':
+    # unsolicited, so not a response to anything in the queue
+    handlePublish(msg)
     
   else:
-    # put all other characters into NORMAL msg
-    recvBuffer.append(c)
+    queue.handle(msg)
     
-    if len(recvBuffer) > 1024:
-      console.warn('buffer too big; dropped; was "%s"' % ''.join(recvBuffer))
-      del recvBuffer[:]
-      global _errorCount
-      _errorCount += 1
+def resetReceive():
+  global _lineLength, _partialTelnet
+  
+  del _lineParts[:]
+  _lineLength = 0
+  _partialTelnet = ''
     
 def telnet_frame_received(data):
-  log(2, 'telnet_recv [%s]' % (data.encode('hex')))
+  if isLogging(2):
+    log(2, 'telnet_recv [%s]' % (data.encode('hex')))
   
   # reject all telnet options
   if data[0] == '\xFF':
@@ -666,8 +843,18 @@ def telnet_frame_received(data):
     elif data[1] == '\xFD': # DO
       tcp.send('\xFF\xFC%s' % data[2]) # send WON'T
       
+def handlePublish(msg):
+  if isLogging(2):
+    log(2, 'publish_recv [%s]' % msg)
+  
+  global _lastReceive
+  _lastReceive = system_clock()
+  
+  subscriptions.handlePublish(msg)
+  
 def msg_received(data):
-  log(2, 'msg_recv [%s]' % (data.strip()))
+  if isLogging(2):
+    log(2, 'msg_recv [%s]' % (data.strip()))
   
   global _lastReceive
   _lastReceive = system_clock()
@@ -677,9 +864,12 @@ def msg_received(data):
     receivedTelnetOptions = True
     
     [ p.start() for p in _pollers ]
+    
+    subscriptions.subscribeAll()
   
 def tcp_sent(data):
-  log(3, 'tcp_sent [%s] -- [%s]' % (data, data.encode('hex')))
+  if isLogging(3):
+    log(3, 'tcp_sent [%s] -- [%s]' % (data, data.encode('hex')))
   
 def tcp_disconnected():
   console.warn('tcp_disconnected')
@@ -689,6 +879,8 @@ def tcp_disconnected():
   
   [ p.stop() for p in _pollers ]  
   
+  subscriptions.stopAll()
+  
 def tcp_timeout():
   console.warn('tcp_timeout; dropping (if connected)')
   
@@ -700,8 +892,7 @@ def tcp_timeout():
 def protocolTimeout():
   console.log('protocol timeout; flushing buffer; dropping connection (if connected)')
   queue.clearQueue()
-  del recvBuffer[:]
-  del telnetBuffer[:]
+  resetReceive()
 
   global receivedTelnetOptions
   receivedTelnetOptions = False
@@ -728,6 +919,10 @@ def log(level, msg):
   if local_event_LogLevel.getArg() >= level:
     console.log(('  ' * level) + msg)    
 
+# (to avoid formatting log messages that won't be shown)
+def isLogging(level):
+  return local_event_LogLevel.getArg() >= level
+
 # --->
 
 
@@ -1,7 +1,7 @@
 '''
 **Blaze** PowerZone Connect 1002 and similar amplifiers
 
-`rev 4.2603`
+`rev 5.2610`
 
 **Resources:** [Blaze Open API for Installer PDF](https://images.salsify.com/image/upload/s--C3GIZKp0--/toqrdtrvqdfxciglxvjm.pdf)
 
@@ -9,6 +9,7 @@ Work-in-progress: feel free to update recipe with extra registers of interest
 
 _revision history_
 
+* _r5 subscribes to registers of interest only, meters on a slower tier with change threshold, register families by parameter_
 * _r4 JP bugfix, and updated resource link_
 * _r3 JP included Zone 2_
 * _r2 JP Drops connection on subscription silence_
@@ -52,6 +53,8 @@ def main():
     console.info("Will connect to port %s" % port)
     _tcp.setDest("%s:%s" % (ipAddr, port))
     
+  initFamilies()
+
   tryInitStringRegister("SYSTEM.DEVICE.VENDOR_NAME", "SYSTEM.DEVICE")
   tryInitStringRegister("SYSTEM.DEVICE.MODEL_NAME", "SYSTEM.DEVICE")
   tryInitStringRegister("SYSTEM.DEVICE.SERIAL", "SYSTEM.DEVICE")
@@ -130,6 +133,9 @@ def tryInitFloatRegister(name, group, withSetter=False): # name could be "ZONE-A
   
   def value_handler(arg):
     e.emit(float(arg))
+
+  if isMeterRegister(name):
+    value_handler = newMeterHandler(e)
     
   _handlers_byPrefix[name] = value_handler
   
@@ -160,6 +166,137 @@ def tryInitStringRegister(name, group, withSetter=False): # name could be "ZONE-
 
     a = create_local_action(name, setter, { "title": name, "group": group, "order": next_seq(), "schema": { "type": "string" }})    
     
+# <!-- subscriptions
+
+# Rather than streaming every register (SUBSCRIBE *), only registers with handlers are subscribed to, with
+# level meters (DYN.SIGNAL) on a slower tier and only emitted on significant change. Whole register families,
+# e.g. all inputs (IN-*), can be opted into by parameter; their signals are created as values first arrive.
+# (a family's meters arrive at the family's rate as wildcards can't exclude them, but are still only emitted
+# on significant change)
+
+DEFAULT_RATE = 2 # per second
+DEFAULT_METER_RATE = 1
+DEFAULT_METER_THRESHOLD = 1.0 # dB
+
+METER_SUFFIX = ".DYN.SIGNAL"
+
+param_subscriptions = Parameter({ "title": "Subscriptions", "order": next_seq(), "schema": { "type": "object", "properties": {
+                                    "rate": { "title": "Rate (per sec)", "type": "number", "hint": str(DEFAULT_RATE), "order": 1 },
+                                    "meterRate": { "title": "Meter rate (per sec)", "type": "number", "hint": str(DEFAULT_METER_RATE), "order": 2 },
+                                    "meterThreshold": { "title": "Meter change threshold (dB)", "type": "number", "hint": str(DEFAULT_METER_THRESHOLD), "order": 3 }}}})
+
+param_registerFamilies = Parameter({ "title": "Register families", "order": next_seq(), "desc": "Additional registers by prefix, e.g. IN-* or ZONE-A.EQ", "schema": { "type": "array", "items": { "type": "object", "properties": {
+                                       "prefix": { "type": "string", "order": 1 },
+                                       "group": { "type": "string", "order": 2 }}}}})
+
+local_event_ReceiveStats = LocalEvent({ "group": "Debug", "order": 10000+next_seq(), "desc": "Subscription data statistics (every minute)", "schema": { "type": "object", "properties": {
+                                          "lines": { "type": "integer", "order": 1 },
+                                          "unhandled": { "type": "integer", "order": 2 },
+                                          "meterEmits": { "type": "integer", "order": 3 },
+                                          "meterSkips": { "type": "integer", "title": "Meter skips (below threshold)", "order": 4 }}}})
+
+_receiveStats = { "lines": 0, "unhandled": 0, "meterEmits": 0, "meterSkips": 0 }
+
+class PrefixTrie:
+  '''Longest-prefix lookup of register names, e.g. "IN-" matches "IN-100.DYN.SIGNAL"'''
+
+  def __init__(self):
+    self._root = { }
+
+  def add(self, prefix, value):
+    node = self._root
+    for c in prefix:
+      node = node.setdefault(c, { })
+    node[None] = value # (None key holds the value)
+
+  def longestMatch(self, name):
+    node = self._root
+    match = node.get(None)
+
+    for c in name:
+      node = node.get(c)
+      if node is None:
+        break
+
+      if None in node:
+        match = node[None]
+
+    return match
+
+_families = PrefixTrie()
+_familyPrefixes = [] # for subscribing
+
+def isMeterRegister(name):
+  return name.endswith(METER_SUFFIX)
+
+def getMeterThreshold():
+  return (param_subscriptions or EMPTY).get("meterThreshold") or DEFAULT_METER_THRESHOLD
+
+def newMeterHandler(e):
+  threshold = getMeterThreshold()
+  last = [ None ]
+
+  def meter_handler(arg):
+    value = float(arg)
+    prev = last[0]
+
+    if prev is not None and abs(value - prev) < threshold:
+      _receiveStats["meterSkips"] += 1
+      return
+
+    last[0] = value
+    _receiveStats["meterEmits"] += 1
+    e.emit(value)
+
+  return meter_handler
+
+def initFamilies():
+  for item in param_registerFamilies or EMPTY:
+    prefix = (item.get("prefix") or "").strip().rstrip("*")
+    if len(prefix) == 0:
+      continue
+
+    _families.add(prefix, item.get("group") or prefix.rstrip("-."))
+    _familyPrefixes.append(prefix)
+
+def tryInitFamilyRegister(name, value):
+  group = _families.longestMatch(name)
+  if group is None:
+    return None
+
+  # values arrive as text, numbers are treated as such otherwise strings
+  try:
+    float(value)
+    tryInitFloatRegister(name, group)
+
+  except ValueError:
+    tryInitStringRegister(name, group)
+
+  return _handlers_byPrefix.get(name)
+
+def subscribeAll():
+  rate = (param_subscriptions or EMPTY).get("rate") or DEFAULT_RATE
+  meterRate = (param_subscriptions or EMPTY).get("meterRate") or DEFAULT_METER_RATE
+
+  for name in sorted(_handlers_byPrefix):
+    if _families.longestMatch(name) is not None:
+      continue # (covered by its family)
+
+    _tcp.send("SUBSCRIBE %s %s" % (name, meterRate if isMeterRegister(name) else rate))
+
+  for prefix in _familyPrefixes:
+    _tcp.send("SUBSCRIBE %s* %s" % (prefix, rate))
+
+def emitReceiveStats():
+  local_event_ReceiveStats.emit(dict(_receiveStats))
+
+  for key in _receiveStats:
+    _receiveStats[key] = 0
+
+timer_receiveStats = Timer(emitReceiveStats, 60, 60)
+
+# -->
+
 # <!-- protocol
 
 def parse_line(rawLine):
@@ -198,13 +335,21 @@ def parse_line(rawLine):
     else:
       value = parts[1].strip()
     
+    _receiveStats["lines"] += 1
+
     handler = _handlers_byPrefix.get(name)
+    if handler is None:
+      # part of an opted-in family?
+      handler = tryInitFamilyRegister(name, value)
+
     if handler is not None:
       _lastReceive = system_clock()
       
       handler(value)
       return
     
+    _receiveStats["unhandled"] += 1
+
     # uncomment this dynamically create any subscription data which comes through
     # ideally this is properly opted-into with value conversions, etc. but for
     # debugging purposes this could be useful although WARNING it can generate a LOT OF ACTIVITY
@@ -226,7 +371,7 @@ def tcp_connected():
   for line in _initial_getters:
     _tcp.send(line)
   
-  _tcp.send("SUBSCRIBE * 2")
+  subscribeAll()
 
 def tcp_disconnected():
   console.warn("TCP connected")
@@ -4,10 +4,11 @@
 '''
 A stateful multi-calendar / scheduling node that takes in event streams from sources (e.g. see *Microsoft Exchange Schedule Retriever* recipe).
 
-`rev 7`
+`rev 8`
 
 NOTE: by design, when this calendar (re)starts after config changes, it will automatically propagate remote actions. To avoid this behaviour, use the **Supress next propagation?** action.
 
+  * _rev 8_ items are parsed and indexed once per feed change; polls happen on the next item start or end instead of on fixed half-minute edges
   * _rev 7.241206_ "Suppress next propagation?" action
   * _rev 6_ bugfix: momentary events some times do not fire (interference with actual scheduler and agenda generation)
   * _rev 3_ support for "momentary" events (not stateful) when "start time" strictly equals "end time" e.g. `{ start: "... 02:45:00", end: "... 02:45:00", title: "{ Power: Off }" }`
@@ -75,34 +76,23 @@ def SuppressNextPropagation():
 # signal types by name
 signalTypes = {}
 
-# last trees by signal name
-lastTrees = {}
+# last states by signal name, then by member index (sparse i.e. only members that had a state)
+lastStates = {}
 
 # members by member name
 members = {}
 
-# The trees holds the data-structure to help with state propagation:
+# The member hierarchy is compiled once into flat, indexed arrays (see CompiledHierarchy), e.g.
 #
-# e.g. {
-#        'M':
-#          { 'state': 'On', 
-#            'locked': True,
-#            'members': [ #REF_TO_X, #REF_TO_Y ] 
-#          },
+#   index:     0     1     2     3     4
+#   names:   [ M,    X,    A,    B,    C  ]
+#   children:[ [1], [2,3], [],   [],   [] ]
+#   parents: [ [],   [0],  [1],  [1],  [] ]
+#   isEdge:  [ F,    F,    T,    T,    T  ]
 #
-#        'X':
-#          { 'state': 'On',
-#            'locked': False,
-#            'members': [ #REF_TO_A, #REF_TO_B, #REF_TO_C ]
-#          }
-#
-#        'A':
-#          { ... 
-#          }
-#       .
-#       .
-#       .
-#      }
+# On each poll, only the members reachable from the active states are visited to produce a sparse
+# map of desired states, which is then diffed against the last one so only members whose state
+# changed are acted upon.
 
 # 'states' e.g.:
 #
@@ -112,34 +102,106 @@ members = {}
 # All keys in items must already be resolved and sanitised.
 # States with warnings will be skipped
 
+class CompiledHierarchy:
+  '''The member hierarchy as flat arrays with pre-resolved remote actions and signals'''
+  
+  def __init__(self, rootMemberInfos, signalNames):
+    self.names = list()
+    self.children = list()
+    self.parents = list()
+    self.isEdge = list()
+    self.indexByName = {}
+    
+    for memberInfo in rootMemberInfos:
+      self._compile(memberInfo)
+      
+    # pre-resolve the actions and signals for each member, by signal name
+    self.actions = {}
+    self.signals = {}
+    for signalName in signalNames:
+      self.actions[signalName] = [lookup_remote_action('%s Propagate %s' % (name, signalName)) for name in self.names]
+      self.signals[signalName] = [lookup_local_event('%s %s' % (name, signalName)) for name in self.names]
+      
+  def _compile(self, memberInfo):
+    name = memberInfo['name']
+    
+    index = self.indexByName.get(name)
+    if index == None:
+      index = len(self.names)
+      self.indexByName[name] = index
+      self.names.append(name)
+      self.children.append(list())
+      self.parents.append(list())
+      self.isEdge.append(False)
+      
+    if safeLen(memberInfo.get('members')) == 0:
+      self.isEdge[index] = True
+      
+    else:
+      for subMemberInfo in memberInfo['members']:
+        subIndex = self._compile(subMemberInfo)
+        
+        # set the member links (a member can appear in more than one place)
+        if subIndex not in self.children[index]:
+          self.children[index].append(subIndex)
+          self.parents[subIndex].append(index)
+        
+    return index
+
+class DesiredStates:
+  '''The sparse desired state of members for one signal type'''
+  
+  def __init__(self, hierarchy):
+    self._children = hierarchy.children
+    
+    self.states = {}     # by member index
+    self.momentary = {}  # by member index, if a momentary event was last involved
+    self._locked = set()
+    
+  def lockAndTraverse(self, state, index, momentary):
+    # the member itself gets locked...
+    if index not in self._locked:
+      self.states[index] = state
+      self._locked.add(index)
+      
+    self.momentary[index] = momentary
+    
+    # ...its sub-members are only traversed
+    stack = list(self._children[index])
+    while len(stack) > 0:
+      subIndex = stack.pop()
+      
+      if subIndex not in self._locked:
+        self.states[subIndex] = state
+        
+      self.momentary[subIndex] = momentary
+      
+      stack.extend(self._children[subIndex])
+
+_compiledHierarchy = None
+
+def getCompiledHierarchy():
+  # (a parameter change restarts the node, so compiling once is enough)
+  global _compiledHierarchy
+  
+  if _compiledHierarchy == None:
+    _compiledHierarchy = CompiledHierarchy(param_members, [signalType['name'] for signalType in param_signalTypes])
+    
+  return _compiledHierarchy
+
 def applyStateList(states, force=False):
   # opt-ing out of next propagation?
   suppressNextPropagation = local_event_SuppressNextPropagation.getArg()
   if suppressNextPropagation:
     # clear flag
     local_event_SuppressNextPropagation.emit(False)
+    
+  hierarchy = getCompiledHierarchy()
   
-  stateTrees = {}
-  
-  def lockAndTraverse(state, member, momentary, traverseOnly=False):
-    # set the state if not locked
-    if not member['locked']:
-      member['state'] = state
-      
-    # lock if not only traversing
-    if not traverseOnly:
-      member['locked'] = True
-      
-    member['momentary'] = momentary
-      
-    for subMember in member['members']:
-      # only traverse from here
-      lockAndTraverse(state, subMember, momentary, True)
-      
-  # create a tree for each signal type
+  # desired states for each signal type
+  desiredStates = {}
   for signalType in param_signalTypes:
-    signalName = signalType['name']
-    stateTrees[signalName] = createNewTree()
+    desiredStates[signalType['name']] = DesiredStates(hierarchy)
       
   # for each state entry, traverse its branch (on its signal tree)
   for stateInfo in states:
@@ -152,34 +214,35 @@ def applyStateList(states, force=False):
     state = stateInfo['state']
     momentary = stateInfo.get('momentary')
     
-    member = stateTrees[signal][memberName]
-      
-    lockAndTraverse(state, member, momentary)
+    desiredStates[signal].lockAndTraverse(state, hierarchy.indexByName[memberName], momentary)
     
   for signalType in param_signalTypes:
     signalName = signalType['name']
     
-    stateTree = stateTrees[signalName]
+    desired = desiredStates[signalName]
     
-    # DEBUG: dump the all the trees
-    dumpTree(stateTree)
+    # DEBUG: dump the desired states
+    dumpDesiredStates(hierarchy, desired)
     
-    # state tree is ready, now go through all affected members and call the actions
+    # desired states are ready, now go through all affected members and call the actions
     # taking into account what their previous state information was
-  
-    for name in stateTree:
-      memberInfo = stateTree[name]
-      state = memberInfo['state']
+    
+    lastSignalStates = lastStates[signalName]
+    
+    nextSignalStates = {}
+    
+    # only members that have a state now or had one last time can be affected
+    for index in sorted(set(desired.states).union(lastSignalStates)):
+      name = hierarchy.names[index]
+      state = desired.states.get(index)
       
-      if memberInfo.get('momentary'):
-        # clear state entry immediately so its non-active state is called
-        memberInfo['state'] = None
+      # momentary states are not kept so their non-active state is called next time
+      if state != None and not desired.momentary.get(index):
+        nextSignalStates[index] = state
     
       reverting = False
       
-      lastState = lastTrees[signalName][name]['state']
-      
-      # wasMomentary = lastTrees[signalName][name]['momentary']
+      lastState = lastSignalStates.get(index)
       
       if not force and state == lastState:
         continue
@@ -191,65 +254,28 @@ def applyStateList(states, force=False):
           continue
           
         else:
-          # if wasMomentary:
-          #   print ('Skipping "%s", was momentary' % name)
-          #   continue
-          
           state = signalType['nonactiveState']
           reverting = True
       
       # if member is an edge, propagation is safe, otherwise request no propagation
     
       actionName = '%s Propagate %s' % (name, signalName)
-      arg = {'state': state, 'noPropagate': not memberInfo['isEdge']}
+      arg = {'state': state, 'noPropagate': not hierarchy.isEdge[index]}
 
       if suppressNextPropagation:
         print 'Ignoring... "%s": %s' % (actionName, arg)
       else:
         print '%s... "%s": %s' % ('Reverting' if reverting else 'Forcing', actionName, arg)
-        lookup_remote_action(actionName).call(arg)
+        hierarchy.actions[signalName][index].call(arg)
       
-      lookup_local_event('%s %s' % (name, signalName)).emit(state)
+      hierarchy.signals[signalName][index].emit(state)
     
-    lastTrees[signalName] = stateTree
+    lastStates[signalName] = nextSignalStates
       
-def dumpTree(tree):
+def dumpDesiredStates(hierarchy, desired):
   if local_event_Debug.getArg() > 0:
-    for name in tree:
-      value = tree[name]
-      console.log('[%s]: state:[%s] locked:[%s] momentary:[%s]' % (name, value['state'], value['locked'], value['momentary']))
-  
-def createNewTree():
-  stateTree = {}
-  
-  def traverse(memberInfo):
-    name = memberInfo['name']
-    
-    if name not in stateTree:
-      member = { 'state': None,
-                 'locked': False,
-                 'isEdge': False,
-                 'momentary': False, # if a momentary event was last involved
-                 'members': [] }
-      stateTree[name] = member
-    else:
-      member = stateTree[name]
-      
-    if safeLen(memberInfo['members']) == 0:
-      member['isEdge'] = True
-      
-    else:
-      for subMemberInfo in memberInfo['members']:
-        traverse(subMemberInfo)
-      
-        # set the member references
-        member['members'].append(stateTree[subMemberInfo['name']])
-  
-  # traverse the roots
-  for memberInfo in param_members:
-    traverse(memberInfo)
-    
-  return stateTree
+    for index in sorted(desired.states):
+      console.log('[%s]: state:[%s] momentary:[%s]' % (hierarchy.names[index], desired.states[index], desired.momentary.get(index)))
 
 def main():
   # set up the schedule sources
@@ -277,43 +303,50 @@ def main():
     
   # TODO: ideally unpersist this data but not a big deal if done outside of booking windows
   
-  # initialise last trees
-  # create a tree for each signal type
+  # initialise last states for each signal type
   for signalType in param_signalTypes:
-    signalName = signalType['name']
-    lastTrees[signalName] = createNewTree()
+    lastStates[signalType['name']] = {}
+    
+  # compile the member hierarchy now that all the actions and signals exist
+  getCompiledHierarchy()
 
   # give at least 20s for opportunity to suppress initial propagation
-  delay = quantisePollNow(minDelay=20)
+  delay = scheduleNextPoll(minDelay=20)
   
-  console.info('Scheduler started! (polling on half-minute boundaries first one in %.1f seconds)' % delay)
+  console.info('Scheduler started! (polling on item boundaries, first one in %.1f seconds)' % delay)
 
   console.info("NOTE: 'Suppress Next Propagation' can be used to avoid any initial actions being called just after (re)starts.")
   
   # check the active future ones every 5 mins (after 30s at first)
   Timer(lambda: lookup_local_action('ProcessActiveFuture').call(), 2.5*60, 30)
   
-# schedules the next poll on sharp 30s wall-clock edges
-def quantisePollNow(minDelay=0):
-  halfMinRemainder = 30 - (date_now().getMillis() % 30000) / 1000.0   # is in secs
+# schedules the next poll exactly on the next start or end of any item (see agenda index)
+def scheduleNextPoll(minDelay=0):
+  nowMillis = date_now().getMillis()
+  
+  nextBoundary = getAgendaIndex().nextBoundaryAfter(nowMillis)
+  
+  if nextBoundary == None:
+    delay = MAX_POLL_GAP
+  else:
+    delay = min(MAX_POLL_GAP, (nextBoundary - nowMillis) / 1000.0)   # is in secs
 
-  delay = max(minDelay, halfMinRemainder)
+  delay = max(minDelay, MIN_POLL_GAP, delay)
 
   timer_poller.setDelay(delay)
 
   # return what is the delay
   return delay
 
-# establish a timer that will be manually quantised on 30s edges
+# establish a timer that will be manually set to fire on item boundaries
 def handlePollTimer():
   if local_event_Debug.getArg() > 0:
     console.log('handlePollTimer called')
 
-  # when this timer fires, we should be on sharp 30s intervals 
-  # of the wall clock
+  # when this timer fires, we should be on an item boundary
   
   lookup_local_action('ProcessActiveNow').call()
-  quantisePollNow()
+  scheduleNextPoll()
   
 timer_poller = Timer(handlePollTimer, 99999, 99999) # NOTE: 'delay' is continually set on-the-fly
                                                     #       and 'interval' control is not used
@@ -361,7 +394,15 @@ def initScheduleSource(sourceInfo):
     }}}})
 
 def handleScheduleSourceFeed(sourceInfo, items):
-  lookup_local_event('Source %s Items' % sourceInfo['name']).emit(items)
+  itemsEvent = lookup_local_event('Source %s Items' % sourceInfo['name'])
+  
+  # (feeds are often re-emitted unchanged, only rebuild the index when the items actually differ)
+  changed = itemsEvent.getArg() != items
+  
+  itemsEvent.emit(items)
+  
+  if changed:
+    invalidateAgendaIndex()
   
   lookup_local_action('ProcessActiveNow').call()
 
@@ -383,7 +424,7 @@ def local_action_ProcessActiveNow(arg=None):
 
   applyStateList(items)
   
-  quantisePollNow()
+  scheduleNextPoll()
   
 # this action is called by the user to force states instead of only respecting changes in state
 def local_action_ForceActiveNow(arg=None):
@@ -402,21 +443,8 @@ def local_action_ForceActiveNow(arg=None):
 
 # this action is used to update the agenda and forwarn of inconsistent event data
 def local_action_ProcessActiveFuture(arg=None):
-  instantsSet = set()
-  instantsList = list()
-
-  for sourceInfo in param_scheduleSources:
-    items = lookup_local_event('Source %s Items' % sourceInfo['name']).getArg()
-
-    for item in safely(items):
-      start = item['start']
-
-      if start not in instantsSet:
-        instantsList.append(date_parse(start))
-        instantsSet.add(start)
-
-  # sort by date
-  instantsList.sort()
+  # (already distinct and sorted by date)
+  instantsList = getAgendaIndex().startInstants()
 
   result = list()
   
@@ -535,77 +563,188 @@ def processAllActiveItems(instant, warnings, fromInstant=None):
   if fromInstantMillis != None:
     console.info('Polling between: %s  and: %s' % (fromInstant, instant))
     
-  # consolidates all available calendar sources
-  for sourceInfo in param_scheduleSources:
-    items = lookup_local_event('Source %s Items' % sourceInfo['name']).getArg()
-
-    for item in safely(items):
-      start = item['start']
-      end = item['end']
-
-      startMillis = date_parse(start).getMillis()
-      endMillis = date_parse(end).getMillis()
+  # consolidates all available calendar sources (see agenda index)
+  for entry in getAgendaIndex().activeAt(instantMillis, fromInstantMillis):
+    sourceInfo = entry.sourceInfo
+    item = entry.item
       
-      momentary = False
+    momentary = fromInstantMillis != None and entry.momentary
       
-      if fromInstantMillis != None and startMillis == endMillis: # check if it's a momentary event
-        # check if active
-        if not (startMillis > fromInstantMillis and startMillis <= instantMillis):
-          # is not within poll period i.e. start is not between current instant and end of last instant
-          continue
-          
-        # is an active momentary event
-        console.info('Is Active Momentary! %s' % start)
+    if momentary:
+      # is an active momentary event
+      console.info('Is Active Momentary! %s' % item['start'])
         
-        momentary = True
-        
-      elif instantMillis < startMillis or instantMillis >= endMillis:
-        continue
-
-      activeItem = {}
+    activeItem = {}
+    
+    warning = None
+    
+    for key in item:
+      activeItem[key] = item[key]
       
-      warning = None
+    if momentary:
+      activeItem['momentary'] = True
+
+    # resolve member
+    if isBlank(item['member']):
+      activeItem['member'] = sourceInfo['defaultMember']
+
+    # validate member
+    if members.get(activeItem['member']) == None:
+      warning = 'Unknown member: %s' % activeItem['member']
+
+    # resolve signal type
+    signal = item['signal']
+    if isBlank(signal):
+      signal = sourceInfo['defaultSignal']
+    activeItem['signal'] = signal
+
+    # validate signal type
+    if signal not in signalTypes:
+      warning = 'Ignoring unmanaged signal type: %s' % signal
+
+    # resolve signal state
+    elif item['state'] == None:
+      # safe to look up signal type to get active state
+      activeItem['state'] = signalTypes[activeItem['signal']]['activeState']
       
-      for key in item:
-        activeItem[key] = item[key]
-        
-      if momentary:
-        activeItem['momentary'] = True
-
-      # resolve member
-      if isBlank(item['member']):
-        activeItem['member'] = sourceInfo['defaultMember']
-
-      # validate member
-      if members.get(activeItem['member']) == None:
-        warning = 'Unknown member: %s' % activeItem['member']
-
-      # resolve signal type
-      signal = item['signal']
-      if isBlank(signal):
-        signal = sourceInfo['defaultSignal']
-      activeItem['signal'] = signal
-
-      # validate signal type
-      if signal not in signalTypes:
-        warning = 'Ignoring unmanaged signal type: %s' % signal
-
-      # resolve signal state
-      elif item['state'] == None:
-        # safe to look up signal type to get active state
-        activeItem['state'] = signalTypes[activeItem['signal']]['activeState']
+    if warning != None:
+      activeItem['warning'] = warning
+      warnings.append({'start': instant,
+                       'calendar': sourceInfo['name'], 
+                       'title': item['title'],
+                       'message': warning})
+
+    activeItems.append(activeItem)
+
+  return activeItems
+
+
+# <!--- agenda index
+
+# All items of all sources are parsed once into an index which is only rebuilt when a source's items change.
+# Active items are found with a stabbing query on an interval tree (items sorted by start, where each implicit
+# subtree holds the max. end of its items) and momentary items by bisecting their starts.
+
+from bisect import bisect_right
+
+MAX_POLL_GAP = 5*60 # (secs) safety net when no boundaries are coming up
+MIN_POLL_GAP = 0.05 # (secs)
+
+class IndexedItem:
+  def __init__(self, ordinal, sourceInfo, item):
+    self.ordinal = ordinal # for preserving source and item order
+    self.sourceInfo = sourceInfo
+    self.item = item
+    self.start = date_parse(item['start'])
+    self.startMillis = self.start.getMillis()
+    self.endMillis = date_parse(item['end']).getMillis()
+    self.momentary = self.startMillis == self.endMillis
+    
+class AgendaIndex:
+  def __init__(self, sources):
+    entries = list()
+    
+    for sourceInfo in sources:
+      for item in safely(lookup_local_event('Source %s Items' % sourceInfo['name']).getArg()):
+        entries.append(IndexedItem(len(entries), sourceInfo, item))
         
-      if warning != None:
-        activeItem['warning'] = warning
-        warnings.append({'start': instant,
-                         'calendar': sourceInfo['name'], 
-                         'title': item['title'],
-                         'message': warning})
+    # the interval tree (momentary items can never be stabbed so are harmless here)
+    self._intervals = sorted(entries, key=lambda entry: entry.startMillis)
+    self._maxEnds = [0] * len(self._intervals)
+    self._augment(0, len(self._intervals))
+    
+    # momentary items, by start
+    self._momentaries = [entry for entry in self._intervals if entry.momentary]
+    self._momentaryStarts = [entry.startMillis for entry in self._momentaries]
+    
+    # all the instants something can change
+    boundaries = set()
+    instantsByMillis = {}
+    for entry in entries:
+      boundaries.add(entry.startMillis)
+      boundaries.add(entry.endMillis)
+      instantsByMillis[entry.startMillis] = entry.start
+      
+    self._boundaries = sorted(boundaries)
+    self._startInstants = [instantsByMillis[millis] for millis in sorted(instantsByMillis)]
+    
+  def _augment(self, lo, hi):
+    # returns the max. end of the subtree, storing it against the subtree's root
+    if lo >= hi:
+      return None
+    
+    mid = (lo + hi) / 2
+    
+    maxEnd = max(self._intervals[mid].endMillis, self._augment(lo, mid), self._augment(mid+1, hi))
+    self._maxEnds[mid] = maxEnd
+    
+    return maxEnd
+  
+  def _stab(self, lo, hi, millis, result):
+    if lo >= hi:
+      return
+    
+    mid = (lo + hi) / 2
+    
+    # nothing in this subtree ends after the instant?
+    if self._maxEnds[mid] <= millis:
+      return
+    
+    self._stab(lo, mid, millis, result)
+    
+    entry = self._intervals[mid]
+    
+    # nothing from here on can have started yet
+    if entry.startMillis > millis:
+      return
+    
+    if millis < entry.endMillis:
+      result.append(entry)
+      
+    self._stab(mid+1, hi, millis, result)
+    
+  def activeAt(self, instantMillis, fromInstantMillis=None):
+    '''Items active at the instant, and momentary items since the "from" instant, in source order'''
+    result = list()
+    
+    self._stab(0, len(self._intervals), instantMillis, result)
+    
+    # momentary items start after the "from" instant and no later than this instant
+    if fromInstantMillis != None:
+      lo = bisect_right(self._momentaryStarts, fromInstantMillis)
+      hi = bisect_right(self._momentaryStarts, instantMillis)
+      result.extend(self._momentaries[lo:hi])
+      
+    result.sort(key=lambda entry: entry.ordinal)
+    
+    return result
+  
+  def nextBoundaryAfter(self, millis):
+    '''The next instant (in millis) any item starts or ends, or None'''
+    i = bisect_right(self._boundaries, millis)
+    
+    return self._boundaries[i] if i < len(self._boundaries) else None
+  
+  def startInstants(self):
+    '''All the distinct start instants, sorted'''
+    return self._startInstants
 
-      activeItems.append(activeItem)
+_agendaIndex = None
   
-  return activeItems
+def getAgendaIndex():
+  global _agendaIndex
+  
+  if _agendaIndex == None:
+    _agendaIndex = AgendaIndex(param_scheduleSources)
+    
+  return _agendaIndex
 
+def invalidateAgendaIndex():
+  global _agendaIndex
+  
+  _agendaIndex = None
+  
+# agenda index ---!>
 
 # <!--- status
 
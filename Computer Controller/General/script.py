@@ -128,31 +128,183 @@ def local_action_SetVolume(arg = None):
 DEFAULT_FREESPACEMB = 0.5
 param_FreeSpaceThreshold = Parameter({'title': 'Freespace threshold (GB)', 'schema': {'type': 'integer', 'hint': DEFAULT_FREESPACEMB}})
 
+DEFAULT_FILLWARNINGHOURS = 24
+param_FillWarningHours = Parameter({'title': 'Warn when a disk is expected to fill within (hours)', 'schema': {'type': 'integer', 'hint': DEFAULT_FILLWARNINGHOURS}})
+
 local_event_Status = LocalEvent({'group': 'Status', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
         'level': {'type': 'integer', 'order': 1},
         'message': {'type': 'string', 'order': 2}}}})
 
+local_event_Volumes = LocalEvent({'group': 'Status', 'order': next_seq(), 'schema': {'type': 'array', 'items': {'type': 'object', 'properties': {
+        'path': {'type': 'string', 'order': 1},
+        'type': {'type': 'string', 'order': 2},
+        'totalGB': {'type': 'number', 'title': 'Total (GB)', 'order': 3},
+        'freeGB': {'type': 'number', 'title': 'Free (GB)', 'order': 4},
+        'fillRate': {'type': 'number', 'title': 'Fill rate (GB/hour)', 'order': 5},
+        'hoursLeft': {'type': 'number', 'title': 'Hours until full', 'order': 6}}}}})
+
+import os
+import re
+from collections import deque
 from java.io import File
 
+# <!-- volumes
+
+# On Linux all mounted (fixed, local, writable) volumes are checked. The mount table is only re-parsed when it
+# changes and free space is sampled from each volume once per check.
+
+MOUNTINFO = '/proc/self/mountinfo'
+
+# kernel / virtual filesystems
+PSEUDO_FSTYPES = set([ 'proc', 'sysfs', 'devtmpfs', 'devpts', 'tmpfs', 'ramfs', 'cgroup', 'cgroup2', 'pstore', 'bpf',
+                       'securityfs', 'debugfs', 'tracefs', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs', 'autofs',
+                       'binfmt_misc', 'rpc_pipefs', 'nsfs', 'efivarfs', 'squashfs', 'overlay', 'fuse.gvfsd-fuse', 'fuse.portal' ])
+
+# typical of USB sticks, memory cards and optical media
+REMOVABLE_FSTYPES = set([ 'vfat', 'msdos', 'exfat', 'iso9660', 'udf' ])
+
+# (free space checks can block when a server is unreachable)
+NETWORK_FSTYPES = set([ 'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'sshfs', 'fuse.sshfs' ])
+
+IGNORED_FSTYPES = PSEUDO_FSTYPES | REMOVABLE_FSTYPES | NETWORK_FSTYPES
+
+FILL_RATE_WINDOW = 3600 * 1000   # free space history used for the fill rate (millis)
+FILL_RATE_MIN_SPAN = 900 * 1000  # least amount of history needed
+
+GB = 1024*1024*1024.0
+
+class Volume:
+  def __init__(self, path, fsType=None):
+    self.path = path
+    self.fsType = fsType
+    self.file = File(path)
+
+    self.total = None
+    self.free = None
+    self.fillRate = None   # bytes per hour
+    self.hoursLeft = None
+
+    self.history = deque() # (millis, free)
+
+  def sample(self, now):
+    self.total = self.file.getTotalSpace()
+    self.free = self.file.getFreeSpace()
+
+    history = self.history
+    history.append((now, self.free))
+
+    while now - history[0][0] > FILL_RATE_WINDOW:
+      history.popleft()
+
+    (firstMillis, firstFree) = history[0]
+
+    if now - firstMillis < FILL_RATE_MIN_SPAN:
+      self.fillRate = self.hoursLeft = None
+      return
+
+    self.fillRate = (firstFree - self.free) * 3600000.0 / (now - firstMillis)
+    self.hoursLeft = self.free / self.fillRate if self.fillRate > 0 else None
+
+def decodeMountPath(s):
+  # spaces, tabs, etc. are octal escaped, e.g. "/media/My\040Drive"
+  return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), s)
+
+def parseMountinfo(raw):
+  '''Returns (path, fsType) of the volumes worth checking, one per device'''
+  candidates = list()
+
+  for line in raw.splitlines():
+    # e.g. 36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+    #      id pid dev root  mount point options    optional  type source super options
+    fields = line.split(' ')
+
+    try:
+      sep = fields.index('-', 6)
+    except ValueError:
+      continue
+
+    if sep + 2 >= len(fields):
+      continue
+
+    (device, root, path, options) = (fields[2], fields[3], decodeMountPath(fields[4]), fields[5])
+    fsType = fields[sep+1]
+
+    if fsType in IGNORED_FSTYPES or 'ro' in options.split(','):
+      continue
+
+    candidates.append((root != '/', len(path), device, path, fsType))
+
+  # the same device is often mounted more than once (bind mounts), prefer its whole-device, shortest path
+  candidates.sort()
+
+  volumes = dict()
+  for (notWhole, length, device, path, fsType) in candidates:
+    if device not in volumes:
+      volumes[device] = (path, fsType)
+
+  return sorted(volumes.values())
+
+_mountinfo = { 'raw': None, 'volumes': [] }
+
+def getVolumes():
+  f = open(MOUNTINFO)
+  try:
+    raw = f.read()
+  finally:
+    f.close()
+
+  if raw != _mountinfo['raw']:
+    # mounts have changed, keep history of existing volumes
+    existing = dict([ (v.path, v) for v in _mountinfo['volumes'] ])
+
+    _mountinfo['raw'] = raw
+    _mountinfo['volumes'] = [ existing.get(path) or Volume(path, fsType) for (path, fsType) in parseMountinfo(raw) ]
+
+  return _mountinfo['volumes']
+
+_linuxVolumes = os.path.isfile(MOUNTINFO)
+
+# File.listRoots() pulls in removable disk drives so elsewhere just the current drive is used
+_currentDrive = [ Volume(File('.').getAbsolutePath()) ]
+
+# volumes -->
+
 def check_status():
-  # unfortunately this pulls in removable disk drives
-  # roots = list(File.listRoots())
-  
-  roots = [File('.')] # so just using current drive instead
-  
+  now = system_clock()
+
+  volumes = getVolumes() if _linuxVolumes else _currentDrive
+
+  threshold = (param_FreeSpaceThreshold or DEFAULT_FREESPACEMB)*GB
+  fillWarningHours = param_FillWarningHours or DEFAULT_FILLWARNINGHOURS
+
   warnings = list()
-  
-  roots.sort(lambda x, y: cmp(x.getAbsolutePath(), y.getAbsolutePath()))
-  
-  for root in roots:
-    path = root.getAbsolutePath()
-    
-    total = root.getTotalSpace()
-    free = root.getFreeSpace()
-    usable = root.getUsableSpace()
-    
-    if free < (param_FreeSpaceThreshold or DEFAULT_FREESPACEMB)*1024*1024*1024L:
-      warnings.append('%s has less than %0.1f GB left' % (path, long(free)/1024/1024/1024))
+  summary = list()
+
+  for volume in volumes:
+    try:
+      volume.sample(now)
+    except:
+      # (e.g. unmounted between checks)
+      continue
+
+    if volume.total == 0:
+      # not accessible
+      continue
+
+    path = volume.path
+
+    if volume.free < threshold:
+      warnings.append('%s has less than %0.1f GB left' % (path, volume.free/GB))
+
+    elif volume.hoursLeft != None and volume.hoursLeft < fillWarningHours:
+      warnings.append('%s is filling up, may be full in %0.1f hours' % (path, volume.hoursLeft))
+
+    summary.append({ 'path': path, 'type': volume.fsType,
+                     'totalGB': round(volume.total/GB, 1), 'freeGB': round(volume.free/GB, 1),
+                     'fillRate': round(volume.fillRate/GB, 3) if volume.fillRate != None else None,
+                     'hoursLeft': round(volume.hoursLeft, 1) if volume.hoursLeft != None else None })
+
+  local_event_Volumes.emit(summary)
       
   if len(warnings) > 0:
     local_event_Status.emit({'level': 2, 'message': 'Disk space is low on some drives: %s' % (','.join(warnings))})
@@ -0,0 +1,127 @@
+'''Tests and times the recipe's mountinfo parsing outside of Nodel (plain Python 2.7).
+
+   python2 test_mountinfo.py
+
+Synthetic /proc/self/mountinfo content is fed through parseMountinfo, including a table of several hundred
+mounts, which must parse well within a status check.'''
+
+import os
+import re
+import time
+import unittest
+from collections import deque
+
+# <!-- pull parseMountinfo (and its constants) out of the recipe
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script.py')
+
+def loadParser():
+  src = open(SCRIPT).read()
+
+  start = src.index('MOUNTINFO = ')
+  end = src.index('_mountinfo = {')
+
+  # (Volume isn't used here, it only needs its names to resolve)
+  scope = { 're': re, 'deque': deque, 'File': None }
+  exec src[start:end] in scope
+
+  return scope['parseMountinfo']
+
+# -->
+
+parseMountinfo = loadParser()
+
+def mount(id, dev, root, path, fsType, options='rw,relatime', source='/dev/sda1', optional='shared:1'):
+  return '%s 1 %s %s %s %s %s - %s %s rw' % (id, dev, root, path, options, optional, fsType, source)
+
+class ParseMountinfoTests(unittest.TestCase):
+  def test_root_only(self):
+    raw = mount(22, '8:1', '/', '/', 'ext4')
+
+    self.assertEqual(parseMountinfo(raw), [ ('/', 'ext4') ])
+
+  def test_octal_escaped_path(self):
+    raw = mount(40, '8:17', '/', '/media/My\\040Drive\\011x', 'ext4')
+
+    self.assertEqual(parseMountinfo(raw), [ ('/media/My Drive\tx', 'ext4') ])
+
+  def test_bind_mounts_of_one_device(self):
+    # whole-device mount wins over the bind mounts, whatever their order or length
+    raw = '\n'.join([ mount(30, '8:2', '/data/a', '/a', 'ext4'),
+                      mount(31, '8:2', '/', '/srv/data', 'ext4'),
+                      mount(32, '8:2', '/data/b/c', '/b', 'ext4') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/srv/data', 'ext4') ])
+
+  def test_bind_mounts_only(self):
+    # no whole-device mount, so the shortest path
+    raw = '\n'.join([ mount(30, '8:2', '/data/a', '/mnt/aaa', 'ext4'),
+                      mount(31, '8:2', '/data/b', '/b', 'ext4') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/b', 'ext4') ])
+
+  def test_read_only_mounts_skipped(self):
+    raw = '\n'.join([ mount(22, '8:1', '/', '/', 'ext4'),
+                      mount(23, '7:0', '/', '/snap/core/1', 'ext4', options='ro,nodev,relatime'),
+                      mount(24, '8:3', '/', '/boot', 'ext4', options='rw,relatime,errors=remount-ro') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/', 'ext4'), ('/boot', 'ext4') ])
+
+  def test_ignored_types_skipped(self):
+    raw = '\n'.join([ mount(22, '8:1', '/', '/', 'xfs'),
+                      mount(23, '0:5', '/', '/proc', 'proc', source='proc'),
+                      mount(24, '0:20', '/', '/run', 'tmpfs', source='tmpfs'),
+                      mount(25, '0:30', '/', '/sys/fs/cgroup', 'cgroup2', source='cgroup2'),
+                      mount(26, '8:33', '/', '/media/usb', 'vfat', source='/dev/sdc1'),
+                      mount(27, '11:0', '/', '/media/cdrom', 'iso9660', source='/dev/sr0'),
+                      mount(28, '0:50', '/', '/mnt/share', 'cifs', source='//server/share'),
+                      mount(29, '0:51', '/', '/mnt/nfs', 'nfs4', source='server:/export') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/', 'xfs') ])
+
+  def test_optional_fields(self):
+    # none, or several, optional fields before the separator
+    raw = '\n'.join([ mount(22, '8:1', '/', '/', 'ext4', optional=''),
+                      mount(23, '8:2', '/', '/home', 'ext4', optional='shared:2 master:1 propagate_from:1') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/', 'ext4'), ('/home', 'ext4') ])
+
+  def test_malformed_lines_skipped(self):
+    raw = '\n'.join([ '36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 ext3 /dev/root rw',  # no '-' separator
+                      '36 35 98:0 /mnt1 /mnt/parent rw,noatime - ext3',                    # no source
+                      '',
+                      'garbage',
+                      mount(22, '8:1', '/', '/', 'ext4') ])
+
+    self.assertEqual(parseMountinfo(raw), [ ('/', 'ext4') ])
+
+  def test_many_mounts(self):
+    # e.g. a host running plenty of containers: 800 mounts, mostly pseudo and bind mounts of few devices
+    lines = [ mount(22, '8:1', '/', '/', 'ext4') ]
+    for i in range(800):
+      if i % 4 == 0:
+        lines.append(mount(100+i, '0:%s' % (100+i), '/', '/run/containers/%s/shm' % i, 'tmpfs', source='shm'))
+      elif i % 4 == 1:
+        lines.append(mount(100+i, '0:%s' % (100+i), '/', '/var/lib/containers/%s/merged' % i, 'overlay', source='overlay'))
+      elif i % 4 == 2:
+        lines.append(mount(100+i, '8:1', '/var/lib/volumes/%s' % i, '/var/lib/containers/%s/data' % i, 'ext4'))
+      else:
+        disk = (i / 4) % 8
+        lines.append(mount(100+i, '8:%s' % (16+disk), '/', '/mnt/disk%s' % disk, 'xfs', source='/dev/sdb%s' % disk))
+    raw = '\n'.join(lines)
+
+    runs = 20
+    started = time.time()
+    for i in range(runs):
+      volumes = parseMountinfo(raw)
+    elapsed = (time.time() - started) / runs
+
+    self.assertEqual(volumes, [ ('/', 'ext4') ] + [ ('/mnt/disk%s' % i, 'xfs') for i in range(8) ])
+
+    print '\n(%s mounts parsed in %.1f ms)' % (len(lines), elapsed * 1000)
+
+    # status checks happen every few minutes, anything near a second would be a problem
+    self.assertTrue(elapsed < 0.25)
+
+if __name__ == '__main__':
+  unittest.main()
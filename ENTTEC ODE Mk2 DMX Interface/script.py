@@ -1,10 +1,12 @@
 '''
 **ENTTEC ODE Mk2**, DMX lighting with Artnet - [info](https://www.enttec.com/product/controls/dmx-ethernet-lighting-control/ethernet-to-dmx-interface/).
 
-`rev 13 2023.03.06`
+`rev 15 2026.10.17`
 
 * loads channels buffer on first use; unused channels will be left unchanged.
 * smoothing is done over 1200 ms @ 20 Hz unless overridden
+* frames are only sent when a channel changes, otherwise refreshed at the keep-alive rate (1 Hz unless overridden)
+* fades can use easing curves (linear, s-curve, square-law or log) and channels can be on any Art-Net universe, optionally also sent as sACN (E1.31)
 
 This nodes allows for single and multi-channel color+ channel modes.
 
@@ -21,6 +23,8 @@ Useful links:
 CHANGELOG:
 
 - added support for stream rate adjustments
+- channel buffer is the Art-Net packet itself (with precomputed header) and is only sent when changed or for keep-alive
+- fade scheduler only visits active fades, easing curves, multi-universe and sACN output
 - included custom script which support V2 firmware for the Ethergate series (which has a different endpoint and HTTP scheme)
 
 TODO:
@@ -36,22 +40,40 @@ param_singleChannels = Parameter({ 'title': 'Single Channels', 'schema': { 'type
   'name': { 'type': 'string', 'hint': 'e.g. Light 1', 'order': next_seq() },
   'label': { 'title': 'label / group', 'type': 'string', 'hint': 'e.g. Front', 'order': next_seq() },
   'num': { 'title': 'channel num.', 'type': 'integer', 'hint': '(1 means first)' },
+  'universe': { 'type': 'integer', 'hint': '0 (default, Art-Net port address)' }
 }}}})
 
 param_rgbChannels = Parameter({ 'title': 'RGB+ Channels', 'schema': { 'type': 'array', 'items': { 'type': 'object', 'properties': {
   'name': { 'type': 'string', 'hint': 'e.g. Light 1', 'order': next_seq() },
   'label': { 'title': 'label / group', 'type': 'string', 'hint': 'e.g. Front', 'order': next_seq() },
   'num': { 'title': 'first channel num.', 'type': 'integer', 'hint': '(1 means first)' },
-  'channels': { 'type': 'string', 'hint': '(e.g. "rgbwaiD")', 'desc': 'Refer to light manaul for applicable multi-channel modes, e.g. "w" - white, "a" - amber", "i" - infrared, "D" - dimmer, etc' }
+  'channels': { 'type': 'string', 'hint': '(e.g. "rgbwaiD")', 'desc': 'Refer to light manaul for applicable multi-channel modes, e.g. "w" - white, "a" - amber", "i" - infrared, "D" - dimmer, etc' },
+  'universe': { 'type': 'integer', 'hint': '0 (default, Art-Net port address)' }
 }}}})
 
 DEFAULT_STREAM_RATE = 20 # (Hz) e.g. 20/sec (0.05)
 
 param_streamRate = Parameter({'title': 'Stream rate (Hz)', 'schema': {'type': 'integer', 'hint': '%s' % DEFAULT_STREAM_RATE, 'default': DEFAULT_STREAM_RATE, 'min': 1, 'max': 44}})
 
-_rawChannels = None # must be either None or a full array of channel values
+DEFAULT_KEEPALIVE_RATE = 1.0 # (Hz) when no channels are changing
 
-_singleChannelTargets_byChannel = { } # [ 11: ( targetValue, startTime, endTime ) ]
+param_keepAliveRate = Parameter({'title': 'Keep-alive rate (Hz)', 'desc': 'How often the frame is resent when nothing has changed',
+                                 'schema': {'type': 'number', 'hint': '%s' % DEFAULT_KEEPALIVE_RATE}})
+
+EASING_CURVES = [ 'linear', 's-curve', 'square-law', 'log' ]
+
+param_fadeCurve = Parameter({'title': 'Default fade curve', 'schema': {'type': 'string', 'enum': EASING_CURVES, 'hint': 'linear (default)'}})
+
+param_sacn = Parameter({'title': 'sACN (E1.31)', 'desc': 'Also sends every universe as sACN multicast (universe is Art-Net port address + 1)',
+                        'schema': {'type': 'object', 'properties': {
+                          'enabled': { 'type': 'boolean', 'order': 1 },
+                          'priority': { 'type': 'integer', 'hint': '100 (default)', 'order': 2 }}}})
+
+_rawChannels = None # must be either None or a full frame of channel values (see ArtDmxFrame) of universe 0
+
+_frames_byUniverse = { } # all the universes in use, incl. universe 0 once synced
+
+_activeFades = { } # only the fades in progress, e.g. { (0, 11): Fade(...) }
 
 UDP_PORT = 6454 # is 0x1936
 
@@ -76,6 +98,16 @@ def main():
   # update stream rate
   if param_streamRate:
     timer_streamer.setInterval(1.0 / param_streamRate)
+    
+  global _keepAliveMillis
+  if param_keepAliveRate:
+    _keepAliveMillis = 1000.0 / param_keepAliveRate
+    
+  global _defaultEasing
+  _defaultEasing = getEasing(param_fadeCurve)
+  
+  global _sacnEnabled
+  _sacnEnabled = (param_sacn or EMPTY).get('enabled') == True
   
 # -->
 
@@ -88,12 +120,13 @@ def initSingleChannel(info):
   label = info['label'] or 'Default group'
   
   num = info['num']
+  universe = info.get('universe') or 0
   
   ctx = 'singleChannelFader#%s' % name
   
   e = Event(name, { 'title': name, 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'number', 'format': 'range', 'min': 0, 'max': 100 }})
   
-  def do_fade(target, period):
+  def do_fade(target, period, curve=None):
     if _rawChannels == None: return # not ready
     if target == None: return console.warn( '%s: no arg supplied' % ctx)
     if target < 0.0: return console.warn('%s: arg less than 0.0 percent' % ctx)
@@ -101,8 +134,7 @@ def initSingleChannel(info):
     
     rawValue = int(target * 255 / 100)
     
-    now = system_clock() # millis
-    _singleChannelTargets_byChannel[num] = ( _rawChannels[num-1], rawValue, now, now+period )    
+    startFade(universe, num, rawValue, period, curve)
     
     console.info('%s: setting to %s percent over %s ms' % (ctx, target, period))
     
@@ -116,17 +148,19 @@ def initSingleChannel(info):
            'schema': { 'type': 'number', 'hint': '(0.0%% - 100.0%%)', 'format': 'range', 'min': 0, 'max': 100 }})
 
   # with period parameter
-  Action('%s Timed' % name, lambda arg: do_fade(arg['target'], arg['period']), 
+  Action('%s Timed' % name, lambda arg: do_fade(arg['target'], arg['period'], arg.get('curve')), 
          { 'title': '(timed)', 'group': '"%s"' % label, 'order': next_seq(), 
            'schema': { 'type': 'object', 'properties': {
              'target': { 'type': 'number', 'hint': '(0.0%% - 100.0%%)', 'format': 'range', 'min': 0, 'max': 100, 'order': 1 },
-             'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 }}}})
+             'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 },
+             'curve': { 'type': 'string', 'enum': EASING_CURVES, 'order': 3 }}}})
     
 def init_rgbChannels(info):
   name = info['name']
   label = info['label'] or 'Default group'
   
   num = info['num']
+  universe = info.get('universe') or 0
   channels = info['channels'] # e.g. 'rgbwaiD' "w" - white, "a" - amber", "i" - infrared, "D" - dimmer, etc
 
   ctx = 'rgbChannels#%s' % name
@@ -141,7 +175,7 @@ def init_rgbChannels(info):
   
   eDimmer = Event('%s Dimmer' % name, { 'title': '(dimmer)', 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'number' }})
 
-  def do_fade(target, dimmer, period):
+  def do_fade(target, dimmer, period, curve=None):
     if _rawChannels == None: return # not ready yet
     
     # e.g. target="hsbw(180, 0, 10, 100)" OR "#rrggbb", ...
@@ -167,18 +201,11 @@ def init_rgbChannels(info):
         # e.g. when static: r = round(channelValues['r'] / 100.0 * 255 * dimmer / 100.0)
         logParts.append('%s:%s' % (c, raw)) # e.g. "r:255"
     
-    now = system_clock() # millis
-    endTime = now + period
-    
     for c in channels:
       if c not in raw_byLetter:
         continue
 
-      xChan = channels_byLetter[c]
-      startValue = _rawChannels[xChan-1]
-      targetValue = raw_byLetter[c]
-      
-      _singleChannelTargets_byChannel[xChan] = ( startValue, targetValue, now, endTime )
+      startFade(universe, channels_byLetter[c], raw_byLetter[c], period, curve)
     
     log(1, '%s: set to %s dimmer:%s over %s ms' % (ctx, ' '.join(logParts), dimmer, period))
     
@@ -186,12 +213,13 @@ def init_rgbChannels(info):
   
   Action(name, lambda arg: do_fade(arg, None, FADESMOOTH_RES), { 'title': name, 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'string', 'hint': LIGHTING_HINT }})
 
-  Action('%s Timed' % name, lambda arg: do_fade(arg['target'], eDimmer.getArg(), arg['period']), 
+  Action('%s Timed' % name, lambda arg: do_fade(arg['target'], eDimmer.getArg(), arg['period'], arg.get('curve')), 
          { 'title': '(timed)', 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'object', 'properties': {
              'target': { 'type': 'string', 'hint': LIGHTING_HINT, 'order': 1 },
-             'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 }}}})
+             'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 },
+             'curve': { 'type': 'string', 'enum': EASING_CURVES, 'order': 3 }}}})
   
-  def handle_dimmer(level, period):
+  def handle_dimmer(level, period, curve=None):
     if _rawChannels == None: return # not ready
     if level == None: return console.warn( '%s: no arg supplied' % ctx)
     if level < 0.0: return console.warn('%s: arg less than 0.0 percent' % ctx)
@@ -202,60 +230,140 @@ def init_rgbChannels(info):
     if not hasDimmer:
       # fade using pseudo dimmer
       target = e.getArg() # use existing colour (channel) target
-      do_fade(target, level, period)
+      do_fade(target, level, period, curve)
       
     else:
       # use actual dimmer channel
       rawValue = int(level * 255 / 100)
-      now = system_clock() # millis
-      dChan = channels_byLetter['D']
-      _singleChannelTargets_byChannel[dChan] = ( _rawChannels[dChan-1], rawValue, now, now+period )
+      startFade(universe, channels_byLetter['D'], rawValue, period, curve)
 
   Action('%s Dimmer' % name, lambda arg: handle_dimmer(arg, FADESMOOTH_RES), 
          { 'title': '(dimmer)', 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'number', 'hint': '(0.0%% - 100.0%%)', 'format': 'range', 'min': 0, 'max': 100, 'order': 1 }})
 
-  Action('%s Dimmer Timed' % name, lambda arg: handle_dimmer(arg['level'], arg['period']), { 'title': '(dimmer timed)', 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'object', 'properties': {
+  Action('%s Dimmer Timed' % name, lambda arg: handle_dimmer(arg['level'], arg['period'], arg.get('curve')), { 'title': '(dimmer timed)', 'group': '"%s"' % label, 'order': next_seq(), 'schema': { 'type': 'object', 'properties': {
            'level': { 'type': 'number', 'hint': '(0.0%% - 100.0%%)', 'format': 'range', 'min': 0, 'max': 100, 'order': 1 },
-           'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 }}}})
+           'period': { 'type': 'integer', 'hint': '(in ms)', 'order': 2 },
+           'curve': { 'type': 'string', 'enum': EASING_CURVES, 'order': 3 }}}})
 
   
+# <!-- fade scheduler
+
+import math
+
+EASING_RES = 256 # lookup table resolution
+
+def newEasingTable(f):
+  return [ f(float(i) / EASING_RES) for i in range(EASING_RES + 1) ]
+
+# progress (0.0 - 1.0) to output (0.0 - 1.0)
+EASING_TABLES = { 'linear':     newEasingTable(lambda x: x),
+                  's-curve':    newEasingTable(lambda x: (1 - math.cos(math.pi * x)) / 2),
+                  'square-law': newEasingTable(lambda x: x * x),
+                  'log':        newEasingTable(lambda x: math.log10(1 + 9 * x)) }
+
+def getEasing(curve):
+  return EASING_TABLES.get(curve) or EASING_TABLES['linear']
+
+_defaultEasing = getEasing('linear')
+
+class Fade:
+  def __init__(self, frame, index, startValue, target, startTime, period, easing):
+    self.frame = frame
+    self.index = index
+    self.startValue = startValue
+    self.diff = target - startValue
+    self.target = target
+    self.startTime = startTime
+    self.period = period
+    self.easing = easing
+
+def getFrame(universe):
+  frame = _frames_byUniverse.get(universe)
+
+  if frame == None:
+    # (universe 0 is synced from the device, others start dark)
+    frame = ArtDmxFrame(universe)
+    _frames_byUniverse[universe] = frame
+
+  return frame
+
+def startFade(universe, chan, target, period, curve=None):
+  frame = getFrame(universe)
+  key = (universe, chan)
+
+  startValue = frame[chan-1]
+
+  if period <= 0 or startValue == target:
+    # nothing to fade (and supersedes any fade in progress)
+    frame[chan-1] = target
+    _activeFades.pop(key, None)
+    return
+
+  easing = getEasing(curve) if curve else _defaultEasing
+
+  _activeFades[key] = Fade(frame, chan-1, startValue, target, system_clock(), period, easing)
+
+def tickFades(now):
+  doneWith = list()
+
+  for key, fade in _activeFades.iteritems():
+    elapsed = now - fade.startTime
+
+    if elapsed >= fade.period:
+      fade.frame[fade.index] = fade.target
+      doneWith.append(key)
+
+    else:
+      fade.frame[fade.index] = fade.startValue + int(fade.diff * fade.easing[elapsed * EASING_RES / fade.period])
+
+  # finished fades are no longer visited
+  for key in doneWith:
+    del _activeFades[key]
+
+local_event_StreamStats = LocalEvent({'group': 'Debug', 'order': 10000+next_seq(), 'desc': 'Fade scheduler and streaming statistics (every 10s)',
+                                      'schema': {'type': 'object', 'properties': {
+                                        'activeFades': {'type': 'integer', 'order': 1},
+                                        'framesSent': {'type': 'integer', 'order': 2},
+                                        'tickAvg': {'type': 'number', 'title': 'Tick avg. (ms)', 'order': 3},
+                                        'tickMax': {'type': 'integer', 'title': 'Tick max. (ms)', 'order': 4}}}})
+
+_streamStats = { 'ticks': 0, 'tickTotal': 0, 'tickMax': 0, 'framesSent': 0 }
+
+def emitStreamStats():
+  ticks = _streamStats['ticks']
+
+  local_event_StreamStats.emit({ 'activeFades': len(_activeFades), 'framesSent': _streamStats['framesSent'],
+                                 'tickAvg': round(float(_streamStats['tickTotal']) / ticks, 2) if ticks > 0 else 0,
+                                 'tickMax': _streamStats['tickMax'] })
+
+  _streamStats['ticks'] = _streamStats['tickTotal'] = _streamStats['tickMax'] = _streamStats['framesSent'] = 0
+
+timer_streamStats = Timer(emitStreamStats, 10, 10)
+
+# fade scheduler -->
+
 def stream():
   if _rawChannels == None:
     # have not synced buffer
     return
- 
-  # _singleChannelTargets_byChannel[num] = ( rawValue, now, now+FADESMOOTH_RES )    
-  # _rawChannels[num-1] = rawValue
-  
-  now = system_clock() # millis  
-  
-  # deal with targets
-  doneWith = list()
-  
-  for chan in _singleChannelTargets_byChannel:
-    current = _rawChannels[chan-1] # e.g. going from 200 to 255
-    startValue, target, startTime, endTime = _singleChannelTargets_byChannel[chan]
-    
-    # range
-    diffValue = target - startValue
-    
-    # percentage time into operation
-    #                         progress / total time
-    totalTime = (endTime - startTime)
-    if totalTime == 0: percTime = 1.0
-    else:              percTime = (now - startTime) * 1.0 / totalTime
-    
-    if percTime >= 1.0:
-      newValue = target
-    else:
-      newValue = int(startValue + diffValue * percTime)
-    
-    if current != target:
-      log(2, 'autoramping: diffValue:%s newValue:%s perc:%s' % (diffValue, newValue, percTime))
-    
-    _rawChannels[chan-1] = newValue
-  
-  sendDmx(0, 0, _rawChannels)
+
+  now = system_clock() # millis
+
+  tickFades(now)
+
+  # only send when something has changed, or to keep the device alive
+  for frame in _frames_byUniverse.itervalues():
+    if frame.dirty or now - frame.lastSent >= _keepAliveMillis:
+      sendFrame(frame, now)
+      _streamStats['framesSent'] += 1
+
+  tickTime = system_clock() - now
+  _streamStats['ticks'] += 1
+  _streamStats['tickTotal'] += tickTime
+  if tickTime > _streamStats['tickMax']:
+    _streamStats['tickMax'] = tickTime
+
+_keepAliveMillis = 1000.0 / DEFAULT_KEEPALIVE_RATE
 
 timer_streamer = Timer(stream, intervalInSeconds=(1.0 / DEFAULT_STREAM_RATE), firstDelayInSeconds=5)
 
@@ -288,7 +396,10 @@ def syncChannels():
   
   if _rawChannels == None:
     # this is first time so ensure data consistency
-    rawChannels = [ v for v in channels ]
+    rawChannels = ArtDmxFrame(0, len(channels))
+    for i, v in enumerate(channels):
+      rawChannels[i] = v
+    _frames_byUniverse[0] = rawChannels
     _rawChannels = rawChannels
     
   else:
@@ -307,29 +418,112 @@ def syncOnce():
   
 timer_syncOnce = Timer(syncOnce, 30, 5, stopped=True) # every 30 secs, first after 5
    
-_seq = 0
-
-P_ArtDMX = '0050' # hex
-
-def sendDmx(subnet, universe, channels):
-  global _seq
-  
-  p = list()
-  p.append('Art-Net'.encode('hex') + '00')
-  p.append(P_ArtDMX)
-  p.append(toU16bits(14).encode('hex'))
-  p.append(toU8bits(_seq).encode('hex'))
-  p.append('00') # "physical" not sure what this is
-  p.append(toU16bits(universe).encode('hex'))
-  
-  count = len(channels)
-  p.append(toU16bits(count).encode('hex'))
-  
-  for b in channels:
-    p.append(toU8bits(b).encode('hex'))
-  
-  _seq = (_seq + 1) % 256
-  udp.sendTo('%s:%s' % (_ipAddress, UDP_PORT), ''.join(p).decode('hex'))
+P_ArtDMX = '\x00\x50' # OpCode (little-endian 0x5000)
+
+ARTDMX_HEADER_LEN = 18
+ARTDMX_SEQ_OFFSET = 12
+
+class ArtDmxFrame:
+  '''A complete ArtDMX packet; the header is prepared once and channel values are written in place'''
+
+  def __init__(self, portAddress, count=512):
+    self.packet = bytearray(ARTDMX_HEADER_LEN + count)
+    self.count = count
+    self.portAddress = portAddress # i.e. Net (7 bits), Sub-Net (4 bits), Universe (4 bits)
+
+    self.packet[0:ARTDMX_HEADER_LEN] = ''.join([ 'Art-Net\x00',
+                                                 P_ArtDMX,
+                                                 toU16bits(14),                       # protocol version
+                                                 '\x00',                              # sequence (set on send)
+                                                 '\x00',                              # "physical" not sure what this is
+                                                 toU8bits(portAddress),               # SubUni
+                                                 toU8bits((portAddress >> 8) & 0x7f), # Net
+                                                 toU16bits(count) ])
+
+    self.seq = 0
+    self.dirty = True  # any changes since last sent
+    self.lastSent = 0  # (millis)
+
+    self.e131Header = newE131Header(portAddress + 1, count) if _sacnEnabled else None
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, i):
+    return self.packet[ARTDMX_HEADER_LEN + i]
+
+  def __setitem__(self, i, value):
+    value = value & 0xff
+
+    if self.packet[ARTDMX_HEADER_LEN + i] != value:
+      self.packet[ARTDMX_HEADER_LEN + i] = value
+      self.dirty = True
+
+def sendFrame(frame, now):
+  seq = frame.seq
+  frame.seq = (seq + 1) % 256
+
+  frame.dirty = False
+  frame.lastSent = now
+
+  frame.packet[ARTDMX_SEQ_OFFSET] = seq
+  udp.sendTo('%s:%s' % (_ipAddress, UDP_PORT), str(frame.packet))
+
+  if frame.e131Header != None:
+    frame.e131Header[E131_SEQ_OFFSET] = seq
+    udp.sendTo(e131Address(frame.portAddress + 1), str(frame.e131Header) + str(frame.packet[ARTDMX_HEADER_LEN:]))
+
+# <!-- sACN (E1.31)
+
+SACN_PORT = 5568
+SACN_SOURCE_NAME = 'Nodel'
+
+E131_HEADER_LEN = 126 # incl. DMX start code
+E131_SEQ_OFFSET = 111
+
+_sacnEnabled = False # (set in main)
+
+def e131Address(universe):
+  # multicast 239.255.{hi}.{lo}
+  return '239.255.%s.%s:%s' % ((universe >> 8) & 0xff, universe & 0xff, SACN_PORT)
+
+def newE131Header(universe, count):
+  import hashlib
+
+  priority = (param_sacn or EMPTY).get('priority') or 100
+
+  # component identifier must stay the same for this source
+  cid = hashlib.md5('nodel:%s' % _node.getName()).digest()
+
+  total = E131_HEADER_LEN + count
+
+  return bytearray(''.join([
+    # root layer
+    toU16bits(0x0010),                      # preamble size
+    toU16bits(0x0000),                      # post-amble size
+    'ASC-E1.17\x00\x00\x00',                # ACN packet identifier
+    toU16bits(0x7000 | (total - 16)),       # flags & length
+    toU32bits(0x00000004),                  # vector (E1.31 data)
+    cid,
+    # framing layer
+    toU16bits(0x7000 | (total - 38)),       # flags & length
+    toU32bits(0x00000002),                  # vector (DMP)
+    SACN_SOURCE_NAME.ljust(64, '\x00'),     # source name
+    toU8bits(priority),
+    toU16bits(0),                           # synchronisation address
+    '\x00',                                 # sequence (set on send)
+    '\x00',                                 # options
+    toU16bits(universe),
+    # DMP layer
+    toU16bits(0x7000 | (total - 115)),      # flags & length
+    '\x02',                                 # vector (set property)
+    '\xa1',                                 # address & data type
+    toU16bits(0x0000),                      # first property address
+    toU16bits(0x0001),                      # address increment
+    toU16bits(count + 1),                   # property value count (incl. start code)
+    '\x00' ]))                              # DMX start code
+
+# sACN -->
 
 def udp_received(src, data):
   hexData = data.encode('hex')
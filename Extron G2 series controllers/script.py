@@ -74,6 +74,57 @@ def main(arg = None):
     
     print 'Driver binding will occur on intial TCP connection...'
     
+# <!--- status polling
+
+# All status polling shares one scheduler instead of timers per port. Each round refreshes every bound port's
+# status ('info') items over the telnet session (once per distinct command) and calls the reserved nodes' status
+# poll actions.
+
+STATUS_POLL_INTERVAL = 5*60  # seconds
+STATUS_CHECK_INTERVAL = 8*60
+
+class StatusPollScheduler:
+    def __init__(self):
+        self._retrievers = {}     # handlers by retrieve command, e.g. { 'W1,2,100LE|': [handler, ...] }
+        self._remotePollers = []  # reserved nodes' poller actions
+        self._checks = []
+
+    def addRetriever(self, cmd, handler):
+        handlers = self._retrievers.get(cmd)
+        if handlers is None:
+            handlers = list()
+            self._retrievers[cmd] = handlers
+
+        handlers.append(handler)
+
+    def clearRetrievers(self):
+        # (ports are rebound on every connection)
+        self._retrievers.clear()
+
+    def addRemotePoller(self, poller):
+        self._remotePollers.append(poller)
+
+    def addCheck(self, check):
+        self._checks.append(check)
+
+    def pollRound(self):
+        for cmd, handlers in self._retrievers.items():
+            tcp.request(cmd, lambda data, handlers=handlers: [ handler(data) for handler in handlers ])
+
+        for poller in self._remotePollers:
+            poller.call()
+
+    def checkAll(self):
+        for check in self._checks:
+            check()
+
+statusPollScheduler = StatusPollScheduler()
+
+timer_statusPollRound = Timer(lambda: statusPollScheduler.pollRound(), STATUS_POLL_INTERVAL, 10)
+timer_statusCheckRound = Timer(lambda: statusPollScheduler.checkAll(), STATUS_CHECK_INTERVAL, 10)
+
+# status polling ---!>
+
 def initStatusPoller(nodeName):
     lastContact = Event('%s Last Status Poll Feedback' % nodeName, {'group': 'Status Polling', 'order': next_seq(), 'schema': {'type': 'string'}})
     
@@ -85,8 +136,8 @@ def initStatusPoller(nodeName):
     
     poller = Action('%s Status Poller' % nodeName, lambda arg: remoteAction.call(), {'group': 'Status Polling', 'order': next_seq()})
     
-    # poll every 5 minutes
-    Timer(lambda: poller.call(), 5*60, 10)
+    # polled every 5 minutes along with everything else
+    statusPollScheduler.addRemotePoller(poller)
       
     def remoteHandler(arg=None):
       lastContact.emit(str(date_now()))
@@ -94,13 +145,12 @@ def initStatusPoller(nodeName):
     remoteEvent = create_remote_event('%s Status Poll Feedback' % nodeName, remoteHandler)
     
     def diffCheck():
-      lastContactDateMillis = 0 if len(lastContact.getArg() or '') == 0 else date_parse(lastContact.getArg()).getMillis()
-      
       if lastContact.getArg() == None:
         statusEvent.emit({'level': 5, 'message': 'Always been missing'})
         
       else:
-        roughDiff = (date_now().getMillis() - lastContactDateMillis)/1000/60
+        previousContact = date_parse(lastContact.getArg())
+        roughDiff = (date_now().getMillis() - previousContact.getMillis())/1000/60
         
         level = 2
         
@@ -119,8 +169,8 @@ def initStatusPoller(nodeName):
         
         statusEvent.emit({'level': level, 'message': message})
     
-    # check every 8 minutes
-    Timer(diffCheck, 8*60, 10)
+    # checked every 8 minutes
+    statusPollScheduler.addCheck(diffCheck)
     
 def bindEverything():
     print 'Extracted IR commands'
@@ -128,14 +178,13 @@ def bindEverything():
     
     if param_useControlSummary:
       
-      urls = extractPortURLs(urlBase, controlSummaryPath)
+      # every port is bound in one pass from the (cached) documents
+      documents = loadDocuments(urlBase, controlSummaryPath)
     
-      print 'Extracted device URLs:', urls
-
-      for url in urls:
-          bindPort(url)
+      print 'Extracted device URLs:', [ url for (url, configXML) in documents ]
 
- 	  bindPort(controlSummaryPath)
+      for (url, configXML) in documents:
+          bindPort(url, configXML)
         
 def unbindEverything():
     for port in ports:
@@ -145,6 +194,8 @@ def unbindEverything():
         
     ports.clear()
     _uniqueNames.clear()
+    
+    statusPollScheduler.clearRetrievers()
         
 local_event_TCPConnected = LocalEvent({ 'desc': 'When a TCP connection occurs.', 'group': 'Comms' })
 local_event_TCPDisconnected = LocalEvent({ 'desc': 'When a TCP disconnection occurs.', 'group': 'Comms' })
@@ -174,10 +225,12 @@ def tcp_connected():
     # receive the files
     # listFiles()
     
-    bindEverything()
+    # (firmware and MAC address identify the cached control summary)
+    requestIdentity(bindEverything)
     
 def tcp_disconnected():
     local_event_TCPDisconnected.emit()
+    _connectionSeq[0] += 1
     ping_timer.stop()
     
     unbindEverything()
@@ -233,9 +286,9 @@ ping_timer = Timer(lambda: local_action_RequestFirmware(), 60, stopped=True)
 # key might be '1,2,3' or '1,2,3,4'
 eventCallbacks = {}
 
-def bindPort(url):
+def bindPort(url, configXML):
     console.info('Binding port against URL "%s"' % url)
-    port = ExtronPort(url)
+    port = ExtronPort(url, configXML)
     name = url
 
     try:
@@ -279,8 +332,9 @@ class EventInfo:
         self.cmd_down = cmd_down
 
 class ExtronPort:
-    def __init__(self, url):
+    def __init__(self, url, configXML):
         self.url = url
+        self.configXML = configXML
         self.warnings = [] # any warnings that occur during parsing
         self.infos = [] # info a user of the driver might find useful
         self.eventLookups = {} # event callback lookups
@@ -288,9 +342,7 @@ class ExtronPort:
         ports.add(self)
 
     def parse(self):
-        configXML = getURL(self.url)
-        
-        content = ET.fromstring(configXML)
+        content = ET.fromstring(self.configXML)
         
         # ...
         # <group device="0" heading="Integra DTR-5.8" dev_type_id="27" driver_info="Integra DTR-5.8">
@@ -449,6 +501,9 @@ class ExtronPort:
                                                                'group': commandLabel,
                                                                'order': nextSeqNum() })
 
+        # and refreshed with every status poll round
+        statusPollScheduler.addRetriever(retrieve_cmd, lambda data: handleFeedback(data, events))
+
     # <command label="Power" control-rowlimit="3" command-priority="2" id="1" show="1">
     #   <item cmddown="W1,2,76,1LE|" current="W1,2,104LE|" type="set" compare="1" item-priority="1">On</item>
     #   <item cmddown="W1,2,76,3LE|" current="W1,2,104LE|" type="set" compare="3" item-priority="2">Off</item>
@@ -971,16 +1026,12 @@ def extractPortNumber(xmlElement):
 #    </summarygroup>
 # </summary>
 # 
-def extractPortURLs(baseURL, filename):
+def extractPortURLs(baseURL, rootXML):
     '''
     Returns a list of full URLs by exploring a 'gv-ctlsum_1_user' list file.
     baseURL: http://192.168.178.205
-    filename: gc2/gv-ctlsum_1_user.xml
+    rootXML: (content of gc2/gv-ctlsum_1_user.xml)
     '''
-    dest = baseURL + '/' + filename
-    console.info('Retrieving %s' % dest)
-    rootXML = getURL(dest)
-        
     root = ET.fromstring(rootXML)
     
     # don't care where they exist, just extract all the <device> elements
@@ -1033,6 +1084,186 @@ STRING_SCHEMA = { "name" : "A name",
                   "title" : "Value", 
                   "type" : "string" }
 
+# <!--- control summary cache
+
+# The control summary and every port document it lists are kept on disk per controller (by MAC address, as the
+# closest thing to a serial number available over SIS, and firmware) so reconnections only revalidate them using
+# conditional GETs instead of downloading them all again. If the web server can't be reached, the cached copies
+# are used.
+
+import re
+
+from java.io import File
+from org.nodel.io import Stream
+
+CONTROLSUMMARY_CACHE_DIR = 'controlSummaryCache'
+
+local_event_MACAddress = LocalEvent({'title': 'MAC address', 'group': 'Comms', 'schema': {'type': 'string'}})
+
+local_event_ControlSummaryCache = LocalEvent({'title': 'Control summary cache', 'group': 'Comms', 'order': 9999+next_seq(), 'schema': {'type': 'object', 'properties': {
+        'documents': {'type': 'integer', 'order': 1},
+        'unchanged': {'type': 'integer', 'title': 'Unchanged (revalidated)', 'order': 2},
+        'downloaded': {'type': 'integer', 'order': 3},
+        'stale': {'type': 'integer', 'title': 'Stale (server unreachable)', 'order': 4}}}})
+
+def getHeader(resp, name):
+    # (header names are loosely capitalised)
+    headers = getattr(resp, 'headers', None) or {}
+    
+    for key in headers:
+        if key != None and key.lower() == name.lower():
+            value = headers[key]
+            if isinstance(value, basestring):
+                return value
+            
+            return value[0] if len(value or '') > 0 else None
+
+class ControlSummaryCache:
+    '''Documents by URL, persisted per controller (if it could be identified)'''
+    
+    def __init__(self, key):
+        self._file = File(File(_node.getRoot(), CONTROLSUMMARY_CACHE_DIR), '%s.json' % key) if key else None
+        
+        # e.g. { 'http://.../gc2/gv-portserial1ctl.xml': {'etag': ..., 'modified': ..., 'content': '<?xml ...'}}
+        self._entries = {}
+        self._used = {}
+        self._changed = False
+        
+        self.stats = { 'documents': 0, 'unchanged': 0, 'downloaded': 0, 'stale': 0 }
+        
+        if self._file is not None and self._file.exists():
+            try:
+                self._entries = json_decode(Stream.readFully(self._file)) or {}
+            except:
+                console.warn('Control summary cache could not be read; will start afresh')
+    
+    def get(self, url):
+        '''Returns the document, only downloading it if it has changed'''
+        cached = self._entries.get(url)
+        
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            
+            if cached.get('modified'):
+                headers['If-Modified-Since'] = cached['modified']
+        
+        self.stats['documents'] += 1
+        
+        try:
+            resp = get_url(url, headers=headers, fullResponse=True)
+        
+        except:
+            if cached is None:
+                raise
+            
+            resp = None
+        
+        if resp is not None and resp.statusCode == 304 and cached is not None:
+            self.stats['unchanged'] += 1
+        
+        elif resp is not None and resp.statusCode == 200:
+            self.stats['downloaded'] += 1
+            
+            cached = { 'etag': getHeader(resp, 'ETag'), 'modified': getHeader(resp, 'Last-Modified'), 'content': resp.content }
+            self._entries[url] = cached
+            self._changed = True
+        
+        elif cached is not None:
+            self.stats['stale'] += 1
+        
+        else:
+            raise Exception('%s %s' % (resp.statusCode, resp.reasonPhrase))
+        
+        self._used[url] = cached
+        
+        return cached['content']
+    
+    def save(self):
+        # only keep what was used this time around
+        if len(self._used) != len(self._entries):
+            self._changed = True
+        
+        if self._file is None or not self._changed:
+            return
+        
+        self._file.getParentFile().mkdirs()
+        Stream.writeFully(self._file, json_encode(self._used))
+        
+        self._entries = self._used
+        self._changed = False
+
+def controllerKey():
+    mac = local_event_MACAddress.getArg()
+    firmware = local_event_Firmware.getArg()
+    
+    if not mac or not firmware:
+        return None
+    
+    return re.sub('[^0-9A-Za-z.-]', '_', '%s_%s' % (mac.strip(), firmware.strip()))
+
+def loadDocuments(baseURL, filename):
+    '''Returns (url, XML) of every port listed in the control summary'''
+    cache = ControlSummaryCache(controllerKey())
+    
+    dest = baseURL + '/' + filename
+    console.info('Retrieving %s' % dest)
+    
+    urls = extractPortURLs(baseURL, cache.get(dest))
+    
+    documents = list()
+    
+    for url in urls:
+        try:
+            documents.append((url, cache.get(url)))
+        
+        except Exception, e:
+            console.error('%s: ERROR - %s' % (url, e))
+            
+            if strictParse:
+                raise
+    
+    cache.save()
+    
+    if cache.stats['stale'] > 0:
+        console.warn('%s document(s) could not be retrieved; using cached copies' % cache.stats['stale'])
+    
+    local_event_ControlSummaryCache.emit(cache.stats)
+    
+    return documents
+
+IDENTITY_TIMEOUT = 15 # seconds
+
+_connectionSeq = [0]
+
+def requestIdentity(then):
+    '''Requests the firmware and MAC address, then carries on (regardless, after a while)'''
+    connectionSeq = _connectionSeq[0]
+    done = [False]
+    
+    def carryOn():
+        if done[0] or connectionSeq != _connectionSeq[0]:
+            return
+        
+        done[0] = True
+        then()
+    
+    def handleMAC(resp):
+        local_event_MACAddress.emit(resp.strip())
+        carryOn()
+    
+    def handleFirmware(resp):
+        local_event_Firmware.emit(resp)
+        tcp.request('\x1BCH', handleMAC)
+    
+    tcp.request('q', handleFirmware)
+    
+    # (in case either goes unanswered)
+    call_safe(carryOn, IDENTITY_TIMEOUT)
+
+# control summary cache ---!>
+
 # status ---
 
 local_event_Status = LocalEvent({'title': 'Status', 'group': 'Status', 'order': 9990, "schema": { 'title': 'Status', 'type': 'object', 'properties': {
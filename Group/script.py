@@ -46,7 +46,7 @@ def initMember(memberInfo):
 membersBySignal = {}
     
 def initSignalSupport(name, mode, signalName, states, disappears, isGroup):
-  members = getMembersInfoOrRegister(signalName, name)
+  getMembersInfoOrRegister(signalName, name)
   
   # establish local signals if haven't done so already
   localDesiredSignal = lookup_local_event('Desired %s' % signalName)
@@ -67,6 +67,10 @@ def initSignalSupport(name, mode, signalName, states, disappears, isGroup):
       # for group member, add remote action to handle the 'propogation' flags  
       create_remote_action('Member %s %s Extended' % (name, signalName), {'title': '"%s" %s (extended)' % (name, signalName), 'group': 'Members (%s)' % signalName, 'schema': {'type': 'string', 'enum': states}},
                            suggestedNode=name, suggestedAction=signalName)    
+      
+    # for propagation metrics (see propagation dispatcher below)
+    if lookup_local_event('Member %s Propagation Latency' % name) == None:
+      Event('Member %s Propagation Latency' % name, {'title': '"%s" propagation latency (ms)' % name, 'group': '(advanced)', 'order': 9999+next_seq(), 'schema': {'type': 'integer'}})
   
   # establish a remote signal to receive status
   # signal status states include 'Partially ...' forms
@@ -74,18 +78,8 @@ def initSignalSupport(name, mode, signalName, states, disappears, isGroup):
   
   localMemberSignal = Event('Member %s %s' % (name, signalName), {'title': '"%s" %s' % (name, signalName), 'group': 'Members\' "%s"' % signalName, 'order': 9999+next_seq(), 'schema': {'type': 'string', 'enum': resultantStates}})
   
-  def aggregateMemberSignals():
-    shouldBeState = localDesiredSignal.getArg()
-    partially = False
-    
-    for memberName in members:
-      if lookup_local_event('Member %s %s' % (memberName, signalName)).getArg() != shouldBeState:
-        partially = True
-        
-    localResultantSignal.emit('Partially %s' % shouldBeState if partially else shouldBeState)
-    
-  localMemberSignal.addEmitHandler(lambda arg: aggregateMemberSignals())
-  localDesiredSignal.addEmitHandler(lambda arg: aggregateMemberSignals())
+  # aggregation is incremental (see aggregation engine below)
+  getSignalAggregator(signalName, localDesiredSignal, localResultantSignal).addMember(name, localMemberSignal)
   
   def handleRemoteEvent(arg):
     if arg == True or arg == 1:
@@ -122,14 +116,14 @@ def initSignal(signalName, mode, states):
       if noPropagate:
         return
       
+      calls = list()
+      
       for memberName in membersBySignal[signalName]:
-        remoteAction = lookup_remote_action('Member %s %s' % (memberName, signalName))
-        if remoteAction != None:
-          remoteAction.call(state)
-
-        remoteActionExtended = lookup_remote_action('Member %s %s Extended' % (memberName, signalName))
-        if remoteActionExtended != None:
-          remoteActionExtended.call(complexArg)
+        calls.append((memberName, 'Member %s %s' % (memberName, signalName), state))
+        calls.append((memberName, 'Member %s %s Extended' % (memberName, signalName), complexArg))
+        
+      # (see propagation dispatcher below)
+      getDispatcher().propagate(signalName, calls)
           
   # create action
   def handleSimpleOrComplexArg(arg):
@@ -165,8 +159,8 @@ STATUS_SCHEMA = { 'type': 'object', 'properties': {
 EMPTY_SET = {}
   
 def initStatusSupport(name, disappears):
-  # look up the members structure (assume
-  members = getMembersInfoOrRegister('Status', name)
+  # register the member
+  getMembersInfoOrRegister('Status', name)
   
   # check if this node has a status yet
   selfStatusSignal = lookup_local_event('Status')
@@ -181,53 +175,8 @@ def initStatusSupport(name, disappears):
   
   Action('Member %s Status Suppressed' % name, lambda arg: memberStatusSuppressedSignal.emit(arg), {'title': 'Suppress "%s" Status' % name, 'group': 'Status Suppression', 'order': 9999+next_seq(), 'schema': {'type': 'boolean'}})
   
-  def aggregateMemberStatus():
-    aggregateLevel = 0
-    aggregateMessage = 'OK'
-    
-    # for composing the aggegate message at the end
-    msgs = []
-    
-    activeSuppression = False
-    
-    for memberName in members:
-      suppressed = lookup_local_event('Member %s Status Suppressed' % memberName).getArg()
-      
-      memberStatus = lookup_local_event('Member %s Status' % memberName).getArg() or EMPTY_SET
-      
-      memberLevel = memberStatus.get('level')
-      if memberLevel == None: # as opposed to the value '0'
-        if suppressed:
-          activeSuppression = True
-          continue
-          
-        memberLevel = 99
-
-      if memberLevel > aggregateLevel:
-        # raise the level (if not suppressed)
-        if suppressed:
-          activeSuppression = True
-          continue
-        
-        aggregateLevel = memberLevel
-      
-      memberMessage = memberStatus.get('message') or 'Has never been seen'
-      if memberLevel > 0:
-        if isBlank(memberMessage):
-          msgs.append(memberName)
-        else:
-          msgs.append('%s: [%s]' % (memberName, memberMessage))
-          
-    if len(msgs) > 0:
-      aggregateMessage = ', '.join(msgs)
-      
-    if activeSuppression:
-      aggregateMessage = '%s (*)' % aggregateMessage
-      
-    selfStatusSignal.emit({'level': aggregateLevel, 'message': aggregateMessage})
-      
-  memberStatusSignal.addEmitHandler(lambda arg: aggregateMemberStatus())
-  memberStatusSuppressedSignal.addEmitHandler(lambda arg: aggregateMemberStatus())
+  # aggregation is incremental (see aggregation engine below)
+  getStatusAggregator(selfStatusSignal).addMember(name, memberStatusSignal, memberStatusSuppressedSignal)
   
   def handleRemoteEvent(arg):
     memberStatusSignal.emit(arg)
@@ -240,6 +189,338 @@ def initStatusSupport(name, disappears):
   
 # members and status support ---!>
 
+# <!--- aggregation engine
+
+# Members' signals and statuses are aggregated incrementally using pre-resolved events
+# instead of rescanning every member whenever any single member emits (was O(n) per emit).
+
+aggregatorsBySignal = {}
+
+def getSignalAggregator(signalName, localDesiredSignal, localResultantSignal):
+  aggregator = aggregatorsBySignal.get(signalName)
+  if aggregator == None:
+    aggregator = SignalAggregator(localDesiredSignal, localResultantSignal)
+    aggregatorsBySignal[signalName] = aggregator
+
+  return aggregator
+
+class SignalAggregator:
+  '''Keeps a count of members per signal value so the resultant signal can be derived without a rescan'''
+
+  def __init__(self, desiredSignal, resultantSignal):
+    self._desiredSignal = desiredSignal
+    self._resultantSignal = resultantSignal
+
+    self._valueByMember = {} # e.g. { 'PC': 'On', 'Display': 'Off' }
+    self._countByValue = {}  # e.g. { 'On': 5, 'Off': 1, None: 2 }
+
+    desiredSignal.addEmitHandler(lambda arg: self.aggregate())
+
+  def addMember(self, name, memberSignal):
+    # seed with the current (possibly persisted) value
+    value = memberSignal.getArg()
+    self._valueByMember[name] = value
+    self._countByValue[value] = self._countByValue.get(value, 0) + 1
+
+    memberSignal.addEmitHandler(lambda arg: self.memberChanged(name, arg))
+
+  def memberChanged(self, name, value):
+    oldValue = self._valueByMember.get(name)
+
+    if oldValue != value:
+      self._countByValue[oldValue] -= 1
+      self._countByValue[value] = self._countByValue.get(value, 0) + 1
+      self._valueByMember[name] = value
+
+    self.aggregate()
+
+  def aggregate(self):
+    shouldBeState = self._desiredSignal.getArg()
+
+    partially = self._countByValue.get(shouldBeState, 0) != len(self._valueByMember)
+
+    self._resultantSignal.emit('Partially %s' % shouldBeState if partially else shouldBeState)
+
+_statusAggregator = None
+
+def getStatusAggregator(selfStatusSignal):
+  global _statusAggregator
+
+  if _statusAggregator == None:
+    _statusAggregator = StatusAggregator(selfStatusSignal)
+
+  return _statusAggregator
+
+class StatusAggregator:
+  '''Keeps per-member status levels so the aggregate status can be derived without a rescan'''
+
+  def __init__(self, selfStatusSignal):
+    self._selfStatusSignal = selfStatusSignal
+
+    self._orderByMember = {}         # for composing the aggregate message in member order
+    self._levelByMember = {}         # levels of the unsuppressed members
+    self._countByLevel = {}          # e.g. { 0: 10, 2: 1, 99: 1 }
+    self._msgByMember = {}           # only members with a level above 0
+    self._suppressingMembers = set() # suppressed members that would otherwise raise the level
+
+  def addMember(self, name, memberStatusSignal, memberStatusSuppressedSignal):
+    self._orderByMember[name] = len(self._orderByMember)
+
+    def handleMemberEmit(arg):
+      self.memberChanged(name, memberStatusSignal.getArg(), memberStatusSuppressedSignal.getArg())
+      self.aggregate()
+
+    memberStatusSignal.addEmitHandler(handleMemberEmit)
+    memberStatusSuppressedSignal.addEmitHandler(handleMemberEmit)
+
+    # seed with the current (possibly persisted) state
+    self.memberChanged(name, memberStatusSignal.getArg(), memberStatusSuppressedSignal.getArg())
+
+  def memberChanged(self, name, memberStatus, suppressed):
+    # take away any previous contribution
+    oldLevel = self._levelByMember.pop(name, None)
+    if oldLevel != None:
+      self._countByLevel[oldLevel] -= 1
+      if self._countByLevel[oldLevel] == 0:
+        del self._countByLevel[oldLevel]
+
+    self._msgByMember.pop(name, None)
+    self._suppressingMembers.discard(name)
+
+    memberStatus = memberStatus or EMPTY_SET
+
+    memberLevel = memberStatus.get('level')
+    if memberLevel == None: # as opposed to the value '0'
+      memberLevel = 99
+
+    if memberLevel > 0 and suppressed:
+      self._suppressingMembers.add(name)
+      return
+
+    self._levelByMember[name] = memberLevel
+    self._countByLevel[memberLevel] = self._countByLevel.get(memberLevel, 0) + 1
+
+    if memberLevel > 0:
+      memberMessage = memberStatus.get('message') or 'Has never been seen'
+      if isBlank(memberMessage):
+        self._msgByMember[name] = name
+      else:
+        self._msgByMember[name] = '%s: [%s]' % (name, memberMessage)
+
+  def aggregate(self):
+    # there are only ever a handful of distinct levels
+    aggregateLevel = max(self._countByLevel) if len(self._countByLevel) > 0 else 0
+    aggregateMessage = 'OK'
+
+    # only members with something to report are visited
+    if len(self._msgByMember) > 0:
+      names = sorted(self._msgByMember, key=lambda name: self._orderByMember[name])
+      aggregateMessage = ', '.join([self._msgByMember[name] for name in names])
+
+    if len(self._suppressingMembers) > 0:
+      aggregateMessage = '%s (*)' % aggregateMessage
+
+    self._selfStatusSignal.emit({'level': aggregateLevel, 'message': aggregateMessage})
+
+# aggregation engine ---!>
+
+# <!--- propagation dispatcher
+
+# Members' remote actions are called with bounded concurrency so a slow or unreachable member
+# does not hold up the rest of the group. A newer value always replaces one still queued for the same
+# member action and is coalesced with an identical one in flight (or queued). A call that times out is
+# reported as such but keeps its worker until it actually returns.
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 10 # seconds
+
+param_propagation = Parameter({'title': 'Propagation', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+   'concurrency': {'title': 'Max. concurrent member calls', 'type': 'integer', 'hint': str(DEFAULT_CONCURRENCY), 'order': 1},
+   'timeout': {'title': 'Member call timeout (s)', 'type': 'integer', 'hint': str(DEFAULT_TIMEOUT), 'order': 2}
+}}})
+
+PROPAGATION_LATENCY_SCHEMA = {'type': 'object', 'properties': {
+                                'signal': {'type': 'string', 'order': 1},
+                                'members': {'type': 'integer', 'order': 2},
+                                'total': {'type': 'integer', 'title': 'Total (ms)', 'order': 3},
+                                'slowest': {'type': 'string', 'order': 4},
+                                'timeouts': {'type': 'integer', 'order': 5}}}
+
+local_event_PropagationLatency = LocalEvent({'title': 'Propagation latency', 'group': '(advanced)', 'order': 9999+next_seq(), 'schema': PROPAGATION_LATENCY_SCHEMA})
+
+class PropagationWave:
+  '''A single fan-out to all members, used for the total latency metric'''
+
+  def __init__(self, signalName):
+    self.signalName = signalName
+    self.started = system_clock()
+    self.outstanding = 0
+    self.members = 0
+    self.timeouts = 0
+    self.slowest = None
+    self.slowestTime = -1
+
+  def record(self, memberName, elapsed, timedOut):
+    if timedOut:
+      self.timeouts += 1
+
+    if elapsed > self.slowestTime:
+      self.slowestTime = elapsed
+      self.slowest = memberName
+
+    self.outstanding -= 1
+
+    if self.outstanding == 0:
+      local_event_PropagationLatency.emit({'signal': self.signalName, 'members': self.members,
+                                           'total': system_clock() - self.started,
+                                           'slowest': self.slowest, 'timeouts': self.timeouts})
+
+class PropagationJob:
+  def __init__(self, key, memberName, remoteAction, arg):
+    self.key = key
+    self.memberName = memberName
+    self.remoteAction = remoteAction
+    self.arg = arg
+    self.waves = list()
+    self.started = None
+    self.done = False
+
+class PropagationDispatcher:
+  '''Calls members' remote actions using a limited number of workers with a per-member timeout'''
+
+  def __init__(self, concurrency, timeout):
+    self._concurrency = max(1, concurrency)
+    self._timeout = timeout
+
+    self._queue = list()      # jobs waiting for a free worker, in order
+    self._queuedByKey = {}    # e.g. { 'Member PC Power': job }
+    self._inFlightByKey = {}
+
+    self._latencySignals = {} # per-member latency events, resolved on first use
+
+  def propagate(self, signalName, calls):
+    '''calls is a list of (memberName, remoteActionName, arg)'''
+    wave = PropagationWave(signalName)
+
+    for memberName, remoteActionName, arg in calls:
+      remoteAction = lookup_remote_action(remoteActionName)
+      if remoteAction == None:
+        continue
+
+      wave.members += 1
+
+      self._enqueue(wave, remoteActionName, memberName, remoteAction, arg)
+
+    self._pump()
+
+  def _enqueue(self, wave, key, memberName, remoteAction, arg):
+    # same value as the one waiting or, with nothing waiting, the one still in flight? just piggy-back on it
+    existing = self._queuedByKey.get(key)
+    if existing == None:
+      existing = self._inFlightByKey.get(key)
+      if existing != None and existing.done:
+        # (timed out, so already reported)
+        existing = None
+
+    if existing != None and existing.arg == arg:
+      existing.waves.append(wave)
+      wave.outstanding += 1
+      return
+
+    job = PropagationJob(key, memberName, remoteAction, arg)
+    job.waves.append(wave)
+    wave.outstanding += 1
+
+    # a newer value supersedes an older one that hasn't been sent yet
+    superseded = self._queuedByKey.get(key)
+    if superseded != None:
+      self._queue.remove(superseded)
+      for supersededWave in superseded.waves:
+        supersededWave.record(memberName, 0, False)
+
+    self._queuedByKey[key] = job
+    self._queue.append(job)
+
+  def _pump(self):
+    i = 0
+    while i < len(self._queue) and len(self._inFlightByKey) < self._concurrency:
+      job = self._queue[i]
+
+      # only one call in flight per member action, which preserves the order of values
+      if job.key in self._inFlightByKey:
+        i += 1
+        continue
+
+      del self._queue[i]
+      del self._queuedByKey[job.key]
+      self._inFlightByKey[job.key] = job
+
+      self._start(job)
+
+  def _start(self, job):
+    job.started = system_clock()
+
+    def callUnsafe():
+      try:
+        job.remoteAction.call(job.arg)
+
+      except:
+        call_safe(lambda: console.warn('propagation: call to member "%s" failed' % job.memberName))
+
+      call_safe(lambda: self._complete(job, False))
+
+    call(callUnsafe)
+
+    # don't let an unresponsive member hold up the group's propagation metrics forever
+    call_safe(lambda: self._complete(job, True), self._timeout)
+
+  def _complete(self, job, timedOut):
+    if not job.done:
+      job.done = True
+
+      elapsed = system_clock() - job.started
+
+      if timedOut:
+        console.warn('propagation: member "%s" did not complete within %ss' % (job.memberName, self._timeout))
+
+      latencySignal = self._latencySignalFor(job.memberName)
+      if latencySignal != None:
+        latencySignal.emit(elapsed)
+
+      for wave in job.waves:
+        wave.record(job.memberName, elapsed, timedOut)
+
+    if timedOut:
+      # reported, but the worker is still blocked in the call so it keeps its slot until it returns
+      return
+
+    if self._inFlightByKey.get(job.key) is job:
+      del self._inFlightByKey[job.key]
+
+    self._pump()
+
+  def _latencySignalFor(self, memberName):
+    signal = self._latencySignals.get(memberName)
+    if signal == None:
+      signal = lookup_local_event('Member %s Propagation Latency' % memberName)
+      self._latencySignals[memberName] = signal
+
+    return signal
+
+_dispatcher = None
+
+def getDispatcher():
+  global _dispatcher
+
+  if _dispatcher == None:
+    propagation = param_propagation or {}
+    _dispatcher = PropagationDispatcher(propagation.get('concurrency') or DEFAULT_CONCURRENCY,
+                                        propagation.get('timeout') or DEFAULT_TIMEOUT)
+
+  return _dispatcher
+
+# propagation dispatcher ---!>
+
 # <!--- disappearing members
 
 # (for disappearing signals)
@@ -44,6 +44,7 @@ ITEM_SCHEMA = { 'type': 'object', 'title': '...', 'properties': {
 
 import xml.etree.ElementTree as ET
 import base64
+from StringIO import StringIO # for incremental parsing
 
 # (uses a safe default)
 connector = { 'ewsEndPoint': DEFAULT_CONN_ENDPOINT,
@@ -203,8 +204,68 @@ def local_action_PollItems(arg=None):
     
     console.warn('Failed to poll items; exception was [%s]' % eValue)
   
+# <--- sync
+
+# Rather than refetching and fully parsing the whole calendar view every poll:
+# - each folder is checked for changes using a (cheap, IdOnly) SyncFolderItems with a stored SyncState token
+# - the calendar view itself is only refetched when something changed or the cache is getting stale
+#   (recurring occurrences are only expanded by a CalendarView, so that remains the source of the items)
+# - the calendar view is paged (MaxEntriesReturned), continuing from the start of the last item received
+# - responses are parsed with iterparse, releasing each item element as soon as it has been read
+# - parsed items are cached by ItemId and ChangeKey so unchanged items are not re-interpreted
+
+PAGE_SIZE = 256                   # (items per calendar view page)
+MAX_PAGES = 50                    # (safety net for paging and syncing)
+MAX_SYNC_CHANGES = 512            # (the EWS maximum)
+FULL_REFRESH_INTERVAL = 15*60     # (secs) the view window slides so occasionally refetch anyway
+
+class CachedItem:
+  def __init__(self, changeKey, raw, startMillis, endMillis):
+    self.changeKey = changeKey
+    self.raw = raw
+    self.startMillis = startMillis
+    self.endMillis = endMillis
+
+class FolderSync:
+  '''Sync state and item cache of a single calendar folder'''
+  
+  def __init__(self, folderElement):
+    self.folderElement = folderElement
+    self.syncState = None
+    self.itemsByID = {}    # e.g. { 'AAMkAGV...': CachedItem }
+    self.lastRefresh = None
+    
+  def needsRefresh(self):
+    return self.lastRefresh == None or (system_clock() - self.lastRefresh) > FULL_REFRESH_INTERVAL*1000
+  
+  def itemsInRange(self, start, end):
+    '''The cached raw items overlapping the range, by start'''
+    startMillis, endMillis = start.getMillis(), end.getMillis()
+    
+    items = [cached for cached in self.itemsByID.values() if cached.endMillis > startMillis and cached.startMillis < endMillis]
+    items.sort(key=lambda cached: cached.startMillis)
+    
+    return [cached.raw for cached in items]
+  
+class PollStats:
+  def __init__(self):
+    self.requests = 0
+    self.bytes = 0
+    self.parseTime = 0 # (ms)
+    self.refreshes = 0
+    
+# sync state by calendar index
+folderSyncs = {}
+
+local_event_PollStats = LocalEvent({'title': 'Last poll stats', 'group': 'Status, Errors & Debug', 'order': 9999+next_seq(), 'schema': {'type': 'object', 'properties': {
+        'requests': {'type': 'integer', 'order': 1},
+        'bytes': {'type': 'integer', 'order': 2},
+        'parseTime': {'title': 'Parse time (ms)', 'type': 'integer', 'order': 3},
+        'refreshes': {'title': 'Calendar views refreshed', 'type': 'integer', 'order': 4}
+      }}})
+
 def query_ews(start, end):
-  '''Date-range query of calendar items. Returns false if calendar resolution has not been completed yet.'''
+  '''Date-range query of calendar items, using the sync state and item cache of each calendar.'''
 
   # prepare named folder elements if in use
   folderElements = list()
@@ -222,8 +283,36 @@ def query_ews(start, end):
     else:
       # use distinguished folder
       folderElements.append(distinguishedFolderIdElement)
+      
+  stats = PollStats()
+      
+  items = list()
+  
+  for index, folderElement in enumerate(folderElements):
+    folderSync = folderSyncs.get(index)
+    
+    # (folders can be re-resolved)
+    if folderSync == None or folderSync.folderElement is not folderElement:
+      folderSync = FolderSync(folderElement)
+      folderSyncs[index] = folderSync
+      
+    changed = sync_folder(folderSync, stats)
+    
+    if changed or folderSync.needsRefresh():
+      refresh_folder(folderSync, start, end, stats)
+      stats.refreshes += 1
+      
+    for raw in folderSync.itemsInRange(start, end):
+      # (copied so the cache is never exposed)
+      item = dict(raw)
+      item['calendar'] = index
+      items.append(item)
+      
+  local_event_PollStats.emit({'requests': stats.requests, 'bytes': stats.bytes, 'parseTime': stats.parseTime, 'refreshes': stats.refreshes})
+  
+  return items
 
-  request = prepareQueryRequest(start, end, resolvedFolders=folderElements)
+def post_ews(request, stats):
   xmlRequest = ET.tostring(request)
   
   trace('Requesting... request:%s' % xmlRequest)
@@ -236,87 +325,203 @@ def query_ews(start, end):
   
   trace('Got response. data:%s' % response)
   
-  warnings = list()
+  stats.requests += 1
+  stats.bytes += len(response)
   
-  items = parse_query_response(response, warnings)
-  return items
+  return response
+
+def sync_folder(folderSync, stats):
+  '''Syncs the folder's state, returning True if anything has changed since the last sync'''
+  changed = folderSync.syncState == None
+  
+  for page in range(MAX_PAGES):
+    response = post_ews(prepareSyncRequest(folderSync.folderElement, folderSync.syncState), stats)
+    
+    started = system_clock()
+    try:
+      syncState, changes, includesLast = parse_sync_response(response)
+      
+    except InvalidSyncStateException:
+      # start again from scratch
+      console.warn('Sync state for a calendar was rejected; will fully refresh')
+      folderSync.syncState = None
+      return True
+    
+    finally:
+      stats.parseTime += system_clock() - started
+      
+    folderSync.syncState = syncState
+    
+    if changes > 0:
+      changed = True
+      
+    if includesLast:
+      break
+    
+  return changed
+
+def refresh_folder(folderSync, start, end, stats):
+  '''Fetches the full calendar view (in pages), rebuilding the item cache'''
+  oldItems = folderSync.itemsByID
+  newItems = {}
+  
+  pageStart = start
+  
+  for page in range(MAX_PAGES):
+    response = post_ews(prepareQueryRequest(pageStart, end, resolvedFolders=[folderSync.folderElement], maxEntries=PAGE_SIZE), stats)
+    
+    started = system_clock()
+    try:
+      includesLast, lastStartMillis = parse_query_response(response, oldItems, newItems)
+      
+    finally:
+      stats.parseTime += system_clock() - started
+      
+    if includesLast or lastStartMillis == None:
+      break
+    
+    # continue from the start of the last item (duplicates are keyed by ItemId)
+    if lastStartMillis <= pageStart.getMillis():
+      console.warn('Too many calendar items start at the same time to page through; some may be missing')
+      break
+    
+    pageStart = date_instant(lastStartMillis)
+    
+  else:
+    console.warn('Calendar view has more than %s pages; some items may be missing' % MAX_PAGES)
+    
+  folderSync.itemsByID = newItems
+  folderSync.lastRefresh = system_clock()
+  
+def parse_query_response(responseXML, oldItems, newItems):
+  '''Incrementally parses a FindItem (calendar view) response, given the full envelope (as XML string), into 'newItems'
+     (reusing any unchanged ones in 'oldItems'). Returns (includesLastItemInRange, startMillisOfLastItem).'''
+  majorResponseTag = None
+  includesLast = True
+  lastStartMillis = None
   
-def parse_query_response(responseXML, warnHandler):
-  '''Parses a response, given the full envelope (as XML string)'''
   # no way to specify string encoding using this version of Python APIs
   # so need to pre-encode UTF8. Inner parser only deals with plain ASCII.
-  root = ET.fromstring(responseXML.encode('utf-8'))
-
-  # ensure header exists
-  header = getElement(root, 'env:Header')
+  for event, element in ET.iterparse(StringIO(responseXML.encode('utf-8')), events=('start', 'end')):
+    tag = element.tag
+    
+    if event == 'start':
+      if majorResponseTag == None and tag.startswith('{%s}' % NS['message']):
+        majorResponseTag = tag
+        
+        if majorResponseTag != TAG_FINDITEMRESPONSE:
+          raise DataException('Unexpected major response element - got %s' % majorResponseTag)
+        
+      elif tag == TAG_ROOTFOLDER:
+        # warning...
+        if element.get('IncludesLastItemInRange') == 'false':
+          includesLast = False
+      
+      continue
+    
+    # (end events)
+    
+    if tag == TAG_CALENDARITEM:
+      itemIDElement = getElement(element, 'type:ItemId')
+      itemID = getAttrib(itemIDElement, 'Id')
+      changeKey = getAttrib(itemIDElement, 'ChangeKey')
+      
+      cached = oldItems.get(itemID)
+      if cached == None or cached.changeKey != changeKey:
+        cached = interpretCalendarItem(element, changeKey)
+        
+      newItems[itemID] = cached
+      lastStartMillis = cached.startMillis
+      
+      # release the item element, no longer needed
+      element.clear()
+      
+    elif tag == TAG_FINDITEMRESPONSEMESSAGE:
+      checkResponseMessage(element)
+      
+  if majorResponseTag == None:
+    raise DataException('Expected a major response with the Body')
+            
+  return includesLast, lastStartMillis
+
+def interpretCalendarItem(item, changeKey):
+  subject = tryGetElementText(item, 'type:Subject', default='')
+  sensitivity = tryGetElementText(item, 'type:Sensitivity', default='') # TODO: interpret 'Sensitivity'
+  start = date_parse(getElementText(item, 'type:Start'))
+  end = date_parse(getElementText(item, 'type:End'))
+  location = tryGetElementText(item, 'type:Location', default='')
+  
+  organiserElement = tryGetElement(item, 'type:Organizer')
+  if organiserElement != None:
+    organiserMailboxElement = getElement(organiserElement, 'type:Mailbox')
+    organiserName = tryGetElementText(organiserMailboxElement, 'type:Name', default='')
+    
+  else:
+    organiserName = ''
+    
+  raw = { 'subject': subject,
+          'sensitivity': sensitivity,
+          'start': date_instant(start.getMillis()), # trick to convert into local timezone for display convenience (instead of GMT)
+          'end': date_instant(end.getMillis()), # trick to convert into local timezone for display convenience (instead of GMT)
+          'location': location,
+          'organiser': organiserName }
+  
+  return CachedItem(changeKey, raw, start.getMillis(), end.getMillis())
 
-  # ensure body exists
-  body = getElement(root, 'env:Body')
+class InvalidSyncStateException(Exception):
+  '''The server no longer accepts a sync state'''
+  pass
 
-  # get major response part
-  if len(body) <= 0:
-    raise ParseException('Expected a major response with the Body')
+def parse_sync_response(responseXML):
+  '''Incrementally parses a SyncFolderItems response, returns (syncState, number of changes, includesLastItemInSync)'''
+  syncState = None
+  changes = 0
+  includesLast = True
+  majorResponseTag = None
   
-  majorResponseTag = body[0].tag
+  # (see previous comment RE UTF-8 encoding)
+  for event, element in ET.iterparse(StringIO(responseXML.encode('utf-8')), events=('start', 'end')):
+    tag = element.tag
+    
+    if event == 'start':
+      if majorResponseTag == None and tag.startswith('{%s}' % NS['message']):
+        majorResponseTag = tag
+        
+        if majorResponseTag != TAG_SYNCFOLDERITEMSRESPONSE:
+          raise DataException('Unexpected major response element - got %s' % majorResponseTag)
+        
+      continue
+    
+    if tag in TAGS_SYNC_CHANGES:
+      changes += 1
+      element.clear()
+      
+    elif tag == TAG_SYNCSTATE:
+      syncState = element.text
+      
+    elif tag == TAG_INCLUDESLASTITEMINSYNC:
+      includesLast = element.text == 'true'
+      
+    elif tag == TAG_SYNCFOLDERITEMSRESPONSEMESSAGE:
+      if tryGetElementText(element, 'message:ResponseCode') == 'ErrorInvalidSyncStateData':
+        raise InvalidSyncStateException()
+      
+      checkResponseMessage(element)
+      
+  if majorResponseTag == None:
+    raise DataException('Expected a major response with the Body')
   
-  calendarItems = list()
-
-  # (tag can be {m:FindItemResponse}, etc.)
-  if majorResponseTag == expandPath('message:FindItemResponse'):
-    findItemResponse = body[0]
+  return syncState, changes, includesLast
 
-    for responseMessage in findItemResponse:
-      for responseIndex, findItemResponseMessage in enumerate(responseMessage):
-        if getAttrib(findItemResponseMessage, "ResponseClass") != "Success":
-          raise DataException("FindItemResponseMessage response class was not 'Success' (was %s)" % ET.tostring(findItemResponseMessage))
+def checkResponseMessage(responseMessage):
+  if getAttrib(responseMessage, "ResponseClass") != "Success":
+    raise DataException("%s response class was not 'Success' (was %s)" % (responseMessage.tag, ET.tostring(responseMessage)))
 
-        responseCode = getElementText(findItemResponseMessage, 'message:ResponseCode')
-        if responseCode != 'NoError':
-          raise DataException("Response code was not 'NoError'")
-          
-        rootFolder = getElement(findItemResponseMessage, 'message:RootFolder')
+  responseCode = getElementText(responseMessage, 'message:ResponseCode')
+  if responseCode != 'NoError':
+    raise DataException("Response code was not 'NoError' (was '%s')" % responseCode)
 
-        # warning...
-        includesLastItemInRange = rootFolder.get('IncludesLastItemInRange')
-        if includesLastItemInRange == False and warnings:
-          warnings.append('IncludesLastItemInRange=false but this parser does not support paged responses')
-        
-        rootFolderItems = getElement(rootFolder, 'type:Items')
-
-        for item in rootFolderItems:
-          itemTag = item.tag
-
-          # interpret calendar items only
-          if itemTag == expandPath('type:CalendarItem'):
-            itemIDElement = getElement(item, 'type:ItemId')
-            itemID = {'id': getAttrib(itemIDElement, 'Id'),
-                      'changeKey': getAttrib(itemIDElement, 'ChangeKey')}
-            subject = tryGetElementText(item, 'type:Subject', default='')
-            sensitivity = tryGetElementText(item, 'type:Sensitivity', default='') # TODO: interpret 'Sensitivity'
-            start = getElementText(item, 'type:Start')
-            end = getElementText(item, 'type:End')
-            location = tryGetElementText(item, 'type:Location', default='')
-            
-            organiserElement = tryGetElement(item, 'type:Organizer')
-            if organiserElement != None:
-              organiserMailboxElement = getElement(organiserElement, 'type:Mailbox')
-              organiserName = tryGetElementText(organiserMailboxElement, 'type:Name', default='')
-              
-            else:
-              organiserName = ''
-
-            calendarItems.append({ # 'id': itemID,
-                                   'calendar': responseIndex,
-                                   'subject': subject,
-                                   'sensitivity': sensitivity,
-                                   'start': date_instant(date_parse(start).getMillis()), # trick to convert into local timezone for display convenience (instead of GMT)
-                                   'end': date_instant(date_parse(end).getMillis()), # trick to convert into local timezone for display convenience (instead of GMT)
-                                   'location': location,
-                                   'organiser': organiserName })
-  else:
-    raise DataException('Unexpected major response element - got %s' % majorResponseTag)
-            
-  return calendarItems
+# sync --->
 
 def local_action_PollFolders(arg=None):
   try:
@@ -476,7 +681,7 @@ REQ_QUERY_TEMPLATE_XML = '''<?xml version="1.0" encoding="utf-8"?>
 #    </ParentFolderIds>
 # ...
 
-def prepareQueryRequest(start, end, resolvedFolders=None):
+def prepareQueryRequest(start, end, resolvedFolders=None, maxEntries=None):
   '''(folders contain XML objects)'''
   # construct a new FindItem request
   request = ET.fromstring(REQ_QUERY_TEMPLATE_XML)
@@ -486,6 +691,10 @@ def prepareQueryRequest(start, end, resolvedFolders=None):
   calendarView.set('StartDate', str(start))
   calendarView.set('EndDate', str(end))
   
+  # specify page size
+  if maxEntries != None:
+    calendarView.set('MaxEntriesReturned', str(maxEntries))
+  
   # specify folder options
   parentFolderIds = searchElement(request, 'message:ParentFolderIds')
 
@@ -523,6 +732,43 @@ def prepareGetFoldersRequest(smtpAddress=None):
 
   return request
 
+REQ_SYNC_TEMPLATE_XML = '''<?xml version="1.0" encoding="utf-8"?>
+  <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+     <s:Header>
+        <h:RequestServerVersion Version="Exchange2010_SP2" xmlns:h="http://schemas.microsoft.com/exchange/services/2006/types"/>
+     </s:Header>
+     <s:Body>
+        <SyncFolderItems xmlns="http://schemas.microsoft.com/exchange/services/2006/messages">
+           <ItemShape>
+              <BaseShape xmlns="http://schemas.microsoft.com/exchange/services/2006/types">IdOnly</BaseShape>
+           </ItemShape>
+           <SyncFolderId><!-- important folder options end up here --></SyncFolderId>
+           <SyncState><!-- omitted for the first sync --></SyncState>
+           <MaxChangesReturned>MAX_CHANGES_HERE</MaxChangesReturned>
+        </SyncFolderItems>
+     </s:Body>
+  </s:Envelope>
+'''
+
+def prepareSyncRequest(folderElement, syncState):
+  # construct a new SyncFolderItems request
+  request = ET.fromstring(REQ_SYNC_TEMPLATE_XML)
+  
+  # specify the folder (only one allowed)
+  searchElement(request, 'message:SyncFolderId').append(folderElement)
+  
+  # specify the sync state, if there is one
+  syncFolderItems = searchElement(request, 'message:SyncFolderItems')
+  syncStateElement = getElement(syncFolderItems, 'message:SyncState')
+  if syncState == None:
+    syncFolderItems.remove(syncStateElement)
+  else:
+    syncStateElement.text = syncState
+    
+  getElement(syncFolderItems, 'message:MaxChangesReturned').text = str(MAX_SYNC_CHANGES)
+  
+  return request
+
 # SOAP/XML operations --->
 
 
@@ -613,6 +859,17 @@ def expandPath(path):
   
   return '{%s}%s' % (NS[parts[0]], parts[1])
 
+# pre-expanded tags for incremental parsing
+TAG_FINDITEMRESPONSE = expandPath('message:FindItemResponse')
+TAG_FINDITEMRESPONSEMESSAGE = expandPath('message:FindItemResponseMessage')
+TAG_ROOTFOLDER = expandPath('message:RootFolder')
+TAG_CALENDARITEM = expandPath('type:CalendarItem')
+TAG_SYNCFOLDERITEMSRESPONSE = expandPath('message:SyncFolderItemsResponse')
+TAG_SYNCFOLDERITEMSRESPONSEMESSAGE = expandPath('message:SyncFolderItemsResponseMessage')
+TAG_SYNCSTATE = expandPath('message:SyncState')
+TAG_INCLUDESLASTITEMINSYNC = expandPath('message:IncludesLastItemInSync')
+TAGS_SYNC_CHANGES = set([expandPath('type:Create'), expandPath('type:Update'), expandPath('type:Delete')])
+
 # XML parsing convenience functions --->
 
 # <--- simple parsing
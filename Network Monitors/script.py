@@ -17,14 +17,17 @@ param_monitors = Parameter({'title': 'Monitors', 'schema': {'type': 'array', 'it
     }}}})
 
 def main():
-  if len(param_monitors or '') == 0:
-    console.warn('No monitors are configured!')
+  if len(param_monitors or '') == 0 and len(param_probes or '') == 0:
+    console.warn('No monitors or probes are configured!')
     return
   
   for param in param_monitors or '':
       initMonitorParam(param)
       
-  console.info('Started %s monitors' % len(param_monitors or ''))
+  if len(param_probes or '') > 0:
+    initProbes()
+      
+  console.info('Started %s monitors and %s probes' % (len(param_monitors or ''), len(param_probes or '')))
 
 def initMonitorParam(param):
   initPoller(param['name'], 
@@ -169,58 +172,490 @@ def beginCheckURL(url, complete, username=None, password=None):
   call(get_unsafe)
   
   
-# DNS poller ----
+# <!--- prober
 
-class DNSPoller:
-  # DNS request (minus first byte)
-  DNS_REQ = '\x1a\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x03\x77\x77\x77\x06\x67\x6f\x6f\x67\x6c\x65\x03\x63\x6f\x6d\x00\x00\x01\x00\x01'
+# A non-blocking prober for many TCP, HTTP and DNS targets: a single thread drives all the probes through a
+# java.nio Selector, launching each target on its own jittered interval (up to a limit of probes in flight).
+# Latencies are recorded into log-linear (HDR-style) histograms and summarised per report period.
+# Host names are looked up (and cached for a while) on a separate pool as lookups block.
 
-  def __init__(self, dnsServer):
-    self.lastSent = 0
-    self.currentID = 9 # modulo 10
-    self.complete = None # on complete callback
-    self.udp = UDP(dest='%s:53' % dnsServer, ready=ready, received=received)
+from java.nio import ByteBuffer
+from java.nio.channels import Selector, SocketChannel, DatagramChannel, SelectionKey
+from java.net import InetSocketAddress
+from java.lang import Thread
+from java.util.concurrent import Executors, ConcurrentLinkedQueue
+import jarray
+import heapq
+import random
+import atexit
+import sys
+from time import sleep
 
-  def ready(self):
-    console.info('udp ready!')
-    
-  def beginPing(self, complete):
-    if self.complete != None:
-      raise Exception('Current operation has not finished')
-      
-    self.complete = complete
-    newID = (self.currentID + 1) % 10
-    self.currentID = newID
-    
-    self.lastSent = system_clock()
-    udp.send('%s%s' % (chr(newID), REQ))
-    
-    call_safe(timeoutCheck, 10)
+PROBE_TYPES = ['TCP', 'HTTP', 'DNS']
 
-  def received(self, src, data):
-    console.log('udp recv: %s %s' % (src, data.encode('hex')))
-  
-    if len(src) == 0 or src[0] != self.currentID:
-      # unexpected ID
-      console.log('ignoring unexpected response')
-      return
-    
-    callback = self.complete
-    self.complete = None
-    callback(True, None)
-    
-  def timeoutCheck(self):
-    if self.complete == None:
+DEFAULT_PROBE_INTERVAL = 10 # secs
+DEFAULT_PROBE_TIMEOUT = 5   # secs
+DEFAULT_REPORT_PERIOD = 60  # secs
+DEFAULT_MAX_INFLIGHT = 256
+PROBE_JITTER = 0.1          # i.e. +/- 10% of the interval
+RESOLVE_TTL = 300           # secs, before a host name is looked up again
+RESOLVER_THREADS = 4
+
+param_probes = Parameter({'title': 'Probes', 'order': next_seq(), 'schema': {'type': 'array', 'items': {'type': 'object', 'properties': {
+        'name': {'title': 'Name', 'type': 'string', 'order': next_seq()},
+        'type': {'title': 'Type', 'type': 'string', 'enum': PROBE_TYPES, 'order': next_seq()},
+        'address': {'title': 'Address', 'type': 'string', 'hint': 'e.g. host:80 (TCP/HTTP) or 8.8.8.8 (DNS)', 'order': next_seq()},
+        'path': {'title': 'Path (HTTP)', 'type': 'string', 'hint': '/', 'order': next_seq()},
+        'query': {'title': 'Query (DNS)', 'type': 'string', 'hint': 'www.google.com', 'order': next_seq()},
+        'interval': {'title': 'Interval (s)', 'type': 'integer', 'hint': str(DEFAULT_PROBE_INTERVAL), 'order': next_seq()}
+    }}}})
+
+param_prober = Parameter({'title': 'Prober', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+        'maxInFlight': {'title': 'Max. probes in flight', 'type': 'integer', 'hint': str(DEFAULT_MAX_INFLIGHT), 'order': 1},
+        'timeout': {'title': 'Probe timeout (s)', 'type': 'integer', 'hint': str(DEFAULT_PROBE_TIMEOUT), 'order': 2},
+        'reportPeriod': {'title': 'Report period (s)', 'type': 'integer', 'hint': str(DEFAULT_REPORT_PERIOD), 'order': 3}
+    }}})
+
+LATENCY_SUMMARY_SCHEMA = {'type': 'object', 'title': 'Latency', 'properties': {
+                            'p50': {'type': 'number', 'title': 'p50 (ms)', 'order': 1},
+                            'p95': {'type': 'number', 'title': 'p95 (ms)', 'order': 2},
+                            'p99': {'type': 'number', 'title': 'p99 (ms)', 'order': 3},
+                            'availability': {'type': 'number', 'title': 'Availability (%)', 'order': 4},
+                            'count': {'type': 'integer', 'title': 'Probes', 'order': 5}
+                         }}
+
+class LatencyHistogram:
+  '''Log-linear buckets over microseconds i.e. each power of two is split into equal sub-buckets'''
+
+  SUB_BUCKET_BITS = 4
+  SUB_BUCKETS = 1 << SUB_BUCKET_BITS # (i.e. within ~6% precision)
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self._counts = {} # by bucket index (sparse)
+    self.total = 0
+    self.failures = 0
+
+  def _indexOf(self, micros):
+    if micros < 2 * self.SUB_BUCKETS:
+      return micros
+
+    # e.g. with 16 sub-buckets, 32..63 -> 32..47, 64..127 -> 48..63, etc.
+    bitLength = len(bin(micros)) - 2
+    magnitude = bitLength - self.SUB_BUCKET_BITS - 1
+    return magnitude * self.SUB_BUCKETS + (micros >> magnitude)
+
+  def _valueOf(self, index):
+    # (the upper end of the bucket)
+    if index < 2 * self.SUB_BUCKETS:
+      return index
+
+    magnitude = index / self.SUB_BUCKETS - 1
+    return (((index % self.SUB_BUCKETS) + self.SUB_BUCKETS + 1) << magnitude) - 1
+
+  def record(self, millis):
+    index = self._indexOf(max(0, int(millis * 1000)))
+    self._counts[index] = self._counts.get(index, 0) + 1
+    self.total += 1
+
+  def recordFailure(self):
+    self.failures += 1
+
+  def percentile(self, p):
+    if self.total == 0:
+      return None
+
+    threshold = max(1, int(round(self.total * p / 100.0)))
+
+    running = 0
+    for index in sorted(self._counts):
+      running += self._counts[index]
+      if running >= threshold:
+        return self._valueOf(index) / 1000.0
+
+  def summary(self):
+    attempts = self.total + self.failures
+
+    return {'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+            'availability': 100.0 * self.total / attempts if attempts > 0 else None,
+            'count': attempts}
+
+def toByte(value):
+  # (Java bytes are signed)
+  return value - 256 if value > 127 else value
+
+def toBytes(s):
+  return jarray.array([toByte(ord(c)) for c in s], 'b')
+
+class ProbeTarget:
+  def __init__(self, name, interval):
+    self.name = name
+    self.interval = interval * 1000
+    self.histogram = LatencyHistogram()
+
+    # resolved InetSocketAddress (see Prober._resolve)
+    self.address = None
+    self.resolvedAt = None
+
+    self.status = Event('%s Status' % name, {'title': 'Status', 'group': name, 'order': next_seq(), 'schema': {
+                          'type': 'object', 'title': 'Status', 'properties': {
+                            'level': {'type': 'integer', 'title': 'Level', 'order': 1},
+                            'message': {'type': 'string', 'title': 'Message', 'order': 2}
+                          }}})
+    self.latency = Event('%s Latency' % name, {'title': 'Latency', 'group': name, 'order': next_seq(), 'schema': LATENCY_SUMMARY_SCHEMA})
+
+  def report(self, summary):
+    # (called in the node's context)
+    self.latency.emit(summary)
+
+    if summary['count'] == 0:
       return
-    
-    diff = system_clock() - self.lastSent
-    if diff>10000:
-      callback = self.complete
-      self.complete = None
-      callback(None, Exception('Timeout! (took >10s)'))
-  
+
+    if summary['availability'] == 0:
+      self.status.emit({'level': 2, 'message': 'Unreachable (%s probes failed)' % summary['count']})
+
+    elif summary['availability'] < 100:
+      self.status.emit({'level': 2, 'message': '%.1f%% availability, p50 %sms' % (summary['availability'], summary['p50'])})
+
+    else:
+      self.status.emit({'level': 0, 'message': 'OK (p50 %sms, p99 %sms)' % (summary['p50'], summary['p99'])})
+
+  # subclasses provide these operations, which are called on the prober thread:
+  #
+  #   open(selector) - starts the probe, returning the channel's selection key
+  #   handle(key)    - returns True when complete, or raises an exception on failure
+
+def splitAddress(address, defaultPort):
+  if ':' in address:
+    host, port = address.rsplit(':', 1)
+    return host.strip(), int(port)
+
+  return address.strip(), defaultPort
+
+class TCPProbeTarget(ProbeTarget):
+  '''Available if a TCP connection can be established'''
+
+  def __init__(self, name, interval, address, defaultPort=80):
+    ProbeTarget.__init__(self, name, interval)
+    self.host, self.port = splitAddress(address, defaultPort)
+
+  def open(self, selector):
+    channel = SocketChannel.open()
+    channel.configureBlocking(False)
+
+    # (can connect immediately e.g. loopback)
+    connected = channel.connect(self.address)
+
+    return channel.register(selector, SelectionKey.OP_WRITE if connected else SelectionKey.OP_CONNECT)
+
+  def handle(self, key):
+    return key.channel().finishConnect()
+
+class HTTPProbeTarget(TCPProbeTarget):
+  '''Available if an HTTP status line is returned (with a status below 400)'''
+
+  def __init__(self, name, interval, address, path):
+    TCPProbeTarget.__init__(self, name, interval, address, defaultPort=80)
+
+    self.request = toBytes('GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n' % (path or '/', self.host))
+
+  def open(self, selector):
+    self.received = ''
+    return TCPProbeTarget.open(self, selector)
+
+  def handle(self, key):
+    channel = key.channel()
+
+    if key.isConnectable() or key.isWritable():
+      if channel.finishConnect():
+        # (small enough to be written in one go)
+        channel.write(ByteBuffer.wrap(self.request))
+        key.interestOps(SelectionKey.OP_READ)
+
+      return False
+
+    buffer = ByteBuffer.allocate(512)
+    count = channel.read(buffer)
+    if count < 0:
+      raise Exception('Connection closed before a status line was received')
+
+    self.received += buffer.array().tostring()[:count]
+
+    if '\r\n' not in self.received:
+      return False
+
+    # e.g. 'HTTP/1.1 200 OK'
+    parts = self.received.split('\r\n', 1)[0].split(' ')
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+      raise Exception('Unexpected response')
+
+    statusCode = int(parts[1])
+    if statusCode >= 400:
+      raise Exception('HTTP status %s' % statusCode)
+
+    return True
+
+class DNSProbeTarget(ProbeTarget):
+  '''Available if the DNS server answers a query (without a server failure)'''
+
+  def __init__(self, name, interval, address, query):
+    ProbeTarget.__init__(self, name, interval)
+    self.host, self.port = splitAddress(address, 53)
+
+    # (the first two bytes, the transaction ID, are set per probe)
+    qname = ''.join(['%s%s' % (chr(len(label)), label) for label in (query or 'www.google.com').split('.') if len(label) > 0])
+    self.request = toBytes('\x00\x00\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00%s\x00\x00\x01\x00\x01' % qname)
+
+  def open(self, selector):
+    self.transactionID = random.randint(0, 0xffff)
+    self.request[0] = toByte(self.transactionID >> 8)
+    self.request[1] = toByte(self.transactionID & 0xff)
+
+    channel = DatagramChannel.open()
+    channel.configureBlocking(False)
+    channel.connect(self.address)
+    channel.write(ByteBuffer.wrap(self.request))
+
+    return channel.register(selector, SelectionKey.OP_READ)
+
+  def handle(self, key):
+    buffer = ByteBuffer.allocate(512)
+    count = key.channel().read(buffer)
+    if count < 4:
+      return False
+
+    data = buffer.array()
+    if ((data[0] & 0xff) << 8 | (data[1] & 0xff)) != self.transactionID or not (data[2] & 0x80):
+      # not the answer to this query, keep waiting
+      return False
+
+    if (data[3] & 0x0f) == 2:
+      raise Exception('Server failure')
+
+    return True
+
+class Prober:
+  '''Drives all the probes from a single thread'''
+
+  def __init__(self, maxInFlight, timeout, reportPeriod):
+    self._maxInFlight = maxInFlight
+    self._timeout = timeout * 1000
+    self._reportPeriod = reportPeriod * 1000
+
+    self._targets = list()
+    self._due = list()      # heap of (due, seq, target)
+    self._deadlines = list() # heap of (deadline, seq, key)
+    self._inFlight = 0
+    self._running = True
+    self._seq = 0 # (orders deadlines)
+
+    self._resolver = Executors.newFixedThreadPool(RESOLVER_THREADS)
+    self._lookups = ConcurrentLinkedQueue() # completed lookups, (target, address or None)
+
+  def add(self, target):
+    target.index = len(self._targets)
+    self._targets.append(target)
+
+  def start(self):
+    self._selector = Selector.open()
+
+    now = system_clock()
+
+    # stagger the first probes over a full interval
+    for target in self._targets:
+      heapq.heappush(self._due, (now + int(random.random() * target.interval), target.index, target))
+
+    self._nextReport = now + self._reportPeriod
+
+    thread = Thread(self._run, 'Prober')
+    thread.setDaemon(True)
+    thread.start()
+
+  def _run(self):
+    while self._running:
+      try:
+        self._step()
+
+      except:
+        # (keep probing; a dead thread would freeze every probe)
+        exc = sys.exc_info()[1]
+        call_safe(lambda: console.error('prober: unexpected error - %s' % exc))
+        sleep(1)
+
+  def _step(self):
+    now = system_clock()
+
+    # pick up finished lookups
+    while True:
+      lookup = self._lookups.poll()
+      if lookup is None:
+        break
+
+      target, address = lookup
+
+      if address is None:
+        # (counts as a failed probe)
+        target.histogram.recordFailure()
+        self._reschedule(target, now)
+
+      else:
+        target.address = address
+        target.resolvedAt = now
+        heapq.heappush(self._due, (now, target.index, target))
+
+    # launch the due probes
+    while len(self._due) > 0 and self._due[0][0] <= now and self._inFlight < self._maxInFlight:
+      due, index, target = heapq.heappop(self._due)
+
+      if target.resolvedAt is None or now - target.resolvedAt > RESOLVE_TTL * 1000:
+        # (launched once resolved)
+        self._resolve(target)
+        continue
+
+      # (timed individually, opening can take a moment)
+      started = system_clock()
+
+      try:
+        key = target.open(self._selector)
+        key.attach([target, started])
+        self._inFlight += 1
+
+        self._seq += 1
+        heapq.heappush(self._deadlines, (started + self._timeout, self._seq, key))
+
+      except:
+        target.histogram.recordFailure()
+        self._reschedule(target, now)
+
+    # expire the probes that have timed out
+    while len(self._deadlines) > 0 and self._deadlines[0][0] <= now:
+      deadline, s, key = heapq.heappop(self._deadlines)
+      if key.isValid():
+        self._complete(key, False, now)
+
+    if now >= self._nextReport:
+      self._report()
+      self._nextReport = now + self._reportPeriod
+
+    # wait for activity or the next due probe / deadline
+    nextEvent = self._nextReport
+    if len(self._due) > 0 and self._inFlight < self._maxInFlight:
+      nextEvent = min(nextEvent, self._due[0][0])
+    if len(self._deadlines) > 0:
+      nextEvent = min(nextEvent, self._deadlines[0][0])
+
+    self._selector.select(max(1, nextEvent - now))
+
+    now = system_clock()
+
+    selectedKeys = self._selector.selectedKeys().iterator()
+    while selectedKeys.hasNext():
+      key = selectedKeys.next()
+      selectedKeys.remove()
+
+      target = key.attachment()[0]
+
+      try:
+        if target.handle(key):
+          self._complete(key, True, now)
+
+      except:
+        self._complete(key, False, now)
+
+  def stop(self):
+    self._running = False
+    self._resolver.shutdownNow()
+    self._selector.wakeup()
+
+  def _resolve(self, target):
+    # (called on the prober thread, completes on a resolver thread)
+    def lookup():
+      address = None
+
+      try:
+        address = InetSocketAddress(target.host, target.port)
+        if address.isUnresolved():
+          address = None
+
+      except:
+        pass
+
+      self._lookups.add((target, address))
+      self._selector.wakeup()
+
+    self._resolver.execute(lookup)
+
+  def _complete(self, key, success, now):
+    target, started = key.attachment()
+
+    key.cancel()
+    try:
+      key.channel().close()
+    except:
+      pass
+
+    if success:
+      target.histogram.record(now - started)
+    else:
+      target.histogram.recordFailure()
+
+    self._inFlight -= 1
+
+    self._reschedule(target, now)
+
+  def _reschedule(self, target, now):
+    jitter = 1 + PROBE_JITTER * (2 * random.random() - 1)
+    heapq.heappush(self._due, (now + int(target.interval * jitter), target.index, target))
+
+  def _report(self):
+    for target in self._targets:
+      summary = target.histogram.summary()
+      target.histogram.reset()
+
+      # hand over to the node's context
+      call_safe(lambda target=target, summary=summary: target.report(summary))
+
+def initProbes():
+  prober = param_prober or {}
+
+  engine = Prober(prober.get('maxInFlight') or DEFAULT_MAX_INFLIGHT,
+                  prober.get('timeout') or DEFAULT_PROBE_TIMEOUT,
+                  prober.get('reportPeriod') or DEFAULT_REPORT_PERIOD)
+
+  for param in param_probes:
+    name, probeType, address = param.get('name'), param.get('type'), param.get('address')
+    interval = param.get('interval') or DEFAULT_PROBE_INTERVAL
+
+    if isBlank(name) or isBlank(address):
+      console.warn('A probe is missing a name or address; ignoring')
+      continue
+
+    if probeType == 'TCP':
+      engine.add(TCPProbeTarget(name, interval, address))
+
+    elif probeType == 'HTTP':
+      engine.add(HTTPProbeTarget(name, interval, address, param.get('path')))
+
+    elif probeType == 'DNS':
+      engine.add(DNSProbeTarget(name, interval, address, param.get('query')))
+
+    else:
+      console.warn('Probe "%s" has an unknown type; ignoring' % name)
+
+  engine.start()
+
+  atexit.register(engine.stop)
+
+# prober ---!>
+
 # convenience functions
   
 def log(msg):
   pass
   print msg
+
+def isBlank(s):
+  if s == None or len(s) == 0 or len(s.strip()) == 0:
+    return True
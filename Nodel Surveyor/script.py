@@ -33,7 +33,8 @@ Step 2: Use the 'Probe' operation to determine which node
         
 
 Step 3: Use 'Begin Survey' to interrogate the nodes in one 
-        sequential sweep.
+        concurrent sweep (can be repeated, only changed scripts
+        are downloaded again).
         
         WAIT...
         
@@ -79,6 +80,9 @@ from org.nodel.io import Stream
 # to determine working directory
 import os 
 
+# for retry back-off
+from time import sleep
+
 param_NodeNameFilter = Parameter({'title': 'Node name filter', 'desc': 'If blank or missing includes all nodes.', 'schema': {'type': 'string'}})
 
 param_Interface = Parameter({'title': 'Network interface for multicasting', 'desc': 'Optional - if blank, will use the OS "bind all" default (0.0.0.0) which can have inconsistent results depending on the state of the topology.', 
@@ -117,8 +121,15 @@ def main():
     global reducedNameFilter
     reducedNameFilter = SimpleName(param_NodeNameFilter).getReducedForMatchingName()
     
+  global recipeIndex
+  recipeIndex = RecipeIndex(File(_node.getRoot(), RECIPE_INDEX_FILE))
+    
   items = load_existing_scripts(recipesFolder)
-  console.info('loaded %s scripts' % len(items))
+  console.info('loaded %s scripts (%s hashed, the rest from the index)' % (len(items), recipeIndex.hashed))
+  
+  recipeIndex.save()
+  
+  # (inverted map for matching surveyed scripts)
   for item in items:
     scriptTypes_bySignature[item['signature']] = {'type': item['path'], 'signature': item['signature']}
     
@@ -154,7 +165,7 @@ def traverse(path, pathFile, items):
       traverse(newPath, f, items)
       
     if f.isFile() and name.lower() == 'script.py':
-      signature = getSignature(Stream.readFully(f))
+      signature = recipeIndex.signatureOf(f)
                                  
       items.append({'path': path, 
                     'scriptFile': f,
@@ -219,35 +230,212 @@ def local_action_Probe(arg=None):
   
   udp.send(json_encode({"discovery": "*", "types": ["tcp", "http"]}))
   
-surveyed = False
+# <!--- survey and push
+
+# Nodes are probed (and scripts pushed) by a bounded pool of workers with per-host timeouts and retries.
+# Signatures are cached (persistently) by node, along with the ETag / length of its script so a re-survey
+# only downloads and hashes scripts that have changed.
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 10 # seconds
+DEFAULT_RETRIES = 2
+
+param_Concurrency = Parameter({'title': 'Concurrency', 'desc': 'Max. number of nodes surveyed or pushed to at once.', 'schema': {'type': 'integer', 'hint': DEFAULT_CONCURRENCY}})
+param_Timeout = Parameter({'title': 'Timeout per node (s)', 'schema': {'type': 'integer', 'hint': DEFAULT_TIMEOUT}})
+param_Retries = Parameter({'title': 'Retries per node', 'schema': {'type': 'integer', 'hint': DEFAULT_RETRIES}})
+
+import threading
+from Queue import Queue, Empty
+
+class WorkerPool:
+  '''Applies a function over a list of items using a bounded number of threads'''
+  
+  def __init__(self, size):
+    self._size = max(1, size)
+    
+  def map(self, func, items):
+    '''Returns a list of (item, result, exception) in the same order as the items'''
+    results = [None] * len(items)
+    
+    queue = Queue()
+    for index, item in enumerate(items):
+      queue.put((index, item))
+      
+    def work():
+      while True:
+        try:
+          index, item = queue.get_nowait()
+        except Empty:
+          return
+        
+        try:
+          results[index] = (item, func(item), None)
+          
+        except BaseException, exc:
+          results[index] = (item, None, exc)
+          
+        except JavaException, exc:
+          results[index] = (item, None, exc)
+          
+    threads = [threading.Thread(target=work, name='Surveyor worker %s' % i) for i in range(min(self._size, len(items)))]
+    for thread in threads:
+      thread.start()
+      
+    for thread in threads:
+      thread.join()
+      
+    return results
+  
+def newWorkerPool():
+  return WorkerPool(param_Concurrency or DEFAULT_CONCURRENCY)
+
+def getWithRetries(url, **kwargs):
+  '''A full-response get_url with per-host timeouts and retries'''
+  timeout = param_Timeout or DEFAULT_TIMEOUT
+  retries = param_Retries if param_Retries != None else DEFAULT_RETRIES
+  
+  attempt = 0
+  while True:
+    try:
+      resp = get_url(url, connectTimeout=timeout, readTimeout=timeout, fullResponse=True, **kwargs)
+      
+      if resp.statusCode >= 500:
+        raise Exception('%s %s' % (resp.statusCode, resp.reasonPhrase))
+      
+      return resp
+    
+    except:
+      attempt += 1
+      if attempt > retries:
+        raise
+      
+      sleep(0.5 * attempt)
+  
+def getHeader(resp, name):
+  # (header names are loosely capitalised)
+  headers = getattr(resp, 'headers', None) or {}
+  
+  for key in headers:
+    if key != None and key.lower() == name.lower():
+      values = headers[key]
+      if isinstance(values, basestring):
+        return values
+      
+      return values[0] if len(values or '') > 0 else None
+
+SIGNATURE_CACHE_FILE = 'surveyCache.json'
+
+class SignatureCache:
+  '''Signatures by node, persisted across sessions'''
+  
+  def __init__(self):
+    self._file = File(_node.getRoot(), SIGNATURE_CACHE_FILE)
+    self._entries = {} # e.g. { 'Node Name': {'etag': ..., 'length': ..., 'modified': ..., 'signature': ...}}
+    
+    if self._file.exists():
+      try:
+        self._entries = json_decode(Stream.readFully(self._file)) or {}
+      except:
+        console.warn('Signature cache could not be read; will start afresh')
+        
+  def get(self, nodeName):
+    return self._entries.get(str(nodeName))
+  
+  def put(self, nodeName, entry):
+    self._entries[str(nodeName)] = entry
+    
+  def save(self):
+    Stream.writeFully(self._file, json_encode(self._entries))
+
+signatureCache = None
+
+def surveyNode(nodeName):
+  '''(runs on a worker) Returns {'signature', 'modified', 'script' (only if downloaded)}'''
+  address = nodeAddressesByName[nodeName]
+  scriptUrl = '%sREST/script' % address
+  
+  cached = signatureCache.get(nodeName)
+  
+  # check whether the script has changed without downloading it
+  if cached != None and (cached.get('etag') or cached.get('length')):
+    try:
+      resp = getWithRetries(scriptUrl, method='HEAD')
+      etag = getHeader(resp, 'ETag')
+      length = getHeader(resp, 'Content-Length')
+      
+      if resp.statusCode == 200 and ((etag != None and etag == cached.get('etag')) or 
+                                     (etag == None and length != None and length == cached.get('length'))):
+        return {'signature': cached['signature'], 'modified': cached.get('modified')}
+      
+    except:
+      # not all hosts support HEAD, fall back to a full download
+      pass
+    
+  resp = getWithRetries(scriptUrl)
+  if resp.statusCode != 200:
+    raise Exception('%s %s' % (resp.statusCode, resp.reasonPhrase))
+  
+  scriptInfo = json_decode(resp.content)
+  
+  script = scriptInfo['script']
+  signature = getSignature(script)
+  
+  signatureCache.put(nodeName, {'etag': getHeader(resp, 'ETag'),
+                                'length': getHeader(resp, 'Content-Length') or str(len(resp.content)),
+                                'modified': scriptInfo['modified'],
+                                'signature': signature})
   
+  return {'signature': signature, 'modified': scriptInfo['modified'], 'script': script}
+
+# survey and push ---!>
+
+# the last surveyed signature of each node, and the reverse (for re-surveys)
+signaturesByNode = {}
+nodesBySignature = {}
+
 def local_action_BeginSurvey(arg=None):
   '''{"title": "2. Begin survey", "group": "Operations", "order": 2}'''
   
+  global signatureCache
+  if signatureCache is None:
+    signatureCache = SignatureCache()
+  
   errors = list()
   
-  global surveyed
-  if surveyed:
-    console.warn('Can only survey once per session. Restart node to repeat.')
-    return
+  nodeNames = list(nodeAddressesByName)
   
-  surveyed = True
+  console.info('Surveying %s nodes...' % len(nodeNames))
   
-  for nodeName in nodeAddressesByName:
-    try:
-      queryNode(nodeName)
+  started = system_clock()
+  
+  # (the probing is done by the workers, the results are applied here)
+  for nodeName, result, failure in newWorkerPool().map(surveyNode, nodeNames):
+    if failure is None:
+      try:
+        applySurvey(nodeName, result)
         
-    except BaseException, exc:
-      errors.append([nodeName, exc])
+      except BaseException, exc:
+        failure = exc
+      
+      except JavaException, exc:
+        failure = exc
       
-    except JavaException, exc:
-      errors.append([nodeName, exc])
+    if failure is not None:
+      errors.append([nodeName, failure])
+      emitNodeInfo(nodeName, {'scriptModified': ''})
+      
+  signatureCache.save()
       
   for error in errors:
     console.warn('("%s" failed)' % error)
     
-  console.info('> %s nodes detected (%s with errors)' % (len(nodeAddressesByName), len(errors)))
-  console.info('> %s signatures' % len(signatures))
+  console.info('> %s nodes detected (%s with errors) in %.1fs' % (len(nodeAddressesByName), len(errors), (system_clock() - started) / 1000.0))
+  console.info('> %s signatures' % len(nodesBySignature))
+  
+  countByType = {}
+  for signature in signaturesByNode.values():
+    ttype = getScriptType(signature)
+    countByType[ttype] = countByType.get(ttype, 0) + 1
   
   types = [t for t in countByType]
   types.sort()
@@ -262,96 +450,86 @@ SCRIPT_SCHEMA = {'type': 'object', 'properties': {
                     'notes':     { 'type': 'string', 'order': 10}
                 }}
 
-signatures = set()
+def getScriptType(signature):
+  scriptTypeInfo = scriptTypes_bySignature.get(signature)
+  if scriptTypeInfo is None:
+    return 'Unknown'
+  
+  return scriptTypeInfo.get('type')
 
-countByType = {}
-    
-def queryNode(nodeName):
+def emitNodeInfo(nodeName, info):
   # create an event if one isn't already set up
   key = 'Node %s' % nodeName
   event = lookup_local_event(key)
   if event is None:
     event = Event(key, {'title': '"%s"' % nodeName, 'group': 'Nodes', 'schema': NODESINFO_SCHEMA})
     
-  info = {}
+  event.emit(info)
+
+def applySurvey(nodeName, result):
+  signature = result['signature']
   
-  address = nodeAddressesByName[nodeName]
+  ttype = getScriptType(signature)
   
-  scriptUrl = '%sREST/script' % address
-  
-  try:
-    scriptInfo = json_decode(get_url(scriptUrl))
-    
-    info['scriptModified'] = scriptInfo['modified']
-    
-    signature = getSignature(scriptInfo['script'])
-    signatures.add(signature)
-    
-    info['scriptSignature'] = signature
-    
-    ttype = 'Unknown'
-    scriptTypeInfo = scriptTypes_bySignature.get(signature)
-    if scriptTypeInfo is not None:
-      # is a well-known script
-      ttype = scriptTypeInfo.get('type')
-      
-      # update the script (once) and set up a 'push' action
-      if not signature in scripts_bySignature:
-        script = scriptInfo['script']
-        scripts_bySignature[signature] = script
+  if ttype != 'Unknown':
+    # is a well-known script so update the script (once) and set up a 'push' action
+    if not signature in scripts_bySignature:
+      script = result.get('script')
+      if script is None:
+        # (signature came from the cache)
+        script = json_decode(getWithRetries('%sREST/script' % nodeAddressesByName[nodeName]).content)['script']
         
-        createPusher(ttype, script)
-    
-    signatureEvent = lookup_local_event('Script %s' % signature)
-    if signatureEvent is None:
-      signatureEvent = Event('Script %s' % signature, {'group': '"%s" scripts' % ttype, 'title': signature, 'schema': SCRIPT_SCHEMA})
-      arg = {'signature': signature, 'nodes': ''}
-      signatureEvent.emit(arg)
-      
-    arg = signatureEvent.getArg()
-      
-    # add another node (need to do reconstruction instead of a direct '.append' in case of a locked list (from persistence)
-    newNodes = arg['nodes'] or ''
-    
-    if len(newNodes) == 0:
-      newNodes = str(nodeName)
-      
-    else:
-      newNodes = newNodes + "\r\n" + str(nodeName)
+      scripts_bySignature[signature] = script
+        
+      createPusher(ttype, script)
       
-    arg['nodes'] = newNodes
-    arg['type'] = ttype
-    
-    typeCount = countByType.get(ttype)
-    if typeCount is None:
-      countByType[ttype] = 1
-    else:
-      countByType[ttype] = typeCount + 1
+  # move the node if its signature has changed since the last survey
+  oldSignature = signaturesByNode.get(nodeName)
+  if oldSignature is not None and oldSignature != signature:
+    nodesBySignature[oldSignature].discard(nodeName)
+    emitSignature(oldSignature)
     
-    signatureEvent.emit(arg)
+  signaturesByNode[nodeName] = signature
+  nodesBySignature.setdefault(signature, set()).add(nodeName)
+  
+  emitSignature(signature)
+  
+  emitNodeInfo(nodeName, {'scriptModified': result['modified'], 'scriptSignature': signature})
+  
+def emitSignature(signature):
+  ttype = getScriptType(signature)
+  
+  signatureEvent = lookup_local_event('Script %s' % signature)
+  if signatureEvent is None:
+    signatureEvent = Event('Script %s' % signature, {'group': '"%s" scripts' % ttype, 'title': signature, 'schema': SCRIPT_SCHEMA})
     
-  except:
-    info['scriptModified'] = ''
+  # (reconstructed instead of modified in case of a locked map (from persistence))
+  arg = {'signature': signature,
+         'type': ttype,
+         'nodes': '\r\n'.join(sorted([str(name) for name in nodesBySignature.get(signature) or []])),
+         'notes': (signatureEvent.getArg() or {}).get('notes')}
+  
+  signatureEvent.emit(arg)
     
-    raise
+def createPusher(ttype, script):
+  
+  def pushTo(nodeName):
+    address = nodeAddressesByName[SimpleName(nodeName)]
     
-  finally:
-    event.emit(info)
+    scriptUrl = '%sREST/script/save' % address
     
-def createPusher(ttype, script):
+    return getWithRetries(scriptUrl, post=json_encode({'script': script})).content
   
   def handler(arg):
     nodes = [x.strip() for x in arg.splitlines() if len(x.strip())>0]
     
     console.info('Pushing to %s...' % nodes)
     
-    for nodeName in nodes:
-      address = nodeAddressesByName[SimpleName(nodeName)]
-  
-      scriptUrl = '%sREST/script/save' % address
-    
-      result = get_url(scriptUrl, post=json_encode({'script': script}))
-      console.info('result: %s' % result)
+    for nodeName, result, exc in newWorkerPool().map(pushTo, nodes):
+      if exc is not None:
+        console.warn('("%s" failed: %s)' % (nodeName, exc))
+      else:
+        console.info('result (%s): %s' % (nodeName, result))
   
   Action('Push script type %s' % ttype, handler, 
          {'title': 'Push "%s"' % ttype, 'group': 'Push', 'caution': 'Are you sure?', 'schema': {'type': 'string', 'format': 'long'}})
@@ -360,25 +538,116 @@ def createPusher(ttype, script):
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 
 import hashlib
+import codecs
+
+SIGNATURE_CHUNK_SIZE = 64 * 1024 # (in characters)
+
+class SignatureBuilder:
+  '''Builds a loose signature of text-based content which is fed in chunks of any size'''
+  
+  def __init__(self):
+    self._m = hashlib.md5()
+    
+    self._totalLines = 0 # the number of lines in the file
+    self._codeLines = 0  # the number of lines of code (comments excluded)
+    self._totalSize = 0  # the number of characters of code (comments excluded)
+    
+    self._carry = u'' # an incomplete line from the previous chunk
+    
+  def update(self, chunk):
+    lines = (self._carry + chunk).splitlines(True)
+    
+    # hold back the last line if it may not be complete (a trailing CR may be followed by LF)
+    if len(lines) > 0 and (lines[-1].endswith('\r') or len(lines[-1].splitlines()[0]) == len(lines[-1])):
+      self._carry = lines.pop()
+    else:
+      self._carry = u''
+      
+    for line in lines:
+      self._line(line.splitlines()[0])
+      
+  def _line(self, line):
+    self._totalLines = self._totalLines + 1
+    
+    stripped = line.strip()
+    if not stripped.startswith('#'):
+      self._codeLines = self._codeLines + 1
+      self._totalSize = self._totalSize + len(stripped)
+      
+    self._m.update(line.encode('utf-8')) # update the digest with comment
+    
+  def signature(self):
+    if len(self._carry) > 0:
+      self._line(self._carry.splitlines()[0])
+      self._carry = u''
+      
+    h = self._m.digest().encode('hex')
+    
+    return 'loc:%s size:%s hash:%s' % (self._codeLines, self._totalSize, h)
 
 # gets a loose signature of a text-based file
 def getSignature(data):
-  m = hashlib.md5()
+  builder = SignatureBuilder()
+  
+  for offset in range(0, len(data), SIGNATURE_CHUNK_SIZE):
+    builder.update(data[offset:offset+SIGNATURE_CHUNK_SIZE])
+    
+  return builder.signature()
+
+def getFileSignature(f):
+  '''Same as getSignature but streams the file in chunks'''
+  builder = SignatureBuilder()
   
-  totalLines = 0 # the number of lines in the file
-  codeLines = 0 # the number of lines of code (comments excluded)
-  totalSize = 0 # the number of characters of code (comments excluded)
+  reader = codecs.open(f.getAbsolutePath(), 'r', 'utf-8')
+  try:
+    while True:
+      chunk = reader.read(SIGNATURE_CHUNK_SIZE)
+      if len(chunk) == 0:
+        break
+      
+      builder.update(chunk)
+      
+  finally:
+    reader.close()
+    
+  return builder.signature()
+
+RECIPE_INDEX_FILE = 'recipeIndex.json'
+
+class RecipeIndex:
+  '''Signatures of recipe scripts by path, persisted so only new or changed files (by modified time and size) are hashed'''
   
-  for line in data.splitlines():
-    totalLines = totalLines + 1
+  def __init__(self, indexFile):
+    self._file = indexFile
+    self._entries = {} # e.g. { '/recipes/pjlink/script.py': {'modified': ___, 'size': ___, 'signature': ___} }
+    self._seen = set()
     
-    stripped = line.strip()
-    if not stripped.startswith('#'):
-      codeLines = codeLines + 1
-      totalSize = totalSize + len(stripped)
+    self.hashed = 0
+    
+    if indexFile.exists():
+      try:
+        self._entries = json_decode(Stream.readFully(indexFile)) or {}
+      except:
+        console.warn('Recipe index could not be read; will rebuild it')
+        
+  def signatureOf(self, f):
+    path = f.getAbsolutePath()
+    modified, size = f.lastModified(), f.length()
+    
+    self._seen.add(path)
+    
+    entry = self._entries.get(path)
+    if entry is None or entry.get('modified') != modified or entry.get('size') != size:
+      entry = {'modified': modified, 'size': size, 'signature': getFileSignature(f)}
+      self._entries[path] = entry
+      self.hashed += 1
       
-    m.update(line.encode('utf-8')) # update the digest with comment
+    return entry['signature']
+  
+  def save(self):
+    # drop the files that no longer exist
+    entries = dict([(path, self._entries[path]) for path in self._seen if path in self._entries])
     
-  h = m.digest().encode('hex')
+    Stream.writeFully(self._file, json_encode(entries))
     
-  return 'loc:%s size:%s hash:%s' % (codeLines, totalSize, h)
+recipeIndex = None
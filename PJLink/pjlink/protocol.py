@@ -6,13 +6,13 @@ def read_until(f, term):
         c = f.read(1)
     return ''.join(data)
 
-def to_binary(body, param, sep=' '):
+def to_binary(body, param, sep=' ', version='1'):
     assert body.isupper()
 
     assert len(body) == 4
     assert len(param) <= 128
 
-    return '%1' + body + sep + param + '\r'
+    return '%' + version + body + sep + param + '\r'
 
 def parse_response(f, data=''):
     if len(data) < 7:
@@ -22,8 +22,8 @@ def parse_response(f, data=''):
     assert header == '%'
 
     version = data[1]
-    # only class 1 is currently defined
-    assert version == '1'
+    # class 1, or class 2 (which extends class 1)
+    assert version in ('1', '2')
 
     body = data[2:6]
     # commands are case-insensitive, but let's turn them upper case anyway
@@ -41,154 +41,353 @@ local_event_Errors = LocalEvent({'group': 'Information', 'schema': {'type': 'obj
 PJLINK_ERRORKEYS = ['fan', 'lamp', 'temperature', 'cover', 'filter', 'other'] # sorted by relative interest when presenting status
 
 def main():
+  initPool()
+
+  initFleet()
+
+  initNotifications()
+
   if len((param_ipAddress or '').strip()) == 0:
-    console.warn('No IP address configured; nothing to do')
+    if len(_fleet) == 0:
+      console.warn('No IP address configured; nothing to do')
+
     return
   
   console.info('Using network destination [%s:%s]' % (param_ipAddress, param_port or DEFAULT_PORT))
-  console.info('Power state is polled every 5 minutes unless actively switching power or inputs.')
+  console.info('Power state is polled every 5 minutes unless actively switching power or inputs (less often once class 2 notifications are received).')
   console.info('Use "Power" and "Input" actions for reliable (managed) state transitions')
 
+  conn = getDefaultConnection()
+  conn.onKeepAlive = handlePowerState
+
+  addNotificationHandler(conn.address, handleNotification)
+
 def local_action_RawPowerOn(arg=None):
   '''{"desc": "Turns projector on.", "group": "Power"}'''
-  p = get_projector()
-  if(p):
-    try:
-      p.set_power('on')
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  withProjector(lambda p: p.set_power('on'))
 
 def local_action_RawPowerOff(arg=None):
   '''{"desc": "Turns the projector off.", "group": "Power" }'''
-  p = get_projector()
-  if(p):
-    try:
-      p.set_power('off')
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  withProjector(lambda p: p.set_power('off'))
 
 def local_action_GetPower(arg=None):
   '''{"desc": "Get power state of projector.", "group": "Power" }'''
-  p = get_projector()
-  if(p):
-    try:
-      pwr = p.get_power()
-      local_event_PowerState.emit(pwr)
-      
-      # for status reporting
-      lastReceive[0] = system_clock()
-      
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  pwr = withProjector(lambda p: p.get_power())
+  if pwr != None:
+    handlePowerState(pwr)
+
+def handlePowerState(pwr):
+  local_event_PowerState.emit(pwr)
+
+  # for status reporting
+  lastReceive[0] = system_clock()
 
 def local_action_RawSetInput(arg):
   '''{"desc": "Set projector input.", "group": "Inputs", "schema": { "type":"object", "required":true, "title": "Input", "properties":{ 
           "number": { "type":"integer", "title": "Number", "required":true }, 
           "source": { "type":"string", "title": "Source", "required":true, "enum": ["RGB", "VIDEO", "DIGITAL", "STORAGE", "NETWORK"] } } } }'''
-  p = get_projector()
-  if(p):
-    try:
-      p.set_input(arg['source'], arg['number'])
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  withProjector(lambda p: p.set_input(arg['source'], arg['number']))
 
 def local_action_GetInput(arg=None):
   '''{"desc": "Get current input.", "group": "Inputs" }'''
-  p = get_projector()
-  if(p):
-    try:
-      inp = p.get_input()
-      local_event_InputState.emit(inp) # legacy
-      local_event_Input.emit({'source': inp[0], 'number': inp[1]}) # managed
-      
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  inp = withProjector(lambda p: parseInput(p.get('INPT')))
+  if inp != None:
+    handleInput(inp)
+
+def handleInput(inp):
+  local_event_InputState.emit(inp) # legacy
+  local_event_Input.emit({'source': inp[0], 'number': inp[1]}) # managed
 
 def local_action_Mute(what):
   '''{"schema": { "title": "What", "type": "string", "required": true, "enum" : ["video", "audio", "all"] }, "group": "Mute" }'''
-  p = get_projector()
-  if(p):
-    try:
-      what = { 'video': 1, 'audio': 2, 'all': 3, }[what]
-      p.set_mute(what, True)
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  what = { 'video': 1, 'audio': 2, 'all': 3, }[what]
+  withProjector(lambda p: p.set_mute(what, True))
 
 def local_action_Unmute(what):
   '''{"schema": { "title": "What", "type": "string", "required": true, "enum" : ["video", "audio", "all"] }, "group": "Mute" }'''
-  p = get_projector()
-  if(p):
-    try:
-      what = { 'video': 1, 'audio': 2, 'all': 3, }[what]
-      p.set_mute(what, False)
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
-
-PJLINK_ERRORBYLEVEL = {0: 'OK', 1: 'Warning', 2: 'Error'}
+  what = { 'video': 1, 'audio': 2, 'all': 3, }[what]
+  withProjector(lambda p: p.set_mute(what, False))
 
 def local_action_LampsAndErrors(x = None):
   '''{"desc": "Get lamp and errors info", "group": "Information" }'''
-  p = get_projector()
-  if(p):
-    try:
-      # get errors first in case lamps fails
-      errors = p.get_errors()
-      
-      for key in errors:
-        # resolve (overwrite) the error levels into text
-        # (note: 'get_errors' wraps the integer values as strings
-        errors[key] = PJLINK_ERRORBYLEVEL.get(int(errors[key]), 'Unknown')
-      
-      local_event_Errors.emit(errors)
-      
-      lampHours = list()
-      for i, (time, state) in enumerate(p.get_lamps()):
-          lampHours.append(str(time))
-          
-      local_event_LampHours.emit(', '.join(lampHours))
-          
-    except Exception, e:
-      local_event_LastCommsError.emit(e)
-    finally:
-      p.f.close()
+  conn = getDefaultConnection()
+  if conn == None:
+    return
 
-def get_projector():
   try:
+    # both queries are pipelined, one failing does not affect the other
+    errors, lamps = conn.query([('1', 'ERST'), ('1', 'LAMP')])
+
+    if errors != None:
+      local_event_Errors.emit(parseErrors(errors))
+
+    if lamps != None:
+      local_event_LampHours.emit(parseLampHours(lamps))
+
+  except:
+    local_event_LastCommsError.emit(describeError())
+
+def getDefaultConnection():
+  if len((param_ipAddress or '').strip()) == 0:
+    return None
+
+  return getConnection(param_ipAddress, param_port or DEFAULT_PORT, param_password)
+
+def withProjector(fn):
+  '''Calls fn(proj) over the pooled connection, returning its result or None if it failed'''
+  conn = getDefaultConnection()
+  if conn == None:
+    return None
+
+  try:
+    return conn.use(fn)
+
+  except:
+    local_event_LastCommsError.emit(describeError())
+    return None
+
+# <!--- connection pool
+
+# Connections are authenticated once and then reused by all actions and polls. Projectors drop a connection
+# after 30s without a command, so idle ones are either kept alive with a cheap power query or closed first.
+
+import threading
+from pjlink import protocol
+from pjlink.projector import ProjectorError, POWER_STATES_REV, SOURCE_TYPES_REV
+
+DEFAULT_IDLECLOSE = 20 # seconds
+KEEPALIVE_INTERVAL = 20 # seconds (within the projector's 30s inactivity timeout)
+
+param_connection = Parameter({'title': 'Connection', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+           'keepAlive': {'title': 'Keep alive', 'type': 'boolean', 'desc': 'Hold connections open indefinitely (some projectors only allow one controller connection)', 'order': 1},
+           'idleClose': {'title': 'Idle close (s)', 'type': 'integer', 'hint': str(DEFAULT_IDLECLOSE), 'desc': 'Unused connections are closed after this time (when not kept alive)', 'order': 2},
+           'noPipelining': {'title': 'No pipelining', 'type': 'boolean', 'desc': 'Wait for each response before sending the next query', 'order': 3}
+        }}})
+
+local_event_ConnectionStats = LocalEvent({'group': 'Debug', 'order': 10000+next_seq(), 'desc': 'Connection pool statistics (every minute)', 'schema': {'type': 'object', 'properties': {
+           'open': {'type': 'integer', 'order': 1},
+           'connects': {'type': 'integer', 'title': 'Connection setups', 'order': 2},
+           'requests': {'type': 'integer', 'order': 3},
+           'latencyAvg': {'type': 'number', 'title': 'Latency avg. (ms)', 'order': 4},
+           'latencyMax': {'type': 'integer', 'title': 'Latency max. (ms)', 'order': 5}
+        }}})
+
+_poolStats = { 'connects': 0, 'requests': 0, 'latencyTotal': 0, 'latencyMax': 0 }
+
+_keepAlive = False
+_idleCloseMillis = DEFAULT_IDLECLOSE * 1000
+_pipelining = True
+
+class PooledConnection:
+  '''A persistent, authenticated connection to one projector'''
+
+  def __init__(self, address, port, password):
+    self.address = address
+    self.port = port
+    self.password = password
+
+    self.onKeepAlive = None # optionally takes the raw power state
+
+    self._lock = threading.RLock()
+    self._sock = None
+    self._proj = None
+    self._lastUsed = 0
+
+  def isOpen(self):
+    return self._proj != None
+
+  def _connect(self):
     sock = socket.socket()
-    sock.settimeout(10) # envorce a conservative timeout to avoid 
+    sock.settimeout(10) # enforce a conservative timeout to avoid
                         # any accidental lingering connections
-    sock.connect((param_ipAddress, param_port or DEFAULT_PORT))
-    f = sock.makefile()
-    proj = pjlink.Projector(f)
-    rv = proj.authenticate(lambda: param_password)
-    if(rv or rv is None):
-      return proj
-    else:
-      local_event_LastCommsError.emit('authentication error')
-      return False
-  except:
-    # may not be native Python exception, so capture using 'sys'
-    eType, eValue, eTraceback = sys.exc_info()
+    try:
+      sock.connect((self.address, self.port))
+      proj = pjlink.Projector(sock.makefile())
+      rv = proj.authenticate(lambda: self.password or '')
 
-    local_event_LastCommsError.emit('connection error - %s' % eValue)
-    
-    return False
-  finally:
-    sock.close()
+    except:
+      sock.close()
+      raise
+
+    if rv == False:
+      sock.close()
+      raise ProjectorError('authentication error')
+
+    self._sock = sock
+    self._proj = proj
+
+    _poolStats['connects'] += 1
+
+  def use(self, fn):
+    '''Calls fn(proj) over the connection, reconnecting once if the projector has dropped it'''
+    self._lock.acquire()
+
+    try:
+      while True:
+        fresh = self._proj == None
+        if fresh:
+          self._connect()
+
+        started = system_clock()
+
+        try:
+          result = fn(self._proj)
+
+        except ProjectorError:
+          # (reported by the projector, connection is still good)
+          self._lastUsed = system_clock()
+          raise
+
+        except:
+          self.close()
+
+          if fresh:
+            raise
+
+          # otherwise was likely a stale connection so try once more on a fresh one
+          continue
+
+        self._lastUsed = system_clock()
+
+        latency = self._lastUsed - started
+        _poolStats['requests'] += 1
+        _poolStats['latencyTotal'] += latency
+        if latency > _poolStats['latencyMax']:
+          _poolStats['latencyMax'] = latency
+
+        return result
+
+    finally:
+      self._lock.release()
+
+  def query(self, queries):
+    '''Queries in one go, e.g. [('1', 'POWR'), ('2', 'INPT')], returning each param (or None if the projector reported an error)'''
+    def pipeline(proj):
+      batchSize = len(queries) if _pipelining else 1
+      results = list()
+
+      for i in range(0, len(queries), batchSize):
+        batch = queries[i:i+batchSize]
+
+        proj.f.write(''.join([protocol.to_binary(body, '?', version=version) for (version, body) in batch]))
+        proj.f.flush()
+
+        # responses come back in order
+        for (version, body) in batch:
+          respBody, param = protocol.parse_response(proj.f)
+          assert respBody == body
+
+          results.append(None if param in protocol.ERRORS else param)
+
+      return results
+
+    return self.use(pipeline)
+
+  def maintain(self, now):
+    # (skip if busy, it's obviously not idle)
+    if not self._lock.acquire(False):
+      return
+
+    try:
+      if self._proj == None:
+        return
+
+      idle = now - self._lastUsed
+
+      if _keepAlive:
+        if idle >= KEEPALIVE_INTERVAL * 1000:
+          powr = self.query([('1', 'POWR')])[0]
+          if self.onKeepAlive and powr in POWER_STATES_REV:
+            self.onKeepAlive(POWER_STATES_REV[powr])
+
+      elif idle >= _idleCloseMillis:
+        self.close()
+
+    except:
+      # (connection will have been closed)
+      pass
+
+    finally:
+      self._lock.release()
+
+  def close(self):
+    sock = self._sock
+
+    self._sock = None
+    self._proj = None
+
+    if sock != None:
+      try:
+        sock.close()
+      except:
+        pass
+
+_pool = {} # by (address, port)
+
+def getConnection(address, port, password):
+  key = (address, port)
+
+  conn = _pool.get(key)
+  if conn == None:
+    conn = PooledConnection(address, port, password)
+    _pool[key] = conn
+
+  return conn
+
+def maintainPool():
+  now = system_clock()
+
+  for conn in _pool.values():
+    conn.maintain(now)
+
+timer_poolMaintainer = Timer(maintainPool, 5, 5)
+
+def emitConnectionStats():
+  requests = _poolStats['requests']
+
+  local_event_ConnectionStats.emit({ 'open': len([conn for conn in _pool.values() if conn.isOpen()]),
+                                     'connects': _poolStats['connects'],
+                                     'requests': requests,
+                                     'latencyAvg': round(float(_poolStats['latencyTotal']) / requests, 1) if requests > 0 else 0,
+                                     'latencyMax': _poolStats['latencyMax'] })
+
+  _poolStats['connects'] = _poolStats['requests'] = _poolStats['latencyTotal'] = _poolStats['latencyMax'] = 0
+
+timer_connectionStats = Timer(emitConnectionStats, 60, 60)
+
+def initPool():
+  global _keepAlive, _idleCloseMillis, _pipelining
+
+  connection = param_connection or {}
+
+  _keepAlive = connection.get('keepAlive') == True
+  _idleCloseMillis = (connection.get('idleClose') or DEFAULT_IDLECLOSE) * 1000
+  _pipelining = connection.get('noPipelining') != True
+
+# PJLINK response parsing
+
+PJLINK_ERRORBYLEVEL = {0: 'OK', 1: 'Warning', 2: 'Error'}
+
+PJLINK_ERSTFIELDS = ['fan', 'lamp', 'temperature', 'cover', 'filter', 'other'] # (order of the ERST response)
+
+def parseInput(param):
+  # e.g. '31' is DIGITAL 1, class 2 also has '3A' to '3Z'
+  return (SOURCE_TYPES_REV.get(param[0], 'UNKNOWN'), int(param[1:], 36))
+
+def parseErrors(param):
+  # e.g. '000010' is a filter warning
+  return dict([ (key, PJLINK_ERRORBYLEVEL.get(int(value), 'Unknown')) for (key, value) in zip(PJLINK_ERSTFIELDS, param) ])
+
+def parseLampHours(param):
+  # e.g. '1200 1 0 0' is (hours, on) pairs
+  return ', '.join(param.split(' ')[::2])
+
+def describeError():
+  # may not be native Python exception, so capture using 'sys'
+  eType, eValue, eTraceback = sys.exc_info()
+  return '%s' % (eValue or eType)
+
+# connection pool --->
 
 # managed power and input select
 
@@ -205,7 +404,7 @@ def syncPower():
     console.info('Power matches desired state ("%s")' % desiredPower)
     timer_powerSyncer.stop()
     
-    timer_powerRetriever.setInterval(5*60) # revert power poller
+    timer_powerRetriever.setInterval(pollInterval()) # revert power poller
     
     return
   
@@ -216,7 +415,7 @@ def syncPower():
     console.warn('Giving up syncing power; more than %s seconds elapsed' % ENFORCEMENT_TIME)
     timer_powerSyncer.stop()
     
-    timer_powerRetriever.setInterval(5*60) # revert power poller
+    timer_powerRetriever.setInterval(pollInterval()) # revert power poller
     
     return
   
@@ -239,7 +438,7 @@ def syncInput():
   if same_value(desired, actual):
     console.info('Input matches desired state ("%s")' % desired)
     timer_inputSyncer.stop()
-    timer_inputRetriever.setInterval(5*60) # revert poller
+    timer_inputRetriever.setInterval(pollInterval()) # revert poller
     return
   
   # should be expiring?
@@ -248,7 +447,7 @@ def syncInput():
   if lastSet != None and (date_now().getMillis() - lastSet.getMillis() > ENFORCEMENT_TIME*1000):
     console.warn('Giving up syncing input; more than %s seconds elapsed' % ENFORCEMENT_TIME)
     timer_inputSyncer.stop()
-    timer_inputRetriever.setInterval(5*60) # revert poller
+    timer_inputRetriever.setInterval(pollInterval()) # revert poller
     return
   
   # otherwise, if power is on, attempt to sync
@@ -270,6 +469,261 @@ def retrieveInputIfOn():
     
 timer_inputRetriever = Timer(retrieveInputIfOn, 5*60, 5) # retrieve the input every 5 minutes (unless syncing)
 
+# <!--- class 2 notifications
+
+# Class 2 projectors push status changes (to the controller that last communicated with them) and announce
+# themselves with LKUP when their network comes up, so status polling is relaxed once notifications arrive.
+# (only one node per host can listen on the PJLINK port so it's opt-in; use fleet mode for several projectors)
+
+NOTIFY_PORT = 4352
+
+param_notifications = Parameter({'title': 'Listen for class 2 notifications', 'order': next_seq(), 'schema': {'type': 'boolean'},
+                                 'desc': 'Binds UDP port %s; only one node on this host can do so' % NOTIFY_PORT})
+
+NOTIFIED_POLL_INTERVAL = 15*60 # (instead of 5 mins)
+NOTIFIED_SYNC_POLL_INTERVAL = 30 # (instead of 10s)
+
+_notificationHandlers = {} # by projector IP address (resolved), takes (body, param)
+
+from java.net import InetAddress
+
+def addNotificationHandler(address, handler):
+  # (notifications arrive from the IP address, which might have been configured as a host name)
+  try:
+    address = InetAddress.getByName(address).getHostAddress()
+
+  except:
+    console.warn('Could not resolve "%s"; notifications from it may be missed' % address)
+
+  _notificationHandlers[address] = handler
+
+_notified = [False] # (for this projector, fleet members track their own)
+
+def pollInterval():
+  return NOTIFIED_POLL_INTERVAL if _notified[0] else 5*60
+
+def syncPollInterval():
+  return NOTIFIED_SYNC_POLL_INTERVAL if _notified[0] else 10
+
+def udp_received(source, data):
+  # e.g. from '/192.168.1.50:4352', '%2POWR=1\r' or '%2LKUP=00:0A:1B:2C:3D:4E\r'
+  address = source.split('/')[-1].rsplit(':', 1)[0]
+
+  handler = _notificationHandlers.get(address)
+  if handler == None:
+    return
+
+  for line in data.split('\r'):
+    if len(line) < 8 or line[0:2] != '%2' or line[6] != '=':
+      continue
+
+    try:
+      handler(line[2:6].upper(), line[7:])
+
+    except:
+      console.warn('Bad notification from %s: %s (%s)' % (address, line, describeError()))
+
+udp_notifications = None # (only when enabled)
+
+def initNotifications():
+  if not param_notifications:
+    return
+
+  global udp_notifications
+  udp_notifications = UDP(source='0.0.0.0:%s' % NOTIFY_PORT, received=udp_received)
+
+def handleNotification(body, param):
+  if not _notified[0]:
+    console.info('Class 2 notifications are being received; relaxing status polling')
+    _notified[0] = True
+
+    if timer_powerSyncer.isStopped():
+      timer_powerRetriever.setInterval(pollInterval())
+
+    if timer_inputSyncer.isStopped():
+      timer_inputRetriever.setInterval(pollInterval())
+
+  if body == 'POWR':
+    if param in POWER_STATES_REV:
+      handlePowerState(POWER_STATES_REV[param])
+
+  elif body == 'INPT':
+    handleInput(parseInput(param))
+
+  elif body == 'ERST':
+    local_event_Errors.emit(parseErrors(param))
+
+  elif body == 'LKUP':
+    # projector (re)joined the network, catch up on its state
+    console.info('Projector link-up notification (MAC %s)' % param)
+
+    call(lambda: lookup_local_action('GetPower').call(), 1)
+    call(retrieveInputIfOn, 3)
+
+# class 2 notifications --->
+
+# <!--- fleet
+
+# Any number of additional projectors can be managed from this node, each with its own signals and actions.
+# Status polls share the connection pool and are spread out, one projector per tick, pipelining the queries.
+
+FLEET_POLL_INTERVAL = 5*60 # seconds
+FLEET_INFO_INTERVAL = 4*3600 # errors and lamp hours
+FLEET_CONFIRM_DELAY = 3 # seconds after a power or input change
+
+param_fleet = Parameter({'title': 'Fleet', 'order': next_seq(), 'desc': 'Additional projectors', 'schema': {'type': 'array', 'items': {'type': 'object', 'properties': {
+           'name': {'type': 'string', 'order': 1},
+           'ipAddress': {'title': 'IP address', 'type': 'string', 'order': 2},
+           'port': {'type': 'integer', 'hint': str(DEFAULT_PORT), 'order': 3},
+           'password': {'type': 'string', 'order': 4}
+        }}}})
+
+FLEET_INPUT_SCHEMA = {'type': 'object', 'properties': {
+                       'number': {'type': 'integer', 'order': 1},
+                       'source': {'type': 'string', 'order': 2, 'enum': ['RGB', 'VIDEO', 'DIGITAL', 'STORAGE', 'NETWORK']} }}
+
+FLEET_ERRORS_SCHEMA = {'type': 'object', 'properties': dict([ (key, {'type': 'string', 'enum': PJLINK_ERRORLEVELS, 'order': i+1}) for (i, key) in enumerate(PJLINK_ERSTFIELDS) ])}
+
+_fleet = list()
+
+class FleetMember:
+  def __init__(self, name, address, port, password):
+    self.name = name
+
+    self.conn = getConnection(address, port, password)
+    self.conn.onKeepAlive = self.handlePowerState
+
+    self.notified = False
+    self.nextPoll = 0 # (millis)
+    self.nextInfoPoll = 0
+
+    group = 'Projector "%s"' % name
+
+    self.powerStateSignal = create_local_event('%s Power State' % name, {'title': 'Power State', 'group': group, 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['off', 'on', 'cooling', 'warm-up']}})
+    self.inputSignal = create_local_event('%s Input' % name, {'title': 'Input', 'group': group, 'order': next_seq(), 'schema': FLEET_INPUT_SCHEMA})
+    self.errorsSignal = create_local_event('%s Errors' % name, {'title': 'Errors', 'group': group, 'order': next_seq(), 'schema': FLEET_ERRORS_SCHEMA})
+    self.lampHoursSignal = create_local_event('%s Lamp Hours' % name, {'title': 'Lamp Hours', 'group': group, 'order': next_seq(), 'schema': {'type': 'string'}})
+    self.lastCommsErrorSignal = create_local_event('%s Last Comms Error' % name, {'title': 'Last Comms Error', 'group': group, 'order': next_seq(), 'schema': {'type': 'string'}})
+
+    powerAction = create_local_action('%s Power' % name, self.setPower, {'title': 'Power', 'group': group, 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
+    create_local_action('%s Power On' % name, lambda ignore: powerAction.call('On'), {'title': 'On', 'group': group, 'order': next_seq()})
+    create_local_action('%s Power Off' % name, lambda ignore: powerAction.call('Off'), {'title': 'Off', 'group': group, 'order': next_seq()})
+    create_local_action('%s Input' % name, self.setInput, {'title': 'Input', 'group': group, 'order': next_seq(), 'schema': FLEET_INPUT_SCHEMA})
+
+  def poll(self, now):
+    queries = [('1', 'POWR'), ('1', 'INPT')]
+
+    withInfo = now >= self.nextInfoPoll
+    if withInfo:
+      queries.extend([('1', 'ERST'), ('1', 'LAMP')])
+
+    self.nextPoll = now + (NOTIFIED_POLL_INTERVAL if self.notified else FLEET_POLL_INTERVAL) * 1000
+
+    try:
+      results = self.conn.query(queries)
+
+    except:
+      self.lastCommsErrorSignal.emit(describeError())
+      return
+
+    powr, inpt = results[0], results[1]
+
+    if powr in POWER_STATES_REV:
+      self.handlePowerState(POWER_STATES_REV[powr])
+
+    # (not available while off)
+    if inpt != None:
+      self.handleInput(parseInput(inpt))
+
+    if withInfo:
+      self.nextInfoPoll = now + FLEET_INFO_INTERVAL * 1000
+
+      if results[2] != None:
+        self.errorsSignal.emit(parseErrors(results[2]))
+
+      if results[3] != None:
+        self.lampHoursSignal.emit(parseLampHours(results[3]))
+
+  def handlePowerState(self, pwr):
+    self.powerStateSignal.emit(pwr)
+
+  def handleInput(self, inp):
+    self.inputSignal.emit({'source': inp[0], 'number': inp[1]})
+
+  def handleNotification(self, body, param):
+    self.notified = True
+
+    if body == 'POWR':
+      if param in POWER_STATES_REV:
+        self.handlePowerState(POWER_STATES_REV[param])
+
+    elif body == 'INPT':
+      self.handleInput(parseInput(param))
+
+    elif body == 'ERST':
+      self.errorsSignal.emit(parseErrors(param))
+
+    elif body == 'LKUP':
+      # projector (re)joined the network, catch up on its state
+      self.confirmSoon()
+
+  def setPower(self, arg):
+    self.perform(lambda p: p.set_power('on' if arg == 'On' else 'off'))
+
+  def setInput(self, arg):
+    self.perform(lambda p: p.set_input(arg['source'], arg['number']))
+
+  def perform(self, fn):
+    try:
+      self.conn.use(fn)
+
+    except:
+      self.lastCommsErrorSignal.emit(describeError())
+
+    self.confirmSoon()
+
+  def confirmSoon(self):
+    self.nextPoll = min(self.nextPoll, system_clock() + FLEET_CONFIRM_DELAY * 1000)
+
+def initFleet():
+  for info in param_fleet or []:
+    name = (info.get('name') or '').strip()
+    address = (info.get('ipAddress') or '').strip()
+
+    if len(name) == 0 or len(address) == 0:
+      console.warn('Fleet member is missing a name or IP address; ignoring')
+      continue
+
+    member = FleetMember(name, address, info.get('port') or DEFAULT_PORT, info.get('password'))
+    _fleet.append(member)
+
+    addNotificationHandler(address, member.handleNotification)
+
+  if len(_fleet) > 0:
+    console.info('Managing a fleet of %s additional projector(s)' % len(_fleet))
+
+_fleetNext = [0] # round-robin position
+
+def pollFleet():
+  count = len(_fleet)
+  if count == 0:
+    return
+
+  now = system_clock()
+
+  # poll at most one member per tick so dozens of projectors don't all poll at once
+  for i in range(count):
+    member = _fleet[(_fleetNext[0] + i) % count]
+
+    if now >= member.nextPoll:
+      _fleetNext[0] = (_fleetNext[0] + i + 1) % count
+      member.poll(now)
+      return
+
+timer_fleetPoller = Timer(pollFleet, 1, 10)
+
+# fleet --->
+
 # power
 
 def local_action_Power(arg=None):
@@ -279,11 +733,11 @@ def local_action_Power(arg=None):
   local_event_DesiredPower.emit(arg)
   
   if timer_powerSyncer.isStopped():
-    console.info('Kicking off power syncer immediately (then every 10s) and power state retriever after 3 seconds (then every 10s)')
+    console.info('Kicking off power syncer immediately (then every 10s) and power state retriever after 3 seconds (then every %ss)' % syncPollInterval())
     timer_powerSyncer.setDelayAndInterval(0.001, 10)
     timer_powerSyncer.start()
     
-    timer_powerRetriever.setDelayAndInterval(3, 10)
+    timer_powerRetriever.setDelayAndInterval(3, syncPollInterval())
     
 def local_action_PowerOn(arg=None):
   '''{"title": "On (managed)", "group": "Power"}'''
@@ -324,11 +778,11 @@ def local_action_Input(arg=None):
   local_event_DesiredInput.emit(arg)
   
   if timer_inputSyncer.isStopped():
-    console.info('Kicking off input syncer immediately (then every 10s) and input state retriever after 3 seconds (then every 10s)')
+    console.info('Kicking off input syncer immediately (then every 10s) and input state retriever after 3 seconds (then every %ss)' % syncPollInterval())
     timer_inputSyncer.setDelayAndInterval(0.001, 10)
     timer_inputSyncer.start()
     
-    timer_inputRetriever.setDelayAndInterval(3, 10)      
+    timer_inputRetriever.setDelayAndInterval(3, syncPollInterval())      
 
 @after_main
 def trapPowerSignals():
@@ -1,7 +1,7 @@
 '''
 **QSC Q-SYS Core**
 
-`rev 7`
+`rev 8`
 
  * simply drag-drop **External Controls.xml** into the node root and restart node
  * supports [Q-SYS Core Redundany](https://q-syshelp.qsc.com/q-sys_8.2/Content/Redundancy/Redundancy_Core.htm) operation via a third instance
@@ -9,6 +9,7 @@
  
 _changelog_
 
+* _rev. 8: controls split into meter, level and status change groups, each with its own poll rate; meter decimation_
 * _rev. 7.2405: tidyup_
 * _rev. 6: add CoreState for redundant operation_
 * _rev. 4.2302: JP added "level" and "message" for Status backwards support_
@@ -31,6 +32,18 @@ param_qscBinding = Parameter({"order": 3, "title": "QSC binding (if no 'External
 param_includeMetersOnly = Parameter({ 'order': 4, 'schema': { 'type': 'boolean' }})
 param_excludeMeters = Parameter({ 'order': 5, 'schema': { 'type': 'boolean' }})
 
+DEFAULT_METER_RATE = 0.3     # seconds
+DEFAULT_LEVEL_RATE = 0.5     # seconds
+DEFAULT_STATUS_RATE = 2.0    # seconds
+DEFAULT_METER_THRESHOLD = 1.0 # dB
+
+param_changeGroups = Parameter({ 'order': 6, 'title': 'Change groups', 'schema': { 'type': 'object', 'properties': {
+                                   'meterRate': { 'order': 1, 'title': 'Meter poll rate (s)', 'type': 'number', 'hint': str(DEFAULT_METER_RATE) },
+                                   'levelRate': { 'order': 2, 'title': 'Level and mute poll rate (s)', 'type': 'number', 'hint': str(DEFAULT_LEVEL_RATE) },
+                                   'statusRate': { 'order': 3, 'title': 'Status poll rate (s)', 'type': 'number', 'hint': str(DEFAULT_STATUS_RATE) },
+                                   'meterThreshold': { 'order': 4, 'title': 'Meter threshold (dB)', 'type': 'number', 'hint': str(DEFAULT_METER_THRESHOLD),
+                                                       'desc': 'Meter changes smaller than this are not emitted' }}}})
+
 # <!-- related to redundancy
 
 local_event_CoreState = LocalEvent({ 'desc': 'Relates to redundant operation', 'schema': { 'type': 'string' }})
@@ -65,9 +78,6 @@ import xml.etree.ElementTree as ET
 QSC_NAMED_CONTROLS = ["Station1_PushToTalk_Input"]
 qscNamedControls = list()
 
-# how often to poll when rapid is needed
-QSC_RAPID_POLL = 0.3
-
 # General signals ---
 
 local_event_EngineStatus = LocalEvent({'group': 'System information', 'order': 1, 'schema': {
@@ -89,6 +99,83 @@ local_event_EngineStatus = LocalEvent({'group': 'System information', 'order': 1
 
 # stores signals by control ID
 externalControlSignalsByControlID = {}
+
+# <!-- change groups
+
+# controls are split by class into their own change groups so that slow-changing
+# controls aren't polled (and decoded) as often as meters
+CHANGE_GROUP_METERS = 'meters'
+CHANGE_GROUP_LEVELS = 'levels'
+CHANGE_GROUP_STATUS = 'status'
+
+CHANGE_GROUPS = [ CHANGE_GROUP_METERS, CHANGE_GROUP_LEVELS, CHANGE_GROUP_STATUS ]
+
+# control IDs by change group, e.g. { 'meters': ['Mic1Meter', ...], ... }
+controlIDsByChangeGroup = { CHANGE_GROUP_METERS: list(), CHANGE_GROUP_LEVELS: list(), CHANGE_GROUP_STATUS: list() }
+
+# pre-resolved feedback handlers by control ID (Name), takes (string, value)
+feedbackByControlID = {}
+
+def getChangeGroupRate(group):
+  changeGroups = param_changeGroups or EMPTY
+  
+  if group == CHANGE_GROUP_METERS:
+    return changeGroups.get('meterRate') or DEFAULT_METER_RATE
+  elif group == CHANGE_GROUP_STATUS:
+    return changeGroups.get('statusRate') or DEFAULT_STATUS_RATE
+  else:
+    return changeGroups.get('levelRate') or DEFAULT_LEVEL_RATE
+
+def getMeterThreshold():
+  threshold = (param_changeGroups or EMPTY).get('meterThreshold')
+  if threshold == None:
+    return DEFAULT_METER_THRESHOLD
+  
+  return threshold
+
+def classifyControl(controlID, controlType, componentNameLower):
+  if controlType == 'Status':
+    return CHANGE_GROUP_STATUS
+  
+  if 'meter' in componentNameLower or 'meter' in controlID.lower():
+    return CHANGE_GROUP_METERS
+  
+  return CHANGE_GROUP_LEVELS
+
+def newFeedbackHandler(signal, schemaType, isMeter):
+  # the decoding is decided once, at binding time, instead of per change
+  if schemaType == 'string':
+    return lambda string, value: signal.emit(string)
+
+  elif schemaType == 'boolean':
+    return lambda string, value: signal.emit(value == 1)
+  
+  # using 'object' to be native QSC type with 'value' and 'string' attributes
+  elif schemaType == 'object':
+    return lambda string, value: signal.emit({'string': string, 'value': value, 'level': value, 'message': string })
+  
+  elif isMeter:
+    threshold = getMeterThreshold()
+    
+    # only emit when the meter has moved by more than the threshold (dB)
+    last = [ None ]
+    
+    def handleMeter(string, value):
+      if value == None:
+        return
+      
+      if last[0] != None and abs(value - last[0]) < threshold:
+        return
+      
+      last[0] = value
+      signal.emit(value)
+      
+    return handleMeter
+  
+  else:
+    return lambda string, value: signal.emit(value)
+
+# -->
     
 # Comms section ---
 local_event_Connected = LocalEvent({'group': 'Comms', 'order': 1})
@@ -153,8 +240,10 @@ def local_action_SetControlValue(arg):
     qscControlSet(control, value)
     
 def local_action_InvalidateGlobalChangeGroup(arg):
-    '''{"group": "QSC direct", "order" : 1, "title" : "Invalidate global change group", "desc": "Resyncs ALL values."}'''
-    tcp.send(json_encode(newJSONrpc('ChangeGroup.Invalidate', params={"Id": "global"})))
+    '''{"group": "QSC direct", "order" : 1, "title" : "Invalidate change groups", "desc": "Resyncs ALL values."}'''
+    for group in CHANGE_GROUPS:
+      if len(controlIDsByChangeGroup[group]) > 0:
+        tcp.send(json_encode(newJSONrpc('ChangeGroup.Invalidate', params={"Id": group})))
     
 def refreshState():
     print 'Refreshing feedback.'
@@ -307,6 +396,10 @@ def bindNamedControlAction(controlID, properties):
     signal = Signal('QSC %s' % controlID, {'group': nodelGroup, 'order': next_seq(), 'title': controlID, 
                                            'schema' : schema})
     externalControlSignalsByControlID[controlID] = signal  
+    
+    changeGroup = classifyControl(controlID, controlType, componentNameLower)
+    controlIDsByChangeGroup[changeGroup].append(controlID)
+    feedbackByControlID[controlID] = newFeedbackHandler(signal, schema['type'], changeGroup == CHANGE_GROUP_METERS)
   
     def handler(arg=None):
         # support some other boolean type for convenience
@@ -376,7 +469,7 @@ def connected():
     timer.start()
     coreStatusPoll_timer.start()
     
-    request_setUpControlChangeGroupPolling(externalControlSignalsByControlID)
+    request_setUpControlChangeGroupPolling()
   
 def received(data):
     log(2, 'RECV: [%s]' % data)
@@ -419,53 +512,40 @@ def request_noOp():
     tcp.send(json_encode(newJSONrpc('NoOp', id='NoOp')))
 
 # Change group controlling -----------
-def request_setUpControlChangeGroupPolling(controls):
-    controlsList = [controlID for controlID in controls]
+def request_setUpControlChangeGroupPolling():
+    for group in CHANGE_GROUPS:
+        controlsList = controlIDsByChangeGroup[group]
+        if len(controlsList) == 0:
+            continue
   
-    # instruct the controls that need polling
-    tcp.send(json_encode(newJSONrpc('ChangeGroup.AddControl', params={"Id": "global", "Controls": controlsList})))
+        # instruct the controls that need polling
+        tcp.send(json_encode(newJSONrpc('ChangeGroup.AddControl', params={"Id": group, "Controls": controlsList})))
     
-    # TODO: check response
+        # TODO: check response
     
-    # set up an auto-poll
-    if not disable_autoPoll:
-        tcp.send(json_encode(newJSONrpc('ChangeGroup.AutoPoll', params={"Id": "global", "Rate": QSC_RAPID_POLL})))
+        # set up an auto-poll
+        if not disable_autoPoll:
+            tcp.send(json_encode(newJSONrpc('ChangeGroup.AutoPoll', params={"Id": group, "Rate": getChangeGroupRate(group)})))
     
     # ... changes start flying in!
 
 # e.g. {jsonrpc=2.0, method=ChangeGroup.Poll, 
-#      params={Id=global, Changes=[{Name=Station1_PushToTalk_Input, String=true, Value=1}]}}
+#      params={Id=meters, Changes=[{Name=Station1_PushToTalk_Input, String=true, Value=1}]}}
 def handleChangeGroupPollFeedback(packet):
     params = packet['params']
     
     # go through the changes
-    changes = params['Changes']
+    changes = params.get('Changes')
     if changes is None:
         return
     
     for change in changes:
-        name = change['Name']
-        string = change['String']
-        value = change['Value']
-        
-        # look up the signal
-        signal = externalControlSignalsByControlID.get(name)
-        if signal is None:
-            return
+        # look up the pre-resolved handler
+        feedback = feedbackByControlID.get(change['Name'])
+        if feedback is None:
+            continue
           
-        signalType = signal.getArgSchema().get('type')
-        if signalType == 'string':
-          signal.emit(string)
-
-        elif signalType == 'boolean':
-          signal.emit(value == 1)
-        
-        # using 'object' to be native QSC type with 'value' and 'string' attributes
-        elif signalType == 'object':
-          signal.emit({'string': string, 'value': value, 'level': value, 'message': string }) # TODO: limit to ONLY status
-        
-        else:
-          signal.emit(value)
+        feedback(change.get('String'), change.get('Value'))
 
 # Sets a control's value
 # (value can be bool of number)
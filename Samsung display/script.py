@@ -1,10 +1,12 @@
 '''
 **Samsung display** recipe, serial or TCP.
 
-`REV 13.2607`
+`REV 15.2610`
 
 Remember to adjust **Network Standby Control** to **On**.
 
+  * r15: received frames are checksum verified, resyncing on corrupt or stray data
+  * r14: daisy-chained displays (e.g. video walls) over one connection with broadcast group commands, shared status poll scheduler
   * r13: can suppress warnings, always log warning changes in console
   * r12: "Treat no signal as fault?" parameter
   * r11: BUGFIX random faults sometimes incorrectly generated on old displays when Powered Off (e.g. Lamp Fault)
@@ -65,12 +67,6 @@ INPUT_CODE_TABLE = [ ('1F', 'PC'),
 inputCodeEvent = Event('InputCode', {'group': 'Input code', 'order': next_seq(), 'schema': {'type': 'string'}})
 local_event_DesiredInputCode = LocalEvent({'group': 'Input code', 'order': next_seq(), 'schema': {'type': 'string'}})
 
-# poll input and power status every 30s
-timer_deviceStatus = Timer(lambda: getDisplayStatusAction.call(), 30)
-
-# check error status every 45 seconds (first after 15)
-timer_errorStatus = Timer(lambda: getExtendedDisplayStatusAction.call(), 45, 15)
-
 # <!-- IP addressing
 
 param_ipAddress = Parameter({ 'title': 'IP address', 'order': 0, 'schema': { 'type': 'string', 'hint': '(overrides remote binding)' }})
@@ -98,9 +94,7 @@ def main():
 
   if is_blank(ipAddress):
     console.warn('No IP address set!')
-    timer_deviceStatus.stop()
     timer_nonCritical.stop()
-    timer_errorStatus.stop()
     return
   
   print 'Nodel script started.'
@@ -122,62 +116,138 @@ def main():
   console.info('Will connect to [%s], setID:%s...' % (address, param_id))
   tcp.setDest(address)
 
+  initChain()
+
+  statusScheduler.start()
+
 local_event_TCPStatus = LocalEvent({'group': 'Comms', 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['Connected', 'Disconnected', 'Timeout']}})  
   
 def connected():
   console.info('TCP connected')
   local_event_TCPStatus.emitIfDifferent('Connected')
   
-  # wait a second and poll
-  timer_deviceStatus.setDelay(1.0)
+  # wait a second and poll (everything on the connection)
+  statusScheduler.allSoon(1.0)
   
-recvBuffer = list()
-
 # data can be fragmented so need a special request queue to manage the protocol
-  
-def received(data):
-  lastReceive[0] = system_clock()
-  log(3, 'tcp_recv [%s]' % data.encode('hex'))
-    
+
+MDC_HEADER = 0xaa
+MDC_RESPONSE = 0xff
+MDC_ACK = ord('A')
+MDC_NAK = ord('N')
+
+class FrameDecoder:
+  '''Extracts checksummed MDC frames from a byte stream that may be fragmented, concatenated or corrupted'''
+
   # aa-ff-00-09-41-00-01-00-00-14-10-00-00-6e
   #
   # aa   ff   00   09      41 ('A')    00
   # HDR  CMD  ID   length  ACK         R->Cmd
-  # +0   1    2    3       4           5  
-  
-  if len(recvBuffer) == 0:
-    if data[0] != chr(0xaa):
-      console.log('bad header; throwing away...')
-      return
-  
-  recvBuffer.extend(data)
-  
-  processBuffer()
-      
-def processBuffer():
-  for x in range(300): # avoiding an infinite loop
-    bufferLen = len(recvBuffer)
-    if bufferLen < 5:
-      # not big enough yet
-      return
-  
-    # got at least 4 bytes (fourth holds the length)
-    messageLen = ord(recvBuffer[3])
-  
-    fullLen = 4 + messageLen + 1
-  
-    if len(recvBuffer) >= fullLen:
-      message = ''.join(recvBuffer[:fullLen])
-      del recvBuffer[:fullLen]
-      
-      log(2, 'recv_samsung [%s]' % message.encode('hex'))
-      
-      queue.handle(message)
-      
-      # might be more, so continue...
-      
-    else:
-      return
+  # +0   1    2    3       4           5
+
+  def __init__(self, onFrame):
+    self._onFrame = onFrame
+    self.badFrames = 0
+    self.reset()
+
+  def reset(self):
+    self._buf = bytearray()
+    self._pos = 0    # start of the current frame (or unconsumed data)
+    self._sumPos = 1 # checksum covers everything after the header, up to here so far
+    self._sum = 0
+
+  def _restartAt(self, pos):
+    self._pos = pos
+    self._sumPos = pos + 1
+    self._sum = 0
+
+  def _falseHeader(self, pos):
+    self.badFrames += 1
+    log(2, 'false header; resyncing')
+    self._restartAt(pos + 1)
+
+  def feed(self, data):
+    buf = self._buf
+    buf.extend(data)
+
+    while True:
+      end = len(buf)
+      pos = self._pos
+
+      if pos >= end:
+        break
+
+      if buf[pos] != MDC_HEADER:
+        # resync on the next header
+        nextPos = buf.find(chr(MDC_HEADER), pos)
+        log(2, 'bad header; skipping %s byte(s)' % ((nextPos if nextPos >= 0 else end) - pos))
+
+        if nextPos < 0:
+          self._restartAt(end)
+          break
+
+        self._restartAt(nextPos)
+        pos = nextPos
+
+      # a stray 0xAA can't be trusted for its length, so check what should follow it first
+      if end - pos >= 2 and buf[pos+1] != MDC_RESPONSE:
+        self._falseHeader(pos)
+        continue
+
+      # got at least 5 bytes (fourth holds the length, fifth the ACK)?
+      if end - pos < 5:
+        break
+
+      if buf[pos+4] != MDC_ACK and buf[pos+4] != MDC_NAK:
+        self._falseHeader(pos)
+        continue
+
+      csumPos = pos + 4 + buf[pos+3]
+
+      # only sum bytes not already summed on an earlier (fragmented) pass
+      s = self._sum
+      for i in xrange(self._sumPos, min(end, csumPos)):
+        s += buf[i]
+      self._sum = s
+      self._sumPos = min(end, csumPos)
+
+      if csumPos >= end:
+        # not big enough yet
+        break
+
+      if (s & 0xff) != buf[csumPos]:
+        # corrupt (or a false header), try from the next byte
+        self.badFrames += 1
+        log(1, 'bad checksum; resyncing')
+        self._restartAt(pos + 1)
+        continue
+
+      frame = str(buf[pos:csumPos+1])
+      self._restartAt(csumPos + 1)
+
+      self._onFrame(frame)
+
+    # drop consumed bytes (keeping any partial frame)
+    if self._pos > 0:
+      del buf[:self._pos]
+      self._sumPos -= self._pos
+      self._pos = 0
+
+def handleFrame(message):
+  log(2, 'recv_samsung [%s]' % message.encode('hex'))
+
+  if isForOtherDisplay(message):
+    return
+
+  queue.handle(message)
+
+decoder = FrameDecoder(handleFrame)
+
+def received(data):
+  lastReceive[0] = system_clock()
+  log(3, 'tcp_recv [%s]' % data.encode('hex'))
+
+  decoder.feed(data)
   
 def sent(data):
   log(3, 'tcp_sent [%s]' % data.encode('hex'))
@@ -187,6 +257,7 @@ def disconnected():
   local_event_TCPStatus.emitIfDifferent('Disconnected')
   tcp.drop()
   tcp.clearQueue()
+  decoder.reset()
   
 def tcptimeout():
   console.warn('TCP timeout')
@@ -201,7 +272,8 @@ tcp = TCP(connected=connected, received=received, sent=sent, disconnected=discon
 def protocolTimeout():
   console.log('protocol timeout; flushing buffer')
   queue.clearQueue()
-  del recvBuffer[:]
+  decoder.reset()
+  _inFlightSetID[0] = None
   
 
 queue = request_queue(timeout=protocolTimeout)
@@ -243,7 +315,7 @@ def forcePower(arg):
   state = True if arg != 'Off' else False
   msg = '\x11%s\x01%s' % (chr(int(param_id)), '\x01' if state else '\x00')
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda arg: checkHeader(arg))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda arg: checkHeader(arg))
   
 forcePowerAction = Action('ForcePower', lambda arg: forcePower(arg), {'title': 'Force', 'group': 'Power', 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
 
@@ -330,7 +402,7 @@ def forceInputCode(arg):
   
   msg = '\x14%s\x01%s' % (chr(int(param_id)), arg.decode('hex'))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: inputCodeEvent.emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: inputCodeEvent.emit(arg)))
 
 forceInputCodeAction = Action('Force Input Code', forceInputCode, {'title': 'Force', 'group': 'Input code', 'order': next_seq(), 'schema': {'type': 'string'}})
 
@@ -417,7 +489,7 @@ def getDisplayStatus():
     quickPowerCheck()
     quickInputCodeCheck()
   
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), handleResp)
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), handleResp)
   
 getDisplayStatusAction = Action('GetDisplayStatus', lambda arg: getDisplayStatus(), {'group': 'General', 'order': next_seq()})
 
@@ -456,7 +528,7 @@ def getExtendedDisplayStatus():
     local_event_CurrentTemp.emit(ord(arg[10]))
     emitAndLogIfDifferent("fan", local_event_ErrorStatusFan, arg[11] == '\x01')
   
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), handleResp)
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), handleResp)
 
 def emitAndLogIfDifferent(name, signal, state):
   prev = signal.getArg()
@@ -468,13 +540,342 @@ getExtendedDisplayStatusAction = Action('GetExtendedDisplayStatus', lambda arg:
 
 # extended status ---!>
 
+# <!-- status scheduler
+
+# The status polls of every display on the connection (this one and any daisy-chained ones) share
+# one scheduler that issues at most one poll per tick, so traffic is interleaved instead of bursting.
+
+SCHEDULER_TICK = 0.5 # seconds
+
+class PollJob:
+  def __init__(self, interval, fn, due):
+    self.interval = interval # (millis)
+    self.fn = fn
+    self.due = due
+
+class StatusScheduler:
+  '''Round-robins periodic status polls, one per tick, most overdue first'''
+
+  def __init__(self):
+    self._jobs = list()
+    self._timer = Timer(self._tick, SCHEDULER_TICK, SCHEDULER_TICK, stopped=True)
+    self.polls = 0
+
+  def add(self, interval, fn, firstDelay=0):
+    job = PollJob(interval * 1000, fn, system_clock() + firstDelay * 1000)
+    self._jobs.append(job)
+    return job
+
+  def soon(self, job, delay=1.0):
+    job.due = min(job.due, system_clock() + int(delay * 1000))
+
+  def allSoon(self, delay=1.0):
+    # (the tick spreads them out)
+    for job in self._jobs:
+      self.soon(job, delay)
+
+  def start(self):
+    self._timer.start()
+
+  def stop(self):
+    self._timer.stop()
+
+  def _tick(self):
+    now = system_clock()
+
+    overdue = None
+    for job in self._jobs:
+      if job.due <= now and (overdue == None or job.due < overdue.due):
+        overdue = job
+
+    if overdue == None:
+      return
+
+    overdue.due = now + overdue.interval
+    self.polls += 1
+
+    overdue.fn()
+
+statusScheduler = StatusScheduler()
+
+# poll input and power status every 30s
+displayStatusJob = statusScheduler.add(30, lambda: getDisplayStatusAction.call())
+
+# check error status every 45 seconds (first after 15)
+errorStatusJob = statusScheduler.add(45, lambda: getExtendedDisplayStatusAction.call(), 15)
+
+# status scheduler -->
+
+# <!-- daisy-chain fan-out
+
+# Displays daisy-chained (RS-232 loop-through) behind this one are driven over the same connection using
+# their own Set IDs, e.g. a video wall. Group commands can use the broadcast ID which all displays obey
+# without acknowledging, so the whole chain switches in one frame; polls then confirm and individually
+# re-send to any display that didn't follow.
+
+BROADCAST_SETID = 0xfe
+
+CHAIN_ENFORCEMENT_TIME = 75 # seconds, same as this display's power and input code enforcement
+CHAIN_CONFIRM_DELAY = 3 # seconds after a command
+
+param_chain = Parameter({'title': 'Daisy-chained displays', 'order': next_seq(), 'desc': 'Displays behind this one, e.g. a video wall', 'schema': {'type': 'object', 'properties': {
+        'useBroadcast': {'title': 'Use broadcast ID for group commands?', 'type': 'boolean', 'order': 1},
+        'displays': {'title': 'Displays', 'type': 'array', 'order': 2, 'items': {'type': 'object', 'properties': {
+          'name': {'type': 'string', 'order': 1},
+          'setID': {'title': 'Set ID', 'type': 'integer', 'order': 2}}}}
+      }}})
+
+local_event_ChainStats = LocalEvent({'group': 'Debug', 'order': 10000+next_seq(), 'desc': 'Group command settle time and poll traffic (every minute)', 'schema': {'type': 'object', 'properties': {
+        'lastSettleTime': {'type': 'integer', 'title': 'Last group command settle time (ms)', 'order': 1},
+        'pollsPerMin': {'type': 'integer', 'title': 'Polls per min.', 'order': 2},
+        'strayAcks': {'type': 'integer', 'title': 'Demultiplexed stray acks', 'order': 3}}}})
+
+_chain = list()
+_chainBySetID = {}
+
+_inFlightSetID = [None] # the Set ID of the request currently awaiting its response
+
+_chainStats = { 'groupRequested': None, 'lastSettleTime': None, 'strayAcks': 0 }
+
+def mdcFrame(cmd, setID, data=''):
+  msg = '%s%s%s%s' % (cmd, chr(setID), chr(len(data)), data)
+  checksum = sum([ord(c) for c in msg]) & 0xff
+  return '\xaa%s%s' % (msg, chr(checksum))
+
+def mdcRequest(setID, frame, handler):
+  def send():
+    _inFlightSetID[0] = setID
+    tcp.send(frame)
+
+  queue.request(send, handler)
+
+def isForOtherDisplay(message):
+  # acks carry the Set ID of the display that sent them so a late one (e.g. after a protocol timeout)
+  # must not be taken as the response to whatever request is now at the head of the queue
+  inFlight = _inFlightSetID[0]
+  msgID = ord(message[2])
+
+  if inFlight == None or msgID == inFlight:
+    return False
+
+  member = _chainBySetID.get(msgID)
+  if member != None:
+    _chainStats['strayAcks'] += 1
+    member.handleAck(message)
+
+  else:
+    log(1, 'ignoring ack from unexpected set ID %s' % msgID)
+
+  return True
+
+class ChainMember:
+  def __init__(self, name, setID):
+    self.name = name
+    self.setID = setID
+
+    self.desiredPower = None
+    self.desiredInputCode = None
+    self.desiredAt = 0
+
+    group = 'Display "%s"' % name
+
+    self.rawPowerSignal = create_local_event('%s Raw Power' % name, {'title': 'Raw Power', 'group': group, 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
+    self.inputCodeSignal = create_local_event('%s Input Code' % name, {'title': 'Input Code', 'group': group, 'order': next_seq(), 'schema': {'type': 'string'}})
+    self.errorsSignal = create_local_event('%s Error Statuses' % name, {'title': 'Error Statuses', 'group': group, 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+                                             'lamp': {'type': 'boolean', 'order': 1},
+                                             'temp': {'type': 'boolean', 'order': 2},
+                                             'brightSensor': {'type': 'boolean', 'order': 3},
+                                             'noSync': {'type': 'boolean', 'order': 4},
+                                             'fan': {'type': 'boolean', 'order': 5}}}})
+
+    powerAction = create_local_action('%s Power' % name, self.setPower, {'title': 'Power', 'group': group, 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
+    create_local_action('%s Power On' % name, lambda ignore: powerAction.call('On'), {'title': 'On', 'group': group, 'order': next_seq()})
+    create_local_action('%s Power Off' % name, lambda ignore: powerAction.call('Off'), {'title': 'Off', 'group': group, 'order': next_seq()})
+    create_local_action('%s Input Code' % name, self.setInputCode, {'title': 'Input Code', 'group': group, 'order': next_seq(), 'schema': {'type': 'string'}})
+
+    # (first polls staggered by the scheduler)
+    self.statusJob = statusScheduler.add(30, self.pollStatus)
+    self.errorStatusJob = statusScheduler.add(45, self.pollErrorStatus, 15)
+
+  def pollStatus(self):
+    mdcRequest(self.setID, mdcFrame('\x00', self.setID), self.handleAck)
+
+  def pollErrorStatus(self):
+    mdcRequest(self.setID, mdcFrame('\x0d', self.setID), self.handleAck)
+
+  def handleAck(self, resp):
+    if resp[4] != 'A':
+      # (may be expected, e.g. while powered off)
+      log(2, '%s: negative acknowledgement' % self.name)
+      return
+
+    handler = CHAIN_ACK_HANDLERS.get(resp[5])
+    if handler != None:
+      handler(self, resp)
+
+  def onStatus(self, resp):
+    # same layout as 'getDisplayStatus'
+    self.rawPowerSignal.emit('On' if ord(resp[6]) == 1 else 'Off')
+    self.inputCodeSignal.emit(resp[9].encode('hex'))
+    self.enforce()
+
+  def onErrorStatus(self, resp):
+    # same layout as 'getExtendedDisplayStatus'
+    self.errorsSignal.emit({'lamp': resp[6] == '\x01', 'temp': resp[7] == '\x01', 'brightSensor': resp[8] == '\x01',
+                            'noSync': resp[9] == '\x01', 'fan': resp[11] == '\x01'})
+
+  def onPower(self, resp):
+    self.rawPowerSignal.emit('On' if resp[6] == '\x01' else 'Off')
+
+  def onInputCode(self, resp):
+    self.inputCodeSignal.emit(resp[6].encode('hex'))
+
+  def setPower(self, arg):
+    console.info('%s: Power(%s) called' % (self.name, arg))
+    self.desiredPower = arg
+    self.desiredAt = system_clock()
+    self.forcePower()
+
+  def setInputCode(self, arg):
+    console.info('%s: InputCode(%s) called' % (self.name, arg))
+    self.desiredInputCode = arg
+    self.desiredAt = system_clock()
+    self.enforce()
+
+  def forcePower(self):
+    mdcRequest(self.setID, mdcFrame('\x11', self.setID, '\x01' if self.desiredPower != 'Off' else '\x00'), self.handleAck)
+    statusScheduler.soon(self.statusJob, CHAIN_CONFIRM_DELAY)
+
+  def forceInputCode(self):
+    mdcRequest(self.setID, mdcFrame('\x14', self.setID, self.desiredInputCode.decode('hex')), self.handleAck)
+    statusScheduler.soon(self.statusJob, CHAIN_CONFIRM_DELAY)
+
+  def enforce(self):
+    if self.desiredPower == None and self.desiredInputCode == None:
+      return
+
+    if system_clock() - self.desiredAt > CHAIN_ENFORCEMENT_TIME * 1000:
+      self.desiredPower = self.desiredInputCode = None
+      return
+
+    power = self.rawPowerSignal.getArg()
+
+    if self.desiredPower != None and power != self.desiredPower:
+      console.info('%s: power (still) does not match desired, setting to "%s"' % (self.name, self.desiredPower))
+      self.forcePower()
+
+    elif self.desiredInputCode != None and self.desiredPower != 'Off' and self.inputCodeSignal.getArg() != self.desiredInputCode:
+      if power != 'On':
+        # (will be re-evaluated when the power is confirmed)
+        self.desiredPower = 'On'
+        self.forcePower()
+
+      else:
+        console.info('%s: input code (still) does not match desired, setting to "%s"' % (self.name, self.desiredInputCode))
+        self.forceInputCode()
+
+    else:
+      self.desiredPower = self.desiredInputCode = None
+      checkGroupSettled()
+
+# acknowledgement handlers by (R->Cmd) command byte
+CHAIN_ACK_HANDLERS = { '\x00': ChainMember.onStatus,
+                       '\x0d': ChainMember.onErrorStatus,
+                       '\x11': ChainMember.onPower,
+                       '\x14': ChainMember.onInputCode }
+
+def checkGroupSettled():
+  requested = _chainStats['groupRequested']
+  if requested == None:
+    return
+
+  for member in _chain:
+    if member.desiredPower != None or member.desiredInputCode != None:
+      return
+
+  _chainStats['lastSettleTime'] = system_clock() - requested
+  _chainStats['groupRequested'] = None
+
+def broadcastOrFanOut(cmd, data, memberFn):
+  _chainStats['groupRequested'] = system_clock()
+
+  if (param_chain or {}).get('useBroadcast'):
+    # no acknowledgements are returned for the broadcast ID so bypass the request queue
+    tcp.send(mdcFrame(cmd, BROADCAST_SETID, data))
+
+    for member in _chain:
+      statusScheduler.soon(member.statusJob, CHAIN_CONFIRM_DELAY)
+
+    statusScheduler.soon(displayStatusJob, CHAIN_CONFIRM_DELAY)
+
+  else:
+    for member in _chain:
+      memberFn(member)
+
+@local_action({'title': 'Power (all)', 'group': 'Daisy-chain', 'order': next_seq(), 'desc': 'This display and all daisy-chained ones', 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
+def AllPower(arg):
+  console.info('AllPower(%s) called' % arg)
+
+  now = system_clock()
+  for member in _chain:
+    member.desiredPower = arg
+    member.desiredAt = now
+
+  broadcastOrFanOut('\x11', '\x01' if arg != 'Off' else '\x00', lambda member: member.forcePower())
+
+  # (this display has its own enforcement)
+  powerAction.call(arg)
+
+@local_action({'title': 'Input Code (all)', 'group': 'Daisy-chain', 'order': next_seq(), 'desc': 'This display and all daisy-chained ones', 'schema': {'type': 'string'}})
+def AllInputCode(arg):
+  console.info('AllInputCode(%s) called' % arg)
+
+  now = system_clock()
+  for member in _chain:
+    member.desiredInputCode = arg
+    member.desiredAt = now
+
+  broadcastOrFanOut('\x14', arg.decode('hex'), lambda member: member.enforce())
+
+  setInputCodeAction.call(arg)
+
+def initChain():
+  for info in (param_chain or {}).get('displays') or []:
+    name = (info.get('name') or '').strip()
+    setID = info.get('setID')
+
+    if len(name) == 0 or setID == None:
+      console.warn('Daisy-chained display is missing a name or Set ID; ignoring')
+      continue
+
+    if setID == int(param_id) or setID in _chainBySetID or setID == BROADCAST_SETID:
+      console.warn('Daisy-chained display "%s" has a duplicate or reserved Set ID (%s); ignoring' % (name, setID))
+      continue
+
+    member = ChainMember(name, setID)
+    _chain.append(member)
+    _chainBySetID[setID] = member
+
+  if len(_chain) > 0:
+    console.info('Driving %s daisy-chained display(s) over the same connection' % len(_chain))
+
+def emitChainStats():
+  local_event_ChainStats.emit({'lastSettleTime': _chainStats['lastSettleTime'], 'pollsPerMin': statusScheduler.polls, 'strayAcks': _chainStats['strayAcks']})
+
+  statusScheduler.polls = 0
+  _chainStats['strayAcks'] = 0
+
+timer_chainStats = Timer(emitChainStats, 60, 60)
+
+# daisy-chain fan-out -->
+
   
 def local_action_ClearMenu(arg=None):
   """{"group": "General", "desc": "Clears the OSD menu"}"""
   console.info('clearMenu()')
   msg = '\x34%s\x01\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda arg: checkHeader(arg))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda arg: checkHeader(arg))
   
   
 def getIRRemoteControl(arg):
@@ -484,7 +885,7 @@ def getIRRemoteControl(arg):
   
   msg = '\x36%s\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: irRemoteControlEvent.emit('Enabled' if resp[6] == '\x01' else 'Disabled')))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: irRemoteControlEvent.emit('Enabled' if resp[6] == '\x01' else 'Disabled')))
   
 Action('Get IR Remote Control', getIRRemoteControl, {'title': 'Get', 'group': 'IR Remote Control'})
   
@@ -498,7 +899,7 @@ def setIRRemoteControl(arg):
   
   msg = '\x36%s\x01%s' % (chr(int(param_id)), '\x01' if state else '\x00')
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: irRemoteControlEvent.emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: irRemoteControlEvent.emit(arg)))
 
 irRemoteControlEvent = Event('IR Remote Control', {'group': 'IR Remote Control', 'schema': {'type': 'string', 'enum': ['Enabled', 'Disabled']}})
 Action('IR Remote Control', setIRRemoteControl, {'title': 'Set', 'group': 'IR Remote Control', 'caution': 'Are you sure you want to enable/disable IR remote control?', 'schema': {'type': 'string', 'enum': ['Enabled', 'Disabled']}})
@@ -511,7 +912,7 @@ def getStandbyControl(arg):
 
   msg = '\x4a%s\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: StandbyControlEvent.emit('On' if resp[6] == '\x01' else ('Off' if resp[6] == '\x00' else 'Auto'))))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: StandbyControlEvent.emit('On' if resp[6] == '\x01' else ('Off' if resp[6] == '\x00' else 'Auto'))))
   
 Action('Get Standby Control', getStandbyControl, {'title': 'Get', 'group': 'Standby Control'})
   
@@ -527,7 +928,7 @@ def setStandbyControl(arg):
 
   msg = '\x4a%s\x01%s' % (chr(int(param_id)), value)
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: StandbyControlEvent.emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: StandbyControlEvent.emit(arg)))
 
 StandbyControlEvent = Event('Standby Control', {'group': 'Standby Control', 'schema': {'type': 'string', 'enum': ['On', 'Off', 'Auto']}})
 Action('Standby Control', setStandbyControl, {'title': 'Set', 'group': 'Standby Control', 'schema': {'type': 'string', 'enum': ['On', 'Off', 'Auto']}})
@@ -555,7 +956,7 @@ def getEcoSolution(arg):
   
   # e.g. response: aa-ff-02-04-41-c6-81- *01* -8e
   
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: EcoSolutionEvent.emit(ECO_LOOKUP_REV[resp[7]])))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: EcoSolutionEvent.emit(ECO_LOOKUP_REV[resp[7]])))
   
 Action('Get EcoSolution', getEcoSolution, {'title': 'Get', 'group': 'EcoSolution'})
 
@@ -571,7 +972,7 @@ def setEcoSolution(arg):
 
   msg = '\xc6%s\x02\x81%s' % (chr(int(param_id)), value)
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: EcoSolutionEvent.emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: EcoSolutionEvent.emit(arg)))
 
 EcoSolutionEvent = Event('EcoSolution', {'group': 'EcoSolution', 'schema': {'type': 'string'}})
 Action('EcoSolution', setEcoSolution, {'title': 'Set', 'group': 'EcoSolution', 'schema': {'type': 'string', 'enum': ['Off', '4 Hour', '6 Hour', '8 Hour']}})
@@ -585,7 +986,7 @@ def getNetworkStandbyControl(arg):
 
   msg = '\xb5%s\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: NetworkStandbyControlEvent.emit('On' if resp[6] == '\x01' else ('Off' if resp[6] == '\x00' else 'Unknown'))))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: NetworkStandbyControlEvent.emit('On' if resp[6] == '\x01' else ('Off' if resp[6] == '\x00' else 'Unknown'))))
   
 Action('Get Network Standby Control', getNetworkStandbyControl, {'title': 'Get', 'group': 'Network Standby Control'})
   
@@ -600,7 +1001,7 @@ def setNetworkStandbyControl(arg):
 
   msg = '\xb5%s\x01%s' % (chr(int(param_id)), value)
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: NetworkStandbyControlEvent.emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: NetworkStandbyControlEvent.emit(arg)))
 
 NetworkStandbyControlEvent = Event('Network Standby Control', {'group': 'Network Standby Control', 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
 Action('Network Standby Control', setNetworkStandbyControl, {'title': 'Set', 'group': 'Network Standby Control', 'schema': {'type': 'string', 'enum': ['On', 'Off']}})
@@ -615,7 +1016,7 @@ def getSerialNumber(arg):
   
   msg = '\x0b%s\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: serialNumberEvent.emit(resp[6:-4])))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: serialNumberEvent.emit(resp[6:-4])))
   
 Action('GetSerialNumber', getSerialNumber, {'title': 'Get', 'group': 'Serial Number'})
 
@@ -626,7 +1027,7 @@ def getSoftwareVersion(arg):
   
   msg = '\x0e%s\x00' % chr(int(param_id))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: softwareVersionEvent.emit(resp[6:-1])))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: softwareVersionEvent.emit(resp[6:-1])))
   
 Action('GetSoftwareVersion', getSoftwareVersion, {'title': 'Get', 'group': 'Software Version'})
 
@@ -635,7 +1036,7 @@ def setVolume(arg):
   
   msg = '\x12%s\x01%s' % (chr(int(param_id)), chr(int(arg)))
   checksum = sum([ord(c) for c in msg]) & 0xff
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: lookup_local_event('volume').emit(arg)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: lookup_local_event('volume').emit(arg)))
 
 Action('Volume', setVolume, {'title': 'Volume', 'group': 'Audio', 'schema': {'type': 'integer', 'max': 100, 'min': 0}})
 
@@ -658,7 +1059,7 @@ def Mute(arg):
     local_event_MuteOn.emit(state)
     local_event_MuteOff.emit(not state)
 
-  queue.request(lambda: tcp.send('\xaa%s%s' % (msg, chr(checksum))), lambda resp: checkHeader(resp, lambda: handler(resp)))
+  mdcRequest(int(param_id), '\xaa%s%s' % (msg, chr(checksum)), lambda resp: checkHeader(resp, lambda: handler(resp)))
 
 @local_action({ 'group': 'Audio', 'title': 'On', 'order': next_seq() })
 def MuteOn(arg):
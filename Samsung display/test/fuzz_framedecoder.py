@@ -0,0 +1,98 @@
+'''Fuzzes and times the recipe's FrameDecoder outside of Nodel (plain Python 2.7).
+
+   python2 fuzz_framedecoder.py [streams]
+
+Valid MDC acknowledgements are fed as concatenated, randomly fragmented streams, with and without junk
+(including stray 0xAA bytes) injected between frames. Every valid frame must come out, in order.'''
+
+import os
+import random
+import sys
+import time
+
+# <!-- pull FrameDecoder (and its constants) out of the recipe
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script.py')
+
+def loadDecoder():
+  src = open(SCRIPT).read()
+
+  start = src.index('MDC_HEADER = ')
+  end = src.index('\n', src.index('self._onFrame(frame)'))
+
+  scope = { 'log': lambda level, msg: None }
+  exec src[start:end] in scope
+
+  return scope['FrameDecoder']
+
+# -->
+
+FrameDecoder = loadDecoder()
+
+def newFrame(rnd):
+  # aa ff <id> <length> <A|N> <r-cmd> <data...> <checksum>
+  body = [ 0xff, rnd.randint(0, 0xfe), 0, ord(rnd.choice('AAAN')), rnd.randint(0, 0xff) ]
+  body += [ rnd.randint(0, 0xff) for i in range(rnd.randint(0, 20)) ]
+  body[2] = len(body) - 3
+
+  return bytearray([ 0xaa ] + body + [ sum(body) & 0xff ])
+
+def newJunk(rnd):
+  junk = bytearray([ rnd.randint(0, 0xff) for i in range(rnd.randint(1, 12)) ])
+
+  # stray headers are the interesting part
+  for i in range(rnd.randint(0, 3)):
+    junk[rnd.randint(0, len(junk)-1)] = 0xaa
+
+  return junk
+
+def runStream(rnd, frameCount, withJunk):
+  frames = [ newFrame(rnd) for i in range(frameCount) ]
+
+  stream = bytearray()
+  for frame in frames:
+    if withJunk and rnd.random() < 0.5:
+      stream += newJunk(rnd)
+    stream += frame
+
+  received = list()
+  decoder = FrameDecoder(received.append)
+
+  pos = 0
+  while pos < len(stream):
+    size = rnd.randint(1, 40)
+    decoder.feed(str(stream[pos:pos+size]))
+    pos += size
+
+  # (junk can very occasionally contain a valid-looking frame of its own, so only look for the real ones in order)
+  expected = [ str(frame) for frame in frames ]
+  i = 0
+  for frame in received:
+    if i < len(expected) and frame == expected[i]:
+      i += 1
+
+  return i == len(expected), len(stream)
+
+def main():
+  streams = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+  rnd = random.Random(1)
+
+  for withJunk in [ False, True ]:
+    failures = 0
+    totalBytes = 0
+
+    started = time.time()
+
+    for i in range(streams):
+      ok, size = runStream(rnd, 50, withJunk)
+      totalBytes += size
+      if not ok:
+        failures += 1
+
+    elapsed = time.time() - started
+
+    print '%s: %s/%s streams lost frames (%.0f kB/s)' % ('with junk' if withJunk else 'clean', failures, streams, totalBytes / 1024.0 / elapsed)
+
+if __name__ == '__main__':
+  main()
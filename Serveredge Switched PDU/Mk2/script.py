@@ -6,8 +6,9 @@ Useful resources:
 * **PDUMIB-201010105.mib** file contains the MIB file for the Serveredge PDUs (not needed for operation, for documentation only)
 * sourceforge.net/projects/jmibbrowser project is a decent little MIB browser
 
-_rev 2b_
+_rev 3_
 
+* polled OIDs are grouped into multi-varbind GETs that share round trips; GETBULK for outlet configs when using SNMP v2c
 * port labelling exposed
 * less console noise
 * optional IP addressing using remote binding
@@ -56,6 +57,12 @@ param_port = Parameter({'schema': {'type': 'integer', 'hint': '%s (default)' % D
 DEFAULT_COMMUNITY = 'public'
 param_community = Parameter({'schema': {'type': 'string', 'hint': '%s (default)' % DEFAULT_COMMUNITY}})
 
+param_snmpVersion = Parameter({'title': 'SNMP version', 'schema': {'type': 'string', 'enum': ['1', '2c'], 'hint': '1 (default)'},
+                               'desc': 'v2c allows GETBULK to be used for the outlet configs'})
+
+DEFAULT_MAX_MESSAGE_SIZE = 484 # bytes, the size every agent must accept
+param_maxMessageSize = Parameter({'title': 'Max. message size', 'schema': {'type': 'integer', 'hint': '%s (default)' % DEFAULT_MAX_MESSAGE_SIZE}})
+
 param_powerOffGuarding = Parameter({ 'title': '"Power Off" Guarding', 'order': next_seq(),
                                      'schema': { 'type': 'array', 'items': { 'type': 'object', 'properties': {
                                        'port': { 'tite': 'PDU port', 'type': 'integer', 'order': 1, 'desc': 'Prevents Power Off until nodes/devices are gracefully shutdown. Bindings need to be filled in after connection to device.' },
@@ -85,8 +92,14 @@ def main():
   _target.setAddress(UdpAddress('%s/%s' % (ipAddress, param_port or DEFAULT_PORT)))
   _target.setCommunity(OctetString(param_community or DEFAULT_COMMUNITY))
   
-  # kick-off timer to poll the outlet status
-  Timer(lambda: snmpLookupOID.call({ 'oid': OUTLETSTATUS_OID, 'signal': 'rawOutletStatus' }), 30, 2)
+  if param_snmpVersion == '2c':
+    _target.setVersion(SnmpConstants.version2c)
+    
+  maxMessageSize[0] = param_maxMessageSize or DEFAULT_MAX_MESSAGE_SIZE
+  _target.setMaxSizeRequestPDU(maxMessageSize[0])
+  
+  # poll the outlet status (e.g. "1,1,-1,-1,-1,-1,-1,-1")
+  planner.add(OUTLETSTATUS_OID, 'RawOutletStatus', 30, valueSize=32)
 
   # have IP address so can start timers
   for t in _timers:
@@ -115,16 +128,77 @@ def main():
 # >    ::= { pdu01Entry 13 }
 OUTLETSTATUS_OID = '1.3.6.1.4.1.17420.1.2.9.1.13.0'
 
+# e.g. "pdu01Outlet2Config" is '...14.2.0', "COMPUTER,0,0,0,0"
+OUTLETCONFIGS_OID = '1.3.6.1.4.1.17420.1.2.9.1.14'
+OUTLETCONFIG_SIZE = 64
+
+def outletConfigOID(portNum):
+  return '%s.%s.0' % (OUTLETCONFIGS_OID, portNum)
+
 # e.g. "1,1,-1,-1,-1,-1,-1,-1"
 local_event_RawOutletStatus = LocalEvent({'title': 'Outlet Status', 'group': 'Raw Feedback', 'order': next_seq(), 'schema': {'type': 'string'}})
 
 def handleOutletStatusResult(result):
   # split the result
-  for index, portStatus in enumerate(result.split(',')):
-    if portStatus in ['-2', '0', '1']:
-      tryInitPort(index+1, portStatus)
+  statuses = [ (index+1, portStatus) for index, portStatus in enumerate(result.split(',')) if portStatus in ['-2', '0', '1'] ]
+  
+  # retrieve the configs of any new ports all at once
+  newPorts = [ portNum for (portNum, portStatus) in statuses if lookup_local_event('Port %s Raw Power' % portNum) == None ]
+  configs = getOutletConfigs(newPorts) if len(newPorts) > 0 else {}
+  
+  for (portNum, portStatus) in statuses:
+    tryInitPort(portNum, portStatus, configs.get(portNum))
       
   prepareForGuarding()
+  
+def getOutletConfigs(portNums):
+  '''Returns configs by port number, walking with GETBULK (v2c) or using multi-varbind GETs (v1)'''
+  if param_snmpVersion == '2c':
+    return walkOutletConfigs(max(portNums))
+  
+  results = getMany([ (outletConfigOID(portNum), VARBIND_OVERHEAD + len(outletConfigOID(portNum)) + OUTLETCONFIG_SIZE) for portNum in portNums ])
+  
+  return dict([ (portNum, results.get(outletConfigOID(portNum))) for portNum in portNums ])
+
+def walkOutletConfigs(count):
+  configs = {}
+  
+  base = OID(OUTLETCONFIGS_OID)
+  nextOID = base
+  
+  # as many repetitions as will fit in a message
+  perPDU = max(1, (maxMessageSize[0] - PDU_OVERHEAD) / (VARBIND_OVERHEAD + len(outletConfigOID(count)) + OUTLETCONFIG_SIZE))
+  
+  while len(configs) < count:
+    pdu = PDU()
+    pdu.add(VariableBinding(nextOID))
+    pdu.setType(PDU.GETBULK)
+    pdu.setNonRepeaters(0)
+    pdu.setMaxRepetitions(min(perPDU, count - len(configs)))
+    
+    respPDU = sendPDU(pdu)
+    if respPDU == None:
+      break
+    
+    if respPDU.getErrorStatus() != PDU.noError:
+      console.warn('an error occurred walking outlet configs - status:%s, text:[%s]' % (respPDU.getErrorStatus(), respPDU.getErrorStatusText()))
+      break
+      
+    vbs = respPDU.getVariableBindings()
+    if len(vbs) == 0:
+      break
+    
+    for vb in vbs:
+      oid = vb.getOid()
+      
+      # stop at the end of the subtree
+      if not oid.startsWith(base) or vb.getVariable().isException():
+        return configs
+      
+      configs[oid.get(base.size())] = str(vb.getVariable())
+      nextOID = oid
+      
+  return configs
 
 def portStatusToName(portStatus):
   if portStatus == '0':
@@ -139,7 +213,7 @@ def portStatusToName(portStatus):
   else:
     return 'Not Present'
     
-def tryInitPort(portNum, portStatus):
+def tryInitPort(portNum, portStatus, configStr):
   # check if signal has already been defined
   rawPortSignal = lookup_local_event('Port %s Raw Power' % portNum)
   
@@ -153,18 +227,17 @@ def tryInitPort(portNum, portStatus):
   rawConfigSignal = create_local_event(rawConfigSignalName, {'group': 'Raw Feedback', 'order': next_seq(), 'schema': {'type': 'string'}})
   labelSignal = create_local_event('Port %s Label' % portNum, {'group': 'Labels', 'order': next_seq(), 'schema': {'type': 'string'}})
   
-  def getPortConfig():
-    return doSnmpLookupOID('1.3.6.1.4.1.17420.1.2.9.1.14.%s.0' % portNum, rawConfigSignalName)
-    
-  Timer(getPortConfig, 5*60, 2)
-  
   rawConfigSignal.addEmitHandler(lambda arg: labelSignal.emit(arg.split(',')[0]))
   
-  # retrieve labelling now
-  configStr = getPortConfig()    
+  # (config was retrieved along with other new ports')
+  if configStr != None:
+    rawConfigSignal.emit(configStr)
+  
+  # keep it fresh from now on
+  planner.add(outletConfigOID(portNum), rawConfigSignalName, 5*60, valueSize=OUTLETCONFIG_SIZE, delay=5*60)
   
   # initialising signals...
-  label = configStr.split(',')[0]
+  label = (configStr or '').split(',')[0]
   rawSignal     = create_local_event('Port %s Raw Power' % portNum,     {'group': 'Raw Feedback', 'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off', 'Lost']}})
   powerSignal   = create_local_event('Port %s Power' % portNum,         {'group': 'Power%s' % (' ("%s")' % label if label else ''),        'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off', 'Partially On', 'Partially Off']}})
   desiredSignal = create_local_event('Port %s Desired Power' % portNum, {'group': 'Power%s' % (' ("%s")' % label if label else ''),        'order': next_seq(), 'schema': {'type': 'string', 'enum': ['On', 'Off', 'Force Off']}})
@@ -254,6 +327,197 @@ timer_syncer = Timer(sync_outlet_states, 20, stopped=True) # every 20 seconds bu
   
 # power --!>
 
+# <!-- poll planner
+
+# All polled OIDs go through one planner which groups those that are due (or nearly due) into as few
+# multi-varbind GETs as the agent's message size allows, so different intervals share round trips.
+
+PDU_OVERHEAD = 48      # bytes, approx. message header, community and PDU fields
+VARBIND_OVERHEAD = 8   # bytes, approx. sequence, type and length octets of a varbind
+MIN_MESSAGE_SIZE = 256 # bytes, the smallest size the planner will learn down to
+POLL_TICK = 1.0        # seconds
+EARLY_FRACTION = 0.25  # an OID can be polled up to this fraction of its interval early to share a request
+
+# (learned downwards if the agent reports 'tooBig')
+maxMessageSize = [ DEFAULT_MAX_MESSAGE_SIZE ]
+
+# OIDs the agent has reported as not available
+unavailableOIDs = set()
+
+local_event_PollStats = LocalEvent({'title': 'Poll stats', 'group': 'SNMP', 'order': next_seq(), 'schema': {'type': 'object', 'properties': {
+        'pdus': {'type': 'integer', 'title': 'PDUs (last min)', 'order': 1},
+        'varbinds': {'type': 'integer', 'title': 'Varbinds (last min)', 'order': 2},
+        'latency': {'type': 'integer', 'title': 'Avg. latency (ms)', 'order': 3},
+        'maxMessageSize': {'type': 'integer', 'title': 'Max. message size', 'order': 4}}}})
+
+_stats = { 'pdus': 0, 'varbinds': 0, 'latency': 0 }
+
+def emitPollStats():
+  pdus = _stats['pdus']
+  local_event_PollStats.emit({ 'pdus': pdus, 'varbinds': _stats['varbinds'],
+                               'latency': _stats['latency'] / pdus if pdus > 0 else 0,
+                               'maxMessageSize': maxMessageSize[0] })
+  
+  _stats['pdus'] = _stats['varbinds'] = _stats['latency'] = 0
+  
+_timers.append(Timer(emitPollStats, 60, 60, stopped=True))
+
+def sendPDU(pdu):
+  '''Sends a (non-SET) PDU, returns the response PDU or None on timeout'''
+  started = system_clock()
+  
+  respEvent = NodelSnmp.shared().get(pdu, _target)
+  
+  _stats['pdus'] += 1
+  _stats['varbinds'] += pdu.size()
+  _stats['latency'] += system_clock() - started
+  
+  if respEvent == None:
+    console.warn('timeout')
+    return
+  
+  respPDU = respEvent.getResponse()
+  
+  if respPDU == None:
+    warn(1, 'response was empty')
+    return
+  
+  lastReceive[0] = system_clock()
+  
+  return respPDU
+
+def packVarbinds(sizedOIDs):
+  '''Splits (oid, size) pairs into batches that fit within the max. message size'''
+  batches = list()
+  batch = list()
+  batchSize = PDU_OVERHEAD
+  
+  for (oid, size) in sizedOIDs:
+    if len(batch) > 0 and batchSize + size > maxMessageSize[0]:
+      batches.append(batch)
+      batch = list()
+      batchSize = PDU_OVERHEAD
+      
+    batch.append(oid)
+    batchSize += size
+    
+  if len(batch) > 0:
+    batches.append(batch)
+    
+  return batches
+
+def getMany(sizedOIDs):
+  '''Retrieves (oid, expected size) pairs using as few multi-varbind GETs as possible, returns values by OID'''
+  results = {}
+  
+  for batch in packVarbinds(sizedOIDs):
+    getBatch(batch, results)
+    
+  return results
+
+def getBatch(oids, results):
+  pdu = PDU()
+  for oid in oids:
+    pdu.add(VariableBinding(OID(oid)))
+  pdu.setType(PDU.GET)
+  
+  respPDU = sendPDU(pdu)
+  if respPDU == None:
+    return
+  
+  errStatus = respPDU.getErrorStatus()
+  
+  if errStatus == PDU.tooBig and len(oids) > 1:
+    # the agent's limit is lower than estimated so learn from it and split
+    maxMessageSize[0] = max(MIN_MESSAGE_SIZE, maxMessageSize[0] * 3 / 4)
+    warn(1, 'response too big; max. message size now %s' % maxMessageSize[0])
+    
+    half = len(oids) / 2
+    getBatch(oids[:half], results)
+    getBatch(oids[half:], results)
+    return
+  
+  errIndex = respPDU.getErrorIndex() - 1
+  
+  if errStatus == PDU.noSuchName and len(oids) > 1 and 0 <= errIndex < len(oids):
+    # (SNMPv1 fails the whole request because of one OID) so leave it out from now on and retry the rest
+    console.warn('OID %s is not available; will no longer poll it' % oids[errIndex])
+    unavailableOIDs.add(oids[errIndex])
+    
+    getBatch(oids[:errIndex] + oids[errIndex+1:], results)
+    return
+  
+  if errStatus != PDU.noError:
+    console.warn('an error occurred - status:%s, index:%s, text:[%s]' % (errStatus, errIndex + 1, respPDU.getErrorStatusText()))
+    return
+  
+  # (GET responses are in request order)
+  for (oid, vb) in zip(oids, respPDU.getVariableBindings()):
+    variable = vb.getVariable()
+    
+    if variable.isException(): # e.g. v2c 'noSuchObject'
+      continue
+    
+    results[oid] = str(variable)
+
+class PollItem:
+  def __init__(self, oid, signalName, interval, valueSize):
+    self.oid = oid
+    self.signalName = signalName
+    self.signal = None # (resolved on first result)
+    self.interval = interval
+    
+    # (the OID's dotted string length is a fair upper bound of its encoded length)
+    self.size = VARBIND_OVERHEAD + len(oid) + valueSize
+    
+    self.nextDue = 0
+
+class PollPlanner:
+  '''Polls OIDs at their own intervals, sharing requests between those that are due or nearly due'''
+  
+  def __init__(self):
+    self._items = list()
+    
+  def add(self, oid, signalName, interval, valueSize=32, delay=2):
+    item = PollItem(oid, signalName, interval, valueSize)
+    item.nextDue = system_clock() + delay * 1000
+    
+    self._items.append(item)
+    
+  def poll(self):
+    now = system_clock()
+    
+    if len(unavailableOIDs) > 0:
+      # (no longer polled, otherwise they would stay due forever)
+      self._items = [ item for item in self._items if item.oid not in unavailableOIDs ]
+    
+    if not any([item.nextDue <= now for item in self._items]):
+      return
+    
+    # something is due, so bring forward anything that will be due soon too
+    batch = [ item for item in self._items if item.nextDue - now <= item.interval * 1000 * EARLY_FRACTION ]
+    
+    results = getMany([ (item.oid, item.size) for item in batch ])
+    
+    for item in batch:
+      item.nextDue = now + item.interval * 1000
+      
+      value = results.get(item.oid)
+      if value == None:
+        continue
+        
+      if item.signal == None:
+        item.signal = lookup_local_event(item.signalName)
+        
+      if item.signal != None:
+        item.signal.emit(value)
+
+planner = PollPlanner()
+
+_timers.append(Timer(lambda: planner.poll(), POLL_TICK, 2, stopped=True))
+
+# poll planner -->
+
 # <!-- other values
 
 # Current:
@@ -266,19 +530,19 @@ timer_syncer = Timer(sync_outlet_states, 20, stopped=True) # every 20 seconds bu
 # Type :0
 
 local_event_Current = LocalEvent({'title': 'Current', 'group': 'Monitoring', 'order': next_seq(), 'schema': {'type': 'string'}})
-_timers.append(Timer(lambda: snmpLookupOID.call({'oid': '.1.3.6.1.4.1.17420.1.2.9.1.11.0', 'signal': 'Current'}), 10, 2, stopped=True))
+planner.add('.1.3.6.1.4.1.17420.1.2.9.1.11.0', 'Current', 10, valueSize=16)
 
 
 # Firmware
 
 local_event_Firmware = LocalEvent({'title': 'Firmware', 'group': 'Device Info', 'order': next_seq(), 'schema': {'type': 'string'}})
-_timers.append(Timer(lambda: snmpLookupOID.call({'oid': '.1.3.6.1.4.1.17420.1.2.4.0', 'signal': 'Firmware'}), 5*60, 2, stopped=True))
+planner.add('.1.3.6.1.4.1.17420.1.2.4.0', 'Firmware', 5*60, valueSize=32)
 
 
 # MAC Address
 
 local_event_MACAddress = LocalEvent({'title': 'MAC address', 'group': 'Device Info', 'order': next_seq(), 'schema': {'type': 'string'}})
-_timers.append(Timer(lambda: snmpLookupOID.call({'oid': '.1.3.6.1.4.1.17420.1.2.3.0', 'signal': 'MACAddress'}), 5*60, 2, stopped=True))
+planner.add('.1.3.6.1.4.1.17420.1.2.3.0', 'MACAddress', 5*60, valueSize=32)
 
 
 # etc.
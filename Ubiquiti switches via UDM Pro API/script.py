@@ -9,7 +9,7 @@
 '''
 Ubiquiti Switch Control Module for **Unifi-Controller API**
 
-`rev 6 2025.03.11`
+`rev 7 2026.10.17`
 
 - This is roughly written and provides read-only information for IP address information by port and by MAC.
 - Tracks device network connection status, detecting when devices connect to or disconnect from the network
@@ -20,6 +20,9 @@ Based on the documentation available at [unifi-controller/api](https://ubntwiki.
 
 '''
 changelog:
+- Offline detection driven by an expiry heap, only examining clients that have been away
+- Client signals only emitted when changed, 'Last Present' emitted at a coarse (5 min) resolution
+- MAC to switch port index (switch MAC tables and client details), 'Locate MAC' action
 - Increased MAC address sanitization throughout the code
 - Fixed variable naming (global variable _lastReceive) 
 - Fixed label in network traffic display ("RX" to "TX" in second part of rates details)
@@ -96,6 +99,8 @@ _items_byID = { } # e.g. { '6131a8cc4b4aae0405d399a5': { 'id': '6131a8cc4b4aae04
                   #                                      'firstSeen': '2021-01-02...', 'timestamp': '2021....'
                   #                                      'rates': (14941, 9086,1239591,2015989), # tx_packets, rx_packets, tx_bytes, rx_bytes ... }          
 
+_portByMac = { } # e.g. { '3e:2f:b5:28:27:c2': ('70:a7:41:e5:d3:89', 3) } i.e. (switch MAC, port), from the switches' MAC tables and clients' own details
+
 _portOverrides = { } # e.g. { '3e:2f:b5:28:27:c2': [{"port_idx":2,"poe_mode":"auto"},{"poe_mode":"off","port_idx":3}]}}                  
 
 # List all switches on site by requesting an outline of all devices via 'stat/device-basic' API and parsing by device type.
@@ -149,6 +154,8 @@ def populateSwitchEvents(arg = None):
   if _activeSwitchStateByMac == None:
     return
   
+  portByMac = {}
+
   # iterate over all switches
   # example { ip=10.97.10.50, mac=70:a7:41:e5:d3:89, model=US624P, port_table=[{port_poe=true, ...}, ...], ... }
   for switch in _activeSwitchStateByMac['data']:
@@ -161,6 +168,13 @@ def populateSwitchEvents(arg = None):
     # get state of ports in port table
     for port in switch_port_table:
       port_id = port.get('port_idx')
+
+      # index MACs learnt on edge ports (uplinks see everything downstream)
+      if port.get('is_uplink') != True:
+        for entry in port.get('mac_table') or []: # e.g. [{mac=3e:2f:b5:28:27:c2, age=4, vlan=1, ...}, ...]
+          if entry.get('mac'):
+            portByMac[sanitiseMac(entry.get('mac'))] = (switch_mac, port_id)
+
       if port.get('port_poe') != True:
         continue # only interested in POE ports
         
@@ -185,6 +199,8 @@ def populateSwitchEvents(arg = None):
     # update port overrides
     _portOverrides[switch_mac] = switch.get('port_overrides')
 
+  _portByMac.update(portByMac)
+
 portOverrideQueue = dict() # holds the queue of API PUT calls to make for POE control
 
 def overrideSwitchPortState(switch_id, port_overrides):
@@ -302,7 +318,11 @@ def statSta():
   data = result['data']
     
   now = date_now()
-    
+  nowMillis = now.getMillis()
+
+  stats = { 'clients': len(data), 'emits': 0, 'unchanged': 0 }
+  ipsByPortKey = { } # all IPs seen on a switch port during this poll
+
   for item in data:
     id = item.get('_id')        
     hostname = item.get('hostname')
@@ -322,6 +342,12 @@ def statSta():
     oui = item.get('oui')
     sw_mac = sanitiseMac(item.get('sw_mac')) if item.get('sw_mac') else None
     sw_port = item.get('sw_port')
+
+    if sw_mac != None and sw_port != None:
+      _portByMac[mac] = (sw_mac, sw_port)
+    else:
+      # e.g. Wi-Fi or behind an unmanaged switch, use what the switches have learnt instead
+      sw_mac, sw_port = _portByMac.get(mac) or (None, None)
     
     wired_rx_bytes = item.get('wired-rx_bytes')
     if wired_rx_bytes:
@@ -400,76 +426,150 @@ def statSta():
 
     cache['detail'] = detail
     
-    key = 'IP %s' % mac
-    eIP = lookup_local_event(key)
-    if eIP == None:
-      # brand new so set up all related signals
-      eIP = create_local_event(key, { 'title': '%s IP (%s)' % (mac, u' • '.join(titleTags)), 
-                                             'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
-      
-      eLastPresent = create_local_event('%s Last Present' % mac, { 'title': '... Last Present', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
-      eLastMissing = create_local_event('%s Last Missing' % mac, { 'title': '... Last Missing', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
-      eLastRates = create_local_event('%s Last Rates' % mac, { 'title': '... Last Rates', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
-                          
-    eLastPresent = lookup_local_event('%s Last Present' % mac)
-    eLastMissing = lookup_local_event('%s Last Missing' % mac)
-    eLastRates = lookup_local_event('%s Last Rates' % mac)
+    signals = cache.get('signals')
+    if signals == None:
+      key = 'IP %s' % mac
+      eIP = lookup_local_event(key)
+      if eIP == None:
+        # brand new so set up all related signals
+        eIP = create_local_event(key, { 'title': '%s IP (%s)' % (mac, u' • '.join(titleTags)), 
+                                               'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
+        
+        eLastPresent = create_local_event('%s Last Present' % mac, { 'title': '... Last Present', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
+        eLastMissing = create_local_event('%s Last Missing' % mac, { 'title': '... Last Missing', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
+        eLastRates = create_local_event('%s Last Rates' % mac, { 'title': '... Last Rates', 'group': 'Network %s' % u' • '.join(groupTags), 'order': next_seq(), 'schema': { 'type': 'string' } })
+
+      # (resolved once, rather than every poll)
+      signals = (eIP, lookup_local_event('%s Last Present' % mac), lookup_local_event('%s Last Missing' % mac), lookup_local_event('%s Last Rates' % mac))
+      cache['signals'] = signals
+
+    eIP, eLastPresent, eLastMissing, eLastRates = signals
     
     if not prevOnline:
-      lastPresent = date_parse(eLastPresent.getArg())
       if SimpleName(mac) not in _ignoreSet_bySimpleMAC:
-        announce(u'APPEARED! • last offline for %s • %s' % (formatMillis(now.getMillis() - lastPresent.getMillis()), detail))
+        announce(u'APPEARED! • last offline for %s • %s' % (formatMillis(nowMillis - cache['lastPresent']), detail))
     
-    eIP.emit(ip)
-    eLastPresent.emit(str(now))
-    eLastRates.emit(ratesDetails)
+    # only emit what has actually changed; 'Last Present' is kept precisely here but emitted coarsely
+    emitIfChanged(eIP, ip, stats)
 
-    ipByPortKey = 'Switch %s Port %s IP' % (sw_mac, sw_port)
-    eIPbyPort = lookup_local_event(ipByPortKey)
-    if eIPbyPort == None:
-      sw_label = (getSwitchLabelByMAC(sw_mac) or 'Switch')
-      eIPbyPort = create_local_event(ipByPortKey, { 'title': 'Port %s IP' % sw_port, 'group': '%s %s - Client(s)' % (sw_label, sw_mac), 'order': sw_port, 'schema': { 'type': 'string' } })
-    
-    eIPbyPort.emit(ip)
+    if not prevOnline or nowMillis - cache.get('lastPresentEmitted', 0) >= LAST_PRESENT_RESOLUTION * 1000:
+      eLastPresent.emit(str(now))
+      cache['lastPresentEmitted'] = nowMillis
+      stats['emits'] += 1
+    else:
+      stats['unchanged'] += 1
+
+    cache['lastPresent'] = nowMillis
+    touchExpiry(cache, nowMillis)
+
+    emitIfChanged(eLastRates, ratesDetails, stats)
+
+    if sw_mac != None and sw_port != None:
+      ipByPortKey = 'Switch %s Port %s IP' % (sw_mac, sw_port)
+      ips = ipsByPortKey.get(ipByPortKey)
+      if ips == None:
+        ips = list()
+        ipsByPortKey[ipByPortKey] = ips
+
+        if lookup_local_event(ipByPortKey) == None:
+          sw_label = (getSwitchLabelByMAC(sw_mac) or 'Switch')
+          create_local_event(ipByPortKey, { 'title': 'Port %s IP' % sw_port, 'group': '%s %s - Client(s)' % (sw_label, sw_mac), 'order': sw_port, 'schema': { 'type': 'string' } })
+
+      ips.append(ip)
     
     if firstTime:
       # update this _after_ creation of the signal lookups to prevent race condition elsewhere
       _items_byID[id] = cache    
+
+  # several clients can share a port (e.g. unmanaged switch), so only change when the current one has gone
+  for ipByPortKey, ips in ipsByPortKey.iteritems():
+    eIPbyPort = lookup_local_event(ipByPortKey)
+    if eIPbyPort.getArg() in ips:
+      stats['unchanged'] += 1
+    else:
+      eIPbyPort.emit(sorted(ips)[0])
+      stats['emits'] += 1
+
+  local_event_ClientStats.emit(stats)
+
+def emitIfChanged(signal, value, stats):
+  if signal.getArg() == value:
+    stats['unchanged'] += 1
+  else:
+    signal.emit(value)
+    stats['emits'] += 1
+
+LAST_PRESENT_RESOLUTION = Time.MINUTE * 5 # 'Last Present' is only re-emitted this often while a client stays online
+
+local_event_ClientStats = LocalEvent({ 'group': 'Debug', 'order': 10000 + next_seq(), 'desc': 'Client signal emits for the last poll',
+                                       'schema': { 'type': 'object', 'properties': {
+                                         'clients': { 'type': 'integer', 'order': 1 },
+                                         'emits': { 'type': 'integer', 'order': 2 },
+                                         'unchanged': { 'type': 'integer', 'title': 'Unchanged (not emitted)', 'order': 3 } } } })
+
+@local_action({ 'title': 'Locate MAC (switch and port)', 'group': 'Operations', 'order': next_seq(), 'schema': { 'type': 'string' } })
+def locateMAC(arg):
+  mac = sanitiseMac(arg or '')
+  location = _portByMac.get(mac)
+
+  if location == None:
+    console.info('%s has not been seen on any switch port' % mac)
+  else:
+    console.info('%s is on %s %s port %s' % (mac, getSwitchLabelByMAC(location[0]) or 'Switch', location[0], location[1]))
   
 timer_pollStat = Timer(lambda: statSta.call(), 45, 5, stopped=True) # every 45 secs, first after 5, 
 
+OFFLINE_AFTER = Time.MINUTE * 5 # considered missing after being away this long
+
+import heapq
+
+_expiryHeap = [] # e.g. [ (1700000300000, '6131a8cc4b4aae0405d399a5'), ... ] i.e. (deadline epoch millis, id), one per client
+
+def touchExpiry(item, nowMillis):
+  # pushed once; when a client is seen again only its deadline moves and the heap entry catches up when it's popped
+  if item.get('deadline') == None:
+    heapq.heappush(_expiryHeap, (nowMillis + OFFLINE_AFTER * 1000, item['id']))
+    
+  item['deadline'] = nowMillis + OFFLINE_AFTER * 1000
+
 def offlineScan():
   now = date_now()
+  nowMillis = now.getMillis()
   
-  for id in _items_byID:
-    item = _items_byID[id]
-    mac = item['mac']
-    lastPresent = lookup_local_event('%s Last Present' % mac).getArg()
+  # only clients whose deadline has passed are examined
+  while len(_expiryHeap) > 0 and _expiryHeap[0][0] <= nowMillis:
+    deadline, id = heapq.heappop(_expiryHeap)
+    item = _items_byID.get(id)
     
-    if is_blank(lastPresent):
+    if item == None:
+      continue
+    
+    if item['deadline'] > nowMillis:
+      # seen since, so reschedule
+      heapq.heappush(_expiryHeap, (item['deadline'], id))
       continue
-      
-    lastPresent = date_parse(lastPresent)
     
-    if (now.getMillis() - lastPresent.getMillis()) > 5 * 60000: # been away for more than 5 mins
-      lastMissingSignal = lookup_local_event('%s Last Missing' % mac)
-      lastMissingSignalArg = lastMissingSignal.getArg()
+    # been away for more than 5 mins
+    mac = item['mac']
+    
+    lastMissingSignal = item['signals'][2]
+    lastMissingSignalArg = lastMissingSignal.getArg()
 
-      lastMissingSignal.emit(str(now))
+    lastMissingSignal.emit(str(now))
       
-      if lastMissingSignalArg == None: # use first found
-        prevLastMissing = item['firstFound']
-      else:
+    if item['online']:
+      # flipped to missing
+      if lastMissingSignalArg != None:
         prevLastMissing = date_parse(lastMissingSignalArg)
-        
-      if item['online']:
-        # flipped to missing
-        if lastMissingSignalArg != None:
           
-          if SimpleName(mac) not in _ignoreSet_bySimpleMAC:
-            announce(u'DISAPPEARED! • last online for %s • %s' % (formatMillis(now.getMillis() - prevLastMissing.getMillis()), item['detail']))
+        if SimpleName(mac) not in _ignoreSet_bySimpleMAC:
+          announce(u'DISAPPEARED! • last online for %s • %s' % (formatMillis(nowMillis - prevLastMissing.getMillis()), item['detail']))
         
-        item['online'] = False
+      item['online'] = False
+    
+    # while still missing, 'Last Missing' is refreshed as coarsely as 'Last Present'
+    item['deadline'] = nowMillis + LAST_PRESENT_RESOLUTION * 1000
+    heapq.heappush(_expiryHeap, (item['deadline'], id))
       
 timer_offlineScan = Timer(offlineScan, 120) # every 2 mins       
   